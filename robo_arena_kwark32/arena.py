@@ -1,4 +1,5 @@
 import random
+import threading
 import effects
 import powerups
 
@@ -9,23 +10,32 @@ from os import path
 from globals import GameInfo
 from camera import CameraState
 from util import Vector, painter_transform_with_rot, is_object_on_screen
+from path_graph import PathGraph
 from constants import MAX_POWER_UP_ITER, TILES_PER_POWER_UP, TILE_ANIM_GROUP_SIZE
 
 if not GameInfo.is_headless:
     from PyQt5.QtGui import QPixmap, QPainter
 
 
+# modification time, cost grids, lists & path graphs of loaded maps (see Arena.build_path_costs) by map file,
+# only the latest modification time of each map is kept
+_path_cost_cache = {}
+
 tile_texture_path = path.join("textures", "static_tiles")
 animated_tiles_texture_path = path.join("textures", "animated_tiles")
 
 
 class TileType:
     """Holds information about the different tile types."""
-    def __init__(self, name, has_collision=False, effect_class=None, has_animation=False):
+    def __init__(self, name, has_collision=False, effect_class=None, has_animation=False, path_cost=1,
+                 low_health_path_cost=None):
         self.name = name
         self.has_collision = has_collision
         self.effect_class = effect_class
         self.has_animation = has_animation
+        # AI pathfinding cost of driving onto the tile (-1 = blocked), below half health if given
+        self.path_cost = -1 if has_collision else path_cost
+        self.low_health_path_cost = self.path_cost if low_health_path_cost is None else low_health_path_cost
         self._texture = None
         self._texture_size = None
 
@@ -54,14 +64,14 @@ class TileType:
 tile_type_dict = {
     "ground": TileType("ground"),
     "wall": TileType("wall", has_collision=True),
-    "earth": TileType("earth", effect_class=effects.EarthTileEffect),
+    "earth": TileType("earth", effect_class=effects.EarthTileEffect, path_cost=2),
     "tower_1": TileType("tower_1", has_collision=True),
-    "hole": TileType("hole", effect_class=effects.HoleTileEffect),
-    "water": TileType("water", effect_class=effects.WaterTileEffect),
-    "lava": TileType("lava", effect_class=effects.LavaTileEffect),
-    "fire": TileType("fire", effect_class=effects.FireTileEffect, has_animation=True),
-    "portal_1": TileType("portal_1", effect_class=effects.Portal1TileEffect, has_animation=True),
-    "portal_2": TileType("portal_2", effect_class=effects.Portal2TileEffect, has_animation=True),
+    "hole": TileType("hole", effect_class=effects.HoleTileEffect, path_cost=-1),
+    "water": TileType("water", effect_class=effects.WaterTileEffect, path_cost=4, low_health_path_cost=15),
+    "lava": TileType("lava", effect_class=effects.LavaTileEffect, path_cost=26),
+    "fire": TileType("fire", effect_class=effects.FireTileEffect, has_animation=True, path_cost=4),
+    "portal_1": TileType("portal_1", effect_class=effects.Portal1TileEffect, has_animation=True, path_cost=15),
+    "portal_2": TileType("portal_2", effect_class=effects.Portal2TileEffect, has_animation=True, path_cost=15),
 }
 
 
@@ -80,6 +90,12 @@ class Arena:
         self._tile_anim_group_count = Vector(0, 0)
 
         self._portal_tiles = None
+        self._tile_effect_classes = None
+        self._collision_grid = None
+        self._path_cost_grids = None
+        self._path_cost_lists = None
+        self._path_graphs = None
+        self._path_graph_lock = None
 
         self.background_pixmap = None
 
@@ -102,6 +118,64 @@ class Arena:
         # get array of empty tiles with correct dimensions
         return np.empty((self.tile_count.y, self.tile_count.x), dtype=TileType)
 
+    def get_collision_grid(self):
+        """Returns which tiles have collision as bool array, to test many positions against the walls at once."""
+        if self._collision_grid is None:
+            has_collision = np.frompyfunc(lambda tile_type: tile_type.has_collision, 1, 1)
+            self._collision_grid = has_collision(self.tiles).astype(bool)
+        return self._collision_grid
+
+    def build_path_costs(self, cache_key=None, cache_version=None):
+        """Precomputes the AI pathfinding cost grids (healthy & below half health), see TileType.path_cost.
+        Arenas of the same cache key & version share them & their path graphs (built on first use,
+        see get_path_graph). A new version of a cache key replaces the cached one."""
+        cached = _path_cost_cache.get(cache_key)
+        if cached is not None and cached[0] == cache_version:
+            _, self._path_cost_grids, self._path_cost_lists, self._path_graphs, self._path_graph_lock = cached
+            return
+
+        path_cost = np.frompyfunc(lambda tile_type: tile_type.path_cost, 1, 1)
+        low_health_path_cost = np.frompyfunc(lambda tile_type: tile_type.low_health_path_cost, 1, 1)
+        self._path_cost_grids = (path_cost(self.tiles).astype(np.int32),
+                                 low_health_path_cost(self.tiles).astype(np.int32))
+        # flat Python lists (indexed by y * width + x) for the per tile reads of the pathfinder
+        self._path_cost_lists = tuple(grid.ravel().tolist() for grid in self._path_cost_grids)
+        self._path_graphs = [None, None]
+        self._path_graph_lock = threading.Lock()  # shared by the arenas sharing the path graphs
+        if cache_key is not None:
+            _path_cost_cache[cache_key] = (cache_version, self._path_cost_grids, self._path_cost_lists,
+                                           self._path_graphs, self._path_graph_lock)
+
+    def get_path_cost_grid(self, low_health=False):
+        """Returns the pathfinding cost of every tile as NumPy array (-1 = blocked)."""
+        if self._path_cost_grids is None:
+            self.build_path_costs()
+        return self._path_cost_grids[1 if low_health else 0]
+
+    def get_path_costs(self, low_health=False):
+        """Returns the pathfinding cost of every tile as flat list, indexed by y * width + x (-1 = blocked)."""
+        if self._path_cost_lists is None:
+            self.build_path_costs()
+        return self._path_cost_lists[1 if low_health else 0]
+
+    def get_path_graph(self, low_health=False):
+        """Returns the hierarchical pathfinding graph of the tile costs, see PathGraph.
+        Building it takes about 150 ms on big arenas, so it's only called by the path planner's worker threads."""
+        if self._path_graphs is None:
+            self.build_path_costs()
+        index = 1 if low_health else 0
+        with self._path_graph_lock:
+            if self._path_graphs[index] is None:
+                self._path_graphs[index] = PathGraph(self._path_cost_lists[index], self.tile_count.x,
+                                                     self.tile_count.y)
+            return self._path_graphs[index]
+
+    def get_tile_effect_classes(self):
+        """Returns the effect class (or None) of every tile, to look up the tiles of many positions at once."""
+        if self._tile_effect_classes is None:
+            self._tile_effect_classes = np.frompyfunc(lambda tile_type: tile_type.effect_class, 1, 1)(self.tiles)
+        return self._tile_effect_classes
+
     # get different portal tiles for portal tile effects
     def get_portal_tiles(self):
         """Creates list of two lists with portal_1 and portal_2 tiles."""
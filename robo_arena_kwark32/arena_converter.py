@@ -7,7 +7,7 @@ from os import path
 from PIL import Image
 from arena import Arena, tile_type_dict
 from util import Vector, get_data_path
-from constants import MAP_FORMAT_VERSION
+from constants import MAP_FORMAT_VERSION, WALL_CATEGORY
 from globals import GameInfo
 from animation import Animation
 
@@ -54,15 +54,18 @@ def add_physics(arena, physics_world):
                 height = GameInfo.arena_tile_size * y_count
                 x_pos = x * GameInfo.arena_tile_size + int(width / 2)
                 y_pos = y * GameInfo.arena_tile_size + int(height / 2)
-                physics_world.add_rect(Vector(x_pos, y_pos), width, height, user_data=tile_type)
+                physics_world.add_rect(Vector(x_pos, y_pos), width, height, user_data=tile_type,
+                                       category_bits=WALL_CATEGORY)
 
 
 def load_map(file, physics_world=None):
     """Creates arena from json or png file, calling the respective sub-method."""
     if file.endswith("json"):
-        arena = load_map_json(path.join(json_map_path, file))
+        file_path = path.join(json_map_path, file)
+        arena = load_map_json(file_path)
     elif file.endswith("png"):
-        arena = load_map_png(path.join(png_map_path, file))
+        file_path = path.join(png_map_path, file)
+        arena = load_map_png(file_path)
     else:
         return None
 
@@ -81,6 +84,7 @@ def load_map(file, physics_world=None):
                     arena.tile_animations.append(anim)
         arena.calc_tile_anim_groups()
 
+    arena.build_path_costs(cache_key=file_path, cache_version=path.getmtime(file_path))
     if physics_world is not None:
         add_physics(arena, physics_world)
 
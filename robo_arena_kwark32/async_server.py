@@ -0,0 +1,96 @@
+import asyncio
+
+from networking import ServerSocket
+
+
+class ServerDatagramProtocol(asyncio.DatagramProtocol):
+    """Forwards datagrams received by the event loop to the server socket's fragment buffer."""
+    def __init__(self, server_socket):
+        self.server_socket = server_socket
+
+    def datagram_received(self, data, addr):
+        self.server_socket.add_datagram(data, addr)
+
+    def error_received(self, exc):
+        pass  # ICMP errors of earlier sends, UDP is unreliable anyway
+
+
+class AsyncServerSocket(ServerSocket):
+    """Server socket driven by an asyncio transport, which reads datagrams as they arrive
+    and buffers sends instead of dropping them."""
+    def __init__(self):
+        super().__init__()
+        self.transport = None
+
+    def connect_transport(self, loop):
+        """Creates the datagram transport on the already bound socket."""
+        self.transport, protocol = loop.run_until_complete(loop.create_datagram_endpoint(
+            lambda: ServerDatagramProtocol(self), sock=self.udp_socket))
+
+    def receive_datagrams(self):
+        pass  # the transport's protocol adds datagrams as soon as they arrive
+
+    def flush(self):
+        if self.transport is None:
+            super().flush()
+            return
+        for datagram, address in self.send_queue:
+            self.transport.sendto(datagram, address)
+        self.send_queue.clear()
+
+    def close(self):
+        if self.transport is None:
+            super().close()
+        else:
+            self.transport.close()
+
+
+class AsyncServerLoop:
+    """Main loop for headless server world sims on an asyncio event loop, with fixed frames run by loop timers.
+    Other async tasks can be added to the same process via the loop."""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.world_sims = []
+        self.update_handles = {}  # world sim -> timer handle of its next update
+        self.server_sockets = []  # all server sockets ever used, to log their metrics when the loop ends
+        self.error = None  # exception raised in a timer callback, re-raised by run
+
+    def add_world_sim(self, world_sim):
+        server_socket = world_sim.udp_socket.server_socket
+        if server_socket.transport is None:
+            server_socket.connect_transport(self.loop)
+        if server_socket not in self.server_sockets:
+            self.server_sockets.append(server_socket)
+        self.world_sims.append(world_sim)
+        self.schedule_update(world_sim)
+
+    def remove_world_sim(self, world_sim):
+        self.update_handles.pop(world_sim).cancel()
+        self.world_sims.remove(world_sim)
+        if not self.world_sims:
+            self.loop.stop()
+
+    def schedule_update(self, world_sim):
+        delay_ns = max(0, world_sim.get_time_until_fixed_update_ns())
+        self.update_handles[world_sim] = self.loop.call_later(delay_ns / 1000000000, self.update, world_sim)
+
+    def update(self, world_sim):
+        try:
+            world_sim.update_world()
+        except Exception as e:
+            # asyncio would only log it, leaving the server running without updates
+            self.error = e
+            self.loop.stop()
+            return
+        if world_sim in self.update_handles:
+            self.schedule_update(world_sim)
+
+    def run(self):
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+            for server_socket in self.server_sockets:
+                server_socket.print_metrics("Server socket")
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,108 @@
+import time
+import random
+
+import numpy as np
+
+from world_sim import SPWorldSim
+from body_store import BodyStore, step_body_views, ROBOT_ROW_SIZE, ROBOT_HEALTH, POSITION_X, ROTATION, VELOCITY_X
+from sound_manager import SoundManager, HeadlessSound
+from globals import GameInfo
+from constants import FIXED_DELTA_TIME
+
+
+class BatchSPWorldSim(SPWorldSim):
+    """Singleplayer world of a batch environment, without highscores & game over menu."""
+    def __init__(self, seed=None, robot_store=None):
+        if seed is not None:
+            random.seed(seed)  # for the first enemy, spawned before the first frame seed
+        super().__init__(robot_store=robot_store)
+
+        self.saves_highscore = False
+        if seed is not None:
+            self.world_start_time_ns = seed
+
+    @property
+    def is_over(self):
+        return self.player_die_frame is not None
+
+
+class BatchSPEnv:
+    """Steps many independent singleplayer worlds in lockstep in one process, e.g. for AI tuning.
+    All worlds share one robot store, so the robot bodies of all worlds are stepped at once with NumPy
+    directly on the store & the tiles under all robots are looked up at once,
+    only the controls (input, AI, effects), Box2D physics & collisions run per world.
+    Unlike a single world's fixed update, the robots' AI sees the other robots at their positions
+    from the start of the frame, as all bodies are stepped after all controls."""
+    def __init__(self, world_count, seed=None):
+        if SoundManager.instance is None:
+            SoundManager.instance = HeadlessSound()
+        if seed is None:
+            seed = time.time_ns()
+        self.robot_store = BodyStore(ROBOT_ROW_SIZE)
+        self.worlds = [BatchSPWorldSim(seed=seed + i, robot_store=self.robot_store) for i in range(world_count)]
+        self.random_states = [None] * world_count
+
+    @property
+    def player_inputs(self):
+        """The PlayerInput of every world's player, to be set before each step."""
+        return [world.player_input for world in self.worlds]
+
+    def get_tile_infos(self):
+        """Looks up the (tile position, tile effect class) under all living robots of all worlds at once."""
+        robots = [robot for world in self.worlds for robot in world.robots if not robot.is_dead]
+        if not robots:
+            return {}
+        positions = self.robot_store.array[[robot.sim_body.slot for robot in robots], POSITION_X:POSITION_X + 2]
+        tile_positions = (positions / GameInfo.arena_tile_size).astype(np.int64)  # truncated like Vector.floor
+        tile_count = self.worlds[0].arena.tile_count  # all worlds have the same map
+        center_tiles = tile_positions.copy()
+        np.clip(center_tiles[:, 0], 0, tile_count.x - 1, out=center_tiles[:, 0])
+        np.clip(center_tiles[:, 1], 0, tile_count.y - 1, out=center_tiles[:, 1])
+        effect_classes = self.worlds[0].arena.get_tile_effect_classes()[center_tiles[:, 1], center_tiles[:, 0]]
+        return {robot: (tuple(tile_position), effect_class)
+                for robot, tile_position, effect_class in zip(robots, tile_positions.tolist(), effect_classes)}
+
+    def fixed_update(self, delta_time):
+        tile_infos = self.get_tile_infos()
+
+        stepped_robots = []
+        for i, world in enumerate(self.worlds):
+            world.set_seed()
+            world.update_enemy_spawning()
+            world.begin_fixed_update(delta_time, catchup_frame=True)
+            for robot in world.robots:
+                if not robot.interpolated and robot.update_controls(delta_time, tile_infos.get(robot)):
+                    stepped_robots.append(robot)
+            self.random_states[i] = random.getstate()  # so each world keeps its own random sequence
+
+        step_body_views([robot.sim_body for robot in stepped_robots], delta_time)
+        for robot in stepped_robots:
+            robot.update_from_body()
+
+        for i, world in enumerate(self.worlds):
+            random.setstate(self.random_states[i])
+            world.end_fixed_update(delta_time)
+            world.update_game_over()
+
+    def step(self, frame_count=1):
+        """Advances all worlds frame_count fixed frames back to back, without sleeping or reading the clock."""
+        for i in range(frame_count):
+            self.fixed_update(FIXED_DELTA_TIME)
+        for world in self.worlds:
+            world.curr_world_time_ns = world.physics_world_time_ns
+            world.curr_time_ns = world.world_start_time_ns + world.curr_world_time_ns
+
+    def get_robot_states(self):
+        """Returns the state of all robots of all worlds as arrays:
+        world index, robot ID, position (n x 2), rotation, velocity (n x 2), health."""
+        robots = [(world_index, robot.robot_id, robot.sim_body.slot)
+                  for world_index, world in enumerate(self.worlds) for robot in world.robots]
+        ids = np.array(robots, dtype=np.int32).reshape(-1, 3)
+        values = self.robot_store.array[ids[:, 2]]  # the robot bodies are at the start of the rows (ROBOT_BODY)
+        return (ids[:, 0], ids[:, 1], values[:, POSITION_X:POSITION_X + 2], values[:, ROTATION],
+                values[:, VELOCITY_X:VELOCITY_X + 2], values[:, ROBOT_HEALTH])
+
+    def clean_mem(self):
+        for world in self.worlds:
+            world.clean_mem()
+        self.worlds.clear()
@@ -0,0 +1,215 @@
+import sys
+import errno
+import socket
+import struct
+import ctypes
+import ctypes.util
+
+from globals import GameInfo
+from constants import DATAGRAM_BATCH_SIZE
+
+
+class DatagramIO:
+    """Sends & receives batches of datagrams on non-blocking UDP sockets, one syscall per datagram."""
+    def __init__(self, batch_size=DATAGRAM_BATCH_SIZE, buffer_size=None):
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        if self.buffer_size is None:
+            self.buffer_size = GameInfo.buffer_size
+
+        # Metrics
+        self.send_errors = 0
+        self.receive_errors = 0
+
+    def count_send_error(self, error):
+        """Counts a datagram that could not be sent (e.g. too large or unreachable client), which is skipped."""
+        self.send_errors += 1
+        print("WARN: Could not send datagram: " + str(error))
+
+    def count_receive_error(self, error):
+        self.receive_errors += 1
+        print("WARN: Could not receive datagrams: " + str(error))
+
+    def send(self, sock, datagrams):
+        """Sends a list of (datagram, address), returning how many were sent (or skipped on errors)
+        before the send buffer was full."""
+        for i, (datagram, address) in enumerate(datagrams):
+            try:
+                sock.sendto(datagram, address)
+            except BlockingIOError:
+                return i
+            except OSError as e:
+                self.count_send_error(e)
+        return len(datagrams)
+
+    def receive(self, sock):
+        """Receives up to batch size waiting datagrams as a list of (datagram, address)."""
+        datagrams = []
+        while len(datagrams) < self.batch_size:
+            try:
+                datagrams.append(sock.recvfrom(self.buffer_size))
+            except BlockingIOError:
+                break
+            except ConnectionResetError:  # ICMP port unreachable of an earlier send (Windows)
+                continue
+            except OSError as e:
+                self.count_receive_error(e)
+                break
+        return datagrams
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class SockAddrIn(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_uint8 * 4), ("sin_zero", ctypes.c_uint8 * 8)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(IOVec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t), ("msg_flags", ctypes.c_int)]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def load_libc_mmsg():
+    """Returns libc if it has sendmmsg & recvmmsg (Linux), else None."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+libc_mmsg = load_libc_mmsg()
+MSG_DONTWAIT = 0x40
+MAX_CACHED_ADDRESSES = 4096
+
+# native layouts of the fields written/read per datagram, packed directly into the header arrays
+IOVEC = struct.Struct("@PN")
+POINTER = struct.Struct("@P")
+MSG_LEN = struct.Struct("@I")
+SOCK_ADDR_PORT_IP = struct.Struct(">2xH4s")
+
+
+class MMsgDatagramIO(DatagramIO):
+    """Sends & receives batches of datagrams with a single sendmmsg/recvmmsg syscall (Linux, IPv4 only).
+    The per datagram fields are written with struct into bytearray backed ctypes arrays,
+    as setting ctypes fields one by one costs more than the saved syscalls."""
+    def __init__(self, batch_size=DATAGRAM_BATCH_SIZE, buffer_size=None):
+        super().__init__(batch_size=batch_size, buffer_size=buffer_size)
+        self.send_iovec_bytes, self.send_iovecs = self.create_array(IOVec)
+        self.send_header_bytes, self.send_headers = self.create_headers(self.send_iovecs)
+        self.socket_addresses = {}  # (host, port) -> (SockAddrIn, its address)
+
+        self.receive_buffers = bytearray(batch_size * self.buffer_size)
+        self.receive_buffers_view = memoryview(self.receive_buffers)
+        self.receive_address_bytes, self.receive_addresses = self.create_array(SockAddrIn)
+        self.receive_iovec_bytes, self.receive_iovecs = self.create_array(IOVec)
+        self.receive_header_bytes, self.receive_headers = self.create_headers(self.receive_iovecs)
+        buffers = (ctypes.c_char * len(self.receive_buffers)).from_buffer(self.receive_buffers)
+        buffers_address = ctypes.addressof(buffers)
+        for i in range(batch_size):
+            self.receive_iovecs[i].iov_base = buffers_address + i * self.buffer_size
+            self.receive_iovecs[i].iov_len = self.buffer_size
+            header = self.receive_headers[i].msg_hdr
+            header.msg_name = ctypes.addressof(self.receive_addresses[i])
+            header.msg_namelen = ctypes.sizeof(SockAddrIn)  # stays the same, all senders are IPv4
+        self.received_addresses = {}  # packed port & IP -> (host, port)
+
+    def create_array(self, struct_type):
+        array_bytes = bytearray(ctypes.sizeof(struct_type) * self.batch_size)
+        return array_bytes, (struct_type * self.batch_size).from_buffer(array_bytes)
+
+    def create_headers(self, iovecs):
+        header_bytes, headers = self.create_array(MMsgHdr)
+        for i in range(self.batch_size):
+            headers[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+            headers[i].msg_hdr.msg_iovlen = 1
+            headers[i].msg_hdr.msg_namelen = ctypes.sizeof(SockAddrIn)
+        return header_bytes, headers
+
+    def get_socket_address(self, address):
+        """Returns the memory address of the cached sockaddr_in of a (host, port) address.
+        The cache is only evicted by send between batches, as the headers point into the cached structs."""
+        cached = self.socket_addresses.get(address)
+        if cached is None:
+            host, port = address
+            socket_address = SockAddrIn(socket.AF_INET, socket.htons(port))
+            ctypes.memmove(socket_address.sin_addr, socket.inet_aton(socket.gethostbyname(host)), 4)
+            cached = (socket_address, ctypes.addressof(socket_address))
+            self.socket_addresses[address] = cached
+        return cached[1]
+
+    def send(self, sock, datagrams):
+        iovec_size = IOVec.iov_len.offset + ctypes.sizeof(ctypes.c_size_t)
+        header_size = ctypes.sizeof(MMsgHdr)
+        name_offset = MsgHdr.msg_name.offset
+
+        sent = 0
+        while sent < len(datagrams):
+            count = min(len(datagrams) - sent, self.batch_size)
+            batch = datagrams[sent:sent + count]
+            if len(self.socket_addresses) + count > MAX_CACHED_ADDRESSES:
+                self.socket_addresses.clear()  # before packing, so the batch's sockaddr_ins stay alive
+            data = b"".join([datagram for datagram, address in batch])  # one buffer to point all iovecs into
+            data_address = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+            offset = 0
+            for i, (datagram, address) in enumerate(batch):
+                IOVEC.pack_into(self.send_iovec_bytes, i * iovec_size, data_address + offset, len(datagram))
+                POINTER.pack_into(self.send_header_bytes, i * header_size + name_offset,
+                                  self.get_socket_address(address))
+                offset += len(datagram)
+
+            result = libc_mmsg.sendmmsg(sock.fileno(), self.send_headers, count, 0)
+            if result < 0:
+                error = ctypes.get_errno()
+                if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                # sendmmsg only fails if the first datagram of the batch can't be sent, skip it
+                self.count_send_error(OSError(error, "sendmmsg: " + errno.errorcode.get(error, str(error))))
+                result = 1
+            sent += result
+        return sent
+
+    def receive(self, sock):
+        count = libc_mmsg.recvmmsg(sock.fileno(), self.receive_headers, self.batch_size, MSG_DONTWAIT, None)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.count_receive_error(OSError(error, "recvmmsg: " + errno.errorcode.get(error, str(error))))
+            return []
+
+        header_size = ctypes.sizeof(MMsgHdr)
+        msg_len_offset = MMsgHdr.msg_len.offset
+        address_size = ctypes.sizeof(SockAddrIn)
+        datagrams = []
+        for i in range(count):
+            length, = MSG_LEN.unpack_from(self.receive_header_bytes, i * header_size + msg_len_offset)
+            packed_address = bytes(self.receive_address_bytes[i * address_size + 2:i * address_size + 8])
+            address = self.received_addresses.get(packed_address)
+            if address is None:
+                if len(self.received_addresses) >= MAX_CACHED_ADDRESSES:
+                    self.received_addresses.clear()
+                port, ip = SOCK_ADDR_PORT_IP.unpack_from(self.receive_address_bytes, i * address_size)
+                address = (socket.inet_ntoa(ip), port)
+                self.received_addresses[packed_address] = address
+            start = i * self.buffer_size
+            datagrams.append((bytes(self.receive_buffers_view[start:start + length]), address))
+        return datagrams
+
+
+def create_datagram_io(sock):
+    """Returns the batched datagram IO for the socket, using sendmmsg/recvmmsg where available."""
+    if GameInfo.use_mmsg and libc_mmsg is not None and sock.family == socket.AF_INET:
+        return MMsgDatagramIO()
+    return DatagramIO()
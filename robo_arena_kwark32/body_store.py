@@ -0,0 +1,355 @@
+import math
+
+import numpy as np
+
+from transform import SimpleBody, SimBody, integrate_sim_body_values
+from util import Vector, limit, limit_rot
+from constants import BODY_STORE_CAPACITY
+
+
+# Value offsets of a SimpleBody in a store row
+POSITION_X = 0
+POSITION_Y = 1
+ROTATION = 2
+SIMPLE_LOCAL_VELOCITY_X = 3
+SIMPLE_LOCAL_VELOCITY_Y = 4
+SIMPLE_BODY_FIELDS = 5
+
+# Value offsets of a SimBody in a store row, in the column order of integrate_sim_body_values
+VELOCITY_X = 3
+VELOCITY_Y = 4
+ACCEL_X = 5
+ACCEL_Y = 6
+LOCAL_VELOCITY_X = 7
+LOCAL_VELOCITY_Y = 8
+LOCAL_ACCEL_X = 9
+LOCAL_ACCEL_Y = 10
+ANG_VELOCITY = 11
+ANG_ACCEL = 12
+MAX_VELOCITY = 13
+MAX_ANG_VELOCITY = 14
+MAX_ACCEL = 15
+MAX_ANG_ACCEL = 16
+SIM_BODY_FIELDS = 17
+
+# Robot rows: body, extrapolation body & health
+ROBOT_BODY = 0
+ROBOT_EXTRAPOLATION_BODY = SIM_BODY_FIELDS
+ROBOT_HEALTH = 2 * SIM_BODY_FIELDS
+ROBOT_ROW_SIZE = ROBOT_HEALTH + 1
+
+# Bullet rows: body, extrapolation body & collider (offset along the bullet, half width & half height)
+BULLET_BODY = 0
+BULLET_EXTRAPOLATION_BODY = SIMPLE_BODY_FIELDS
+BULLET_COLLIDER_OFFSET = 2 * SIMPLE_BODY_FIELDS
+BULLET_COLLIDER_HALF_WIDTH = BULLET_COLLIDER_OFFSET + 1
+BULLET_COLLIDER_HALF_HEIGHT = BULLET_COLLIDER_OFFSET + 2
+BULLET_ROW_SIZE = BULLET_COLLIDER_OFFSET + 3
+
+
+class BodyStore:
+    """Structure of arrays store of the kinematic state of all robots or all bullets of a world,
+    one row of float64 values per entity slot. The bodies of the entities are views onto their row,
+    so all bodies can be stepped & snapshotted at once with NumPy (array), while single values are read
+    & written as Python floats (values, a flat memoryview of the same memory)."""
+    def __init__(self, row_size, capacity=BODY_STORE_CAPACITY):
+        self.row_size = row_size
+        self.array = np.zeros((max(capacity, 1), row_size), dtype=np.float64)
+        self.values = memoryview(self.array.reshape(-1))
+        self.slot_count = 0  # slots ever allocated, all rows after them are unused
+        self.free_slots = []
+
+    def grow(self, capacity):
+        array = np.zeros((capacity, self.row_size), dtype=np.float64)
+        array[:self.slot_count] = self.array[:self.slot_count]
+        self.array = array
+        self.values = memoryview(self.array.reshape(-1))
+
+    def allocate(self):
+        """Returns a free slot with all values zeroed."""
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.array[slot] = 0
+            return slot
+        if self.slot_count >= len(self.array):
+            self.grow(len(self.array) * 2)
+        self.slot_count += 1
+        return self.slot_count - 1
+
+    def free(self, slot):
+        self.free_slots.append(slot)
+
+    def detach(self, slot, bodies):
+        """Frees the slot of a removed entity, moving its values to a store of their own for the bodies,
+        so references left to the entity keep its last state instead of the slot's next entity."""
+        store = BodyStore(self.row_size, capacity=1)
+        store.array[0] = self.array[slot]
+        store.slot_count = 1
+        for body in bodies:
+            body.bind(store, 0)
+        self.free(slot)
+
+    def snapshot(self):
+        """Returns a copy of all rows, e.g. to roll the world's bodies back later with restore."""
+        return self.array[:self.slot_count].copy()
+
+    def restore(self, snapshot):
+        self.array[:len(snapshot)] = snapshot
+
+
+class VectorView(Vector):
+    """Vector whose x & y are two values of a BodyStore, so in place changes write through to the store."""
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self._x_for_mag = 0
+        self._y_for_mag = 0
+        self._mag = 0
+
+    @property
+    def x(self):
+        return self.store.values[self.index]
+
+    @x.setter
+    def x(self, value):
+        self.store.values[self.index] = value
+
+    @property
+    def y(self):
+        return self.store.values[self.index + 1]
+
+    @y.setter
+    def y(self, value):
+        self.store.values[self.index + 1] = value
+
+
+def value_property(field):
+    """Property of a body view for a single value of its row."""
+    def get_value(self):
+        return self.store.values[self.index + field]
+
+    def set_value(self, value):
+        self.store.values[self.index + field] = value
+    return property(get_value, set_value)
+
+
+def vector_property(field):
+    """Property of a body view for a vector of its row, assigning copies the x & y values into the store."""
+    def get_vector(self):
+        return self.vector_views[field]
+
+    def set_vector(self, value):
+        values = self.store.values
+        index = self.index + field
+        values[index] = value.x
+        values[index + 1] = value.y
+    return property(get_vector, set_vector)
+
+
+class BodyView:
+    """Binding of a body view to its row in a BodyStore (at the offset of the body in the row)."""
+    vector_fields = ()
+
+    def init_view(self, store, slot, offset):
+        self.offset = offset
+        self.vector_views = {field: VectorView(store, 0) for field in self.vector_fields}
+        self.bind(store, slot)
+
+    def bind(self, store, slot):
+        self.store = store
+        self.slot = slot
+        self.row = slot * store.row_size
+        self.index = self.row + self.offset
+        for field, view in self.vector_views.items():
+            view.store = store
+            view.index = self.index + field
+
+
+class SimpleBodyView(BodyView, SimpleBody):
+    """SimpleBody whose values are stored in a row of a BodyStore."""
+    vector_fields = (POSITION_X, SIMPLE_LOCAL_VELOCITY_X)
+
+    position = vector_property(POSITION_X)
+    rotation = value_property(ROTATION)
+    local_velocity = vector_property(SIMPLE_LOCAL_VELOCITY_X)
+
+    def __init__(self, store, slot, offset=0, position=Vector(0, 0), rotation=0):
+        self.init_view(store, slot, offset)
+        super().__init__(position=position, rotation=rotation)
+
+    def set(self, other):
+        if isinstance(other, SimpleBodyView):
+            self.store.values[self.index:self.index + SIMPLE_BODY_FIELDS] = \
+                other.store.values[other.index:other.index + SIMPLE_BODY_FIELDS]
+        else:
+            super().set(other)
+
+    def set_tuples(self, other):
+        values = self.store.values
+        index = self.index
+        values[index + POSITION_X], values[index + POSITION_Y] = other.position
+        values[index + ROTATION] = other.rotation
+        values[index + SIMPLE_LOCAL_VELOCITY_X], values[index + SIMPLE_LOCAL_VELOCITY_Y] = other.local_velocity
+
+    def step(self, delta_time):
+        """SimpleBody.step on the stored values, without any temporary Vectors."""
+        if self._was_reset:
+            self._was_reset = True
+            return
+
+        values = self.store.values
+        index = self.index
+        local_vx = values[index + SIMPLE_LOCAL_VELOCITY_X]
+        local_vy = values[index + SIMPLE_LOCAL_VELOCITY_Y]
+        rotation = values[index + ROTATION]
+        values[index + POSITION_X] += (local_vx * math.cos(rotation) - local_vy * math.sin(rotation)) * delta_time
+        values[index + POSITION_Y] += (local_vx * math.sin(rotation) + local_vy * math.cos(rotation)) * delta_time
+
+
+class SimBodyView(BodyView, SimBody):
+    """SimBody whose values are stored in a row of a BodyStore."""
+    vector_fields = (POSITION_X, VELOCITY_X, ACCEL_X, LOCAL_VELOCITY_X, LOCAL_ACCEL_X)
+
+    position = vector_property(POSITION_X)
+    rotation = value_property(ROTATION)
+    velocity = vector_property(VELOCITY_X)
+    accel = vector_property(ACCEL_X)
+    local_velocity = vector_property(LOCAL_VELOCITY_X)
+    local_accel = vector_property(LOCAL_ACCEL_X)
+    ang_velocity = value_property(ANG_VELOCITY)
+    ang_accel = value_property(ANG_ACCEL)
+    max_velocity = value_property(MAX_VELOCITY)
+    max_ang_velocity = value_property(MAX_ANG_VELOCITY)
+    max_accel = value_property(MAX_ACCEL)
+    max_ang_accel = value_property(MAX_ANG_ACCEL)
+
+    def __init__(self, store, slot, offset=0, position=Vector(0, 0), rotation=0, max_velocity=0,
+                 max_ang_velocity=0, max_accel=0, max_ang_accel=0):
+        self.init_view(store, slot, offset)
+        super().__init__(position=position, rotation=rotation, max_velocity=max_velocity,
+                         max_ang_velocity=max_ang_velocity, max_accel=max_accel, max_ang_accel=max_ang_accel)
+
+    def as_tuples(self):
+        (x, y, rotation, vx, vy, ax, ay, local_vx, local_vy, local_ax, local_ay, ang_velocity, ang_accel,
+         max_velocity, max_ang_velocity, max_accel, max_ang_accel) = \
+            self.store.values[self.index:self.index + SIM_BODY_FIELDS].tolist()
+        body = SimBody(rotation=rotation, max_velocity=max_velocity, max_ang_velocity=max_ang_velocity,
+                       max_accel=max_accel, max_ang_accel=max_ang_accel)
+        body.position = (x, y)
+        body.velocity = (vx, vy)
+        body.accel = (ax, ay)
+        body.local_velocity = (local_vx, local_vy)
+        body.local_accel = (local_ax, local_ay)
+        body.ang_velocity = ang_velocity
+        body.ang_accel = ang_accel
+        return body
+
+    def set(self, other):
+        if isinstance(other, SimBodyView):
+            self.store.values[self.index:self.index + SIM_BODY_FIELDS] = \
+                other.store.values[other.index:other.index + SIM_BODY_FIELDS]
+        else:
+            super().set(other)
+
+    def set_tuples(self, other):
+        values = self.store.values
+        index = self.index
+        values[index + POSITION_X], values[index + POSITION_Y] = other.position
+        values[index + ROTATION] = other.rotation
+        values[index + MAX_VELOCITY] = other.max_velocity
+        values[index + MAX_ANG_VELOCITY] = other.max_ang_velocity
+        values[index + MAX_ACCEL] = other.max_accel
+        values[index + MAX_ANG_ACCEL] = other.max_ang_accel
+
+        values[index + ANG_ACCEL] = other.ang_accel
+        values[index + ANG_VELOCITY] = other.ang_velocity
+        values[index + ACCEL_X], values[index + ACCEL_Y] = other.accel
+        values[index + LOCAL_ACCEL_X], values[index + LOCAL_ACCEL_Y] = other.local_accel
+        values[index + VELOCITY_X], values[index + VELOCITY_Y] = other.velocity
+        values[index + LOCAL_VELOCITY_X], values[index + LOCAL_VELOCITY_Y] = other.local_velocity
+
+    def step(self, delta_time):
+        """SimBody.step on the stored values (with the same math & quirks), without any temporary Vectors."""
+        if self._was_reset:
+            self._was_reset = False
+            return
+
+        values = self.store.values
+        index = self.index
+        (x, y, rotation, vx, vy, ax, ay, local_vx, local_vy, local_ax, local_ay, ang_velocity, ang_accel,
+         max_velocity, max_ang_velocity, max_accel, max_ang_accel) = values[index:index + SIM_BODY_FIELDS].tolist()
+        max_velocity = max(max_velocity, 0)
+        max_ang_velocity = max(max_ang_velocity, 0)
+        max_accel = max(max_accel, 0)
+        max_ang_accel = max(max_ang_accel, 0)
+
+        # pos_change_from_velocity_accel, whose velocity change is the (limited) accel itself, scaled by delta time
+        ax, ay = limit_magnitude(ax, ay, max_accel)
+        ax *= delta_time
+        ay *= delta_time
+        vx, vy = limit_magnitude(vx + ax, vy + ay, max_velocity)
+        local_ax, local_ay = limit_magnitude(local_ax, local_ay, max_accel)
+        local_ax *= delta_time
+        local_ay *= delta_time
+        local_vx, local_vy = limit_magnitude(local_vx + local_ax, local_vy + local_ay, max_velocity)
+
+        local_change_x = local_vx * delta_time
+        local_change_y = local_vy * delta_time
+        cos = math.cos(rotation)
+        sin = math.sin(rotation)
+        change_x, change_y = limit_magnitude(vx * delta_time + (local_change_x * cos - local_change_y * sin),
+                                             vy * delta_time + (local_change_x * sin + local_change_y * cos),
+                                             max_velocity * delta_time)
+
+        # rot_change_from_velocity_accel
+        ang_accel = limit(ang_accel, -max_ang_accel, max_ang_accel)
+        ang_velocity = limit(ang_velocity + ang_accel * delta_time, -max_ang_velocity, max_ang_velocity)
+
+        values[index + POSITION_X] = change_x + x
+        values[index + POSITION_Y] = change_y + y
+        values[index + ROTATION] = limit_rot(rotation + ang_velocity * delta_time)
+        values[index + VELOCITY_X] = vx
+        values[index + VELOCITY_Y] = vy
+        values[index + ACCEL_X] = ax
+        values[index + ACCEL_Y] = ay
+        values[index + LOCAL_VELOCITY_X] = local_vx
+        values[index + LOCAL_VELOCITY_Y] = local_vy
+        values[index + LOCAL_ACCEL_X] = local_ax
+        values[index + LOCAL_ACCEL_Y] = local_ay
+        values[index + ANG_VELOCITY] = ang_velocity
+        values[index + ANG_ACCEL] = ang_accel
+        values[index + MAX_VELOCITY] = max_velocity
+        values[index + MAX_ANG_VELOCITY] = max_ang_velocity
+        values[index + MAX_ACCEL] = max_accel
+        values[index + MAX_ANG_ACCEL] = max_ang_accel
+
+
+def limit_magnitude(x, y, max_magnitude):
+    """Vector.limit_magnitude for separate x & y values."""
+    magnitude = math.sqrt(x * x + y * y)
+    if magnitude > max_magnitude:
+        factor = max_magnitude / magnitude
+        return x * factor, y * factor
+    return x, y
+
+
+def step_body_views(bodies, delta_time):
+    """Steps many SimBodyViews at once with integrate_sim_body_values, directly on the rows of their stores
+    (one gather & scatter per store & body offset)."""
+    groups = {}
+    for body in bodies:
+        if body._was_reset:
+            body._was_reset = False
+            continue
+        group = groups.get((id(body.store), body.offset))
+        if group is None:
+            group = groups[(id(body.store), body.offset)] = (body.store, body.offset, [])
+        group[2].append(body.slot)
+
+    for store, offset, slots in groups.values():
+        columns = slice(offset, offset + SIM_BODY_FIELDS)
+        values = store.array[slots, columns]
+        integrate_sim_body_values(values, delta_time)
+        store.array[slots, columns] = values
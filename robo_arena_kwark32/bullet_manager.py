@@ -0,0 +1,116 @@
+import numpy as np
+
+from combat import hit_shell
+from body_store import BULLET_BODY, BULLET_EXTRAPOLATION_BODY, SIMPLE_BODY_FIELDS, POSITION_X, POSITION_Y, ROTATION
+from body_store import SIMPLE_LOCAL_VELOCITY_X, SIMPLE_LOCAL_VELOCITY_Y, BULLET_COLLIDER_OFFSET
+from body_store import BULLET_COLLIDER_HALF_WIDTH, BULLET_COLLIDER_HALF_HEIGHT
+from globals import GameInfo
+
+
+class BulletManager:
+    """Updates all bullets of a world at once on the rows of its bullet store: integrates them with NumPy
+    & tests them against the wall tiles of the arena grid, so Box2D is only left with the robot (& bullet) hits.
+    Results can differ in the last bits from Bullet.update, as NumPy's sin & cos may be implemented differently."""
+    def __init__(self, world_sim):
+        self.world_sim = world_sim
+
+        # Metrics
+        self.wall_hits = 0
+
+    def get_rows(self, bullets):
+        """Returns the slots & a copy of the bullet store rows of the bullets."""
+        slots = np.fromiter((bullet.sim_body.slot for bullet in bullets), dtype=np.intp, count=len(bullets))
+        return slots, self.world_sim.bullet_store.array[slots]
+
+    def update(self, bullets, delta_time):
+        """Bullet.update of all given bullets: step, extrapolation body copy & Box2D transform sync."""
+        if not bullets:
+            return
+        frame = self.world_sim.physics_frame_count
+        for bullet in bullets:
+            if not bullet.collider_set and frame > bullet.creation_frame:
+                bullet.set_collider()
+
+        slots, rows = self.get_rows(bullets)
+        x = rows[:, BULLET_BODY + POSITION_X]
+        y = rows[:, BULLET_BODY + POSITION_Y]
+        rotation = rows[:, BULLET_BODY + ROTATION]
+        local_vx = rows[:, BULLET_BODY + SIMPLE_LOCAL_VELOCITY_X]
+        local_vy = rows[:, BULLET_BODY + SIMPLE_LOCAL_VELOCITY_Y]
+
+        # SimpleBody.step
+        cos = np.cos(rotation)
+        sin = np.sin(rotation)
+        x += (local_vx * cos - local_vy * sin) * delta_time
+        y += (local_vx * sin + local_vy * cos) * delta_time
+        rows[:, BULLET_EXTRAPOLATION_BODY:BULLET_EXTRAPOLATION_BODY + SIMPLE_BODY_FIELDS] = \
+            rows[:, BULLET_BODY:BULLET_BODY + SIMPLE_BODY_FIELDS]
+        self.world_sim.bullet_store.array[slots] = rows
+
+        # Bullet.get_collider_pos
+        offset = rows[:, BULLET_COLLIDER_OFFSET]
+        collider_x = x - offset * sin
+        collider_y = y + offset * cos
+        for bullet, position_x, position_y, angle in zip(bullets, collider_x.tolist(), collider_y.tolist(),
+                                                         rotation.tolist()):
+            bullet.physics_body.transform = ((position_x, position_y), angle)
+
+    def resolve_wall_hits(self, bullets):
+        """Hits the simulated bullets whose collider overlaps a wall tile & destroys the ones that left the arena."""
+        arena = self.world_sim.arena
+        bullets = [bullet for bullet in bullets if not bullet.to_destroy and not bullet.interpolated]
+        if not bullets or arena.tiles is None:
+            return
+
+        slots, rows = self.get_rows(bullets)
+        rotation = rows[:, BULLET_BODY + ROTATION]
+        cos = np.cos(rotation)
+        sin = np.sin(rotation)
+        offset = rows[:, BULLET_COLLIDER_OFFSET]
+        center_x = rows[:, BULLET_BODY + POSITION_X] - offset * sin
+        center_y = rows[:, BULLET_BODY + POSITION_Y] + offset * cos
+        half_width = rows[:, BULLET_COLLIDER_HALF_WIDTH]
+        half_height = rows[:, BULLET_COLLIDER_HALF_HEIGHT]
+        abs_cos = np.abs(cos)
+        abs_sin = np.abs(sin)
+
+        # tile range of the axis aligned bounds of the rotated colliders
+        tile_size = GameInfo.arena_tile_size
+        extent_x = abs_cos * half_width + abs_sin * half_height
+        extent_y = abs_sin * half_width + abs_cos * half_height
+        min_x = np.floor((center_x - extent_x) / tile_size).astype(np.int64)
+        max_x = np.floor((center_x + extent_x) / tile_size).astype(np.int64)
+        min_y = np.floor((center_y - extent_y) / tile_size).astype(np.int64)
+        max_y = np.floor((center_y + extent_y) / tile_size).astype(np.int64)
+
+        collision_grid = arena.get_collision_grid()
+        tile_extent = (tile_size / 2) * (abs_cos + abs_sin)  # of a tile along both bullet axes
+        hit = np.zeros(len(bullets), dtype=bool)
+        hit_x = np.zeros(len(bullets), dtype=np.int64)
+        hit_y = np.zeros(len(bullets), dtype=np.int64)
+        for tile_offset_y in range(int((max_y - min_y).max()) + 1):
+            for tile_offset_x in range(int((max_x - min_x).max()) + 1):
+                tile_x = min_x + tile_offset_x
+                tile_y = min_y + tile_offset_y
+                candidate = (~hit & (tile_x <= max_x) & (tile_y <= max_y) & (tile_x >= 0) & (tile_y >= 0)
+                             & (tile_x < arena.tile_count.x) & (tile_y < arena.tile_count.y))
+                candidate[candidate] = collision_grid[tile_y[candidate], tile_x[candidate]]
+                if not candidate.any():
+                    continue
+
+                # separating axis test along the bullet axes, the world axes overlap within the tile range
+                diff_x = (tile_x + 0.5) * tile_size - center_x
+                diff_y = (tile_y + 0.5) * tile_size - center_y
+                candidate &= np.abs(diff_x * cos + diff_y * sin) <= half_width + tile_extent
+                candidate &= np.abs(-diff_x * sin + diff_y * cos) <= half_height + tile_extent
+                hit_x[candidate] = tile_x[candidate]
+                hit_y[candidate] = tile_y[candidate]
+                hit |= candidate
+
+        for index in np.flatnonzero(hit).tolist():
+            hit_shell(bullets[index], arena.tiles[hit_y[index]][hit_x[index]])
+            self.wall_hits += 1
+
+        outside = (center_x < 0) | (center_y < 0) | (center_x >= arena.size.x) | (center_y >= arena.size.y)
+        for index in np.flatnonzero(outside & ~hit).tolist():
+            bullets[index].destroy()
@@ -1,11 +1,21 @@
+import random
+
+import numpy as np
+
 from world_sim import WorldSim
-from robot import PlayerInput
-from util import limit, lerp
+from robot import Robot, PlayerInput
+from physics import PhysicsWorld
+from arena_converter import add_physics
+from sound_manager import SoundManager
+from util import Vector, limit, lerp
 from networking import UDPClient, ClientPacket
 from globals import GameInfo
 from constants import FIXED_DELTA_TIME, FIXED_DELTA_TIME_NS, MAX_EXTRAPOLATION_STEPS, TIME_SYNC_LERP_AMOUNT
+from constants import INPUT_REDUNDANCY_COUNT
 from powerups import decompress_power_ups
 from weapons import bullet_classes
+from interpolation import InterpolationBuffer, interpolate_body
+from lag_compensation import get_overlapping
 
 
 class OnlineWorldSim(WorldSim):
@@ -22,6 +32,13 @@ class OnlineWorldSim(WorldSim):
         self.server_client_latency_ns = 0
 
         self.received_first_packet = False
+        self.scores = None
+
+        self.interpolation_buffer = InterpolationBuffer()
+        self.last_interpolated_frame = -1
+
+        self.prediction_physics_world = None  # created on the first local rollback
+        self.prediction_body = None
 
     def clean_mem(self):
         super().clean_mem()
@@ -29,9 +46,14 @@ class OnlineWorldSim(WorldSim):
             self.udp_socket.send_packet(None, ClientPacket(
                 creation_time=(self.curr_time_ns + 1000000000), disconnect=True))
 
-    def set_robots(self, robots):
-        """Sets all robots to the newest server packet info."""
+    def set_robots(self, robots, local=None, physics_frame=None):
+        """Sets all robots to the newest server packet info.
+        With local True/False only the local player's/remote robots are set & removed."""
+        if physics_frame is None:
+            physics_frame = self.physics_frame_count
         for new_robot_info in robots:
+            if local is not None and (new_robot_info.player_id == GameInfo.local_player_id) != local:
+                continue
             existing_robot = None
             for robot in self.robots:
                 if robot.robot_id == new_robot_info.player_id:
@@ -47,11 +69,13 @@ class OnlineWorldSim(WorldSim):
                     existing_robot = self.create_enemy_robot(has_ai=False, robot_id=new_robot_info.player_id,
                                                              should_respawn=True)
 
-            new_robot_info.set_robot_values(existing_robot, self.physics_frame_count)
+            new_robot_info.set_robot_values(existing_robot, physics_frame)
 
-        if len(self.robots) > len(robots):
+        if len(self.robots) > len(robots) or local is not None:
             dead_robots = []
             for robot in self.robots:
+                if local is not None and (robot is self.local_player_robot) != local:
+                    continue
                 contained = False
                 for new_robot_info in robots:
                     if robot.robot_id == new_robot_info.player_id:
@@ -61,17 +85,21 @@ class OnlineWorldSim(WorldSim):
                     dead_robots.append(robot)
             for dead in dead_robots:
                 dead.remove()
+                dead.release_store_slot()
                 self.robots.remove(dead)
                 if dead is self.local_player_robot:
                     self.local_player_robot = None
             dead_robots.clear()
 
-    def set_bullets(self, bullets):
-        """Sets all bullets to the newest server packet info."""
+    def set_bullets(self, bullets, local=None):
+        """Sets all bullets to the newest server packet info.
+        With local True/False only the local player's/remote bullets are set & removed."""
         for new_bullet_info in bullets:
+            if local is not None and (new_bullet_info.source_id == GameInfo.local_player_id) != local:
+                continue
             existing_bullet = None
             for bullet in self.bullets:
-                if bullet.bullet_id == new_bullet_info.bullet_id:
+                if bullet.bullet_id == new_bullet_info.bullet_id and bullet.source_id == new_bullet_info.source_id:
                     existing_bullet = bullet
                     break
 
@@ -81,12 +109,14 @@ class OnlineWorldSim(WorldSim):
 
             new_bullet_info.set_bullet_values(existing_bullet)
 
-        if len(self.bullets) > len(bullets):
+        if len(self.bullets) > len(bullets) or local is not None:
             dead_bullets = []
             for bullet in self.bullets:
+                if local is not None and (bullet.source_id == GameInfo.local_player_id) != local:
+                    continue
                 contained = False
                 for new_bullet_info in bullets:
-                    if bullet.bullet_id == new_bullet_info.bullet_id:
+                    if bullet.bullet_id == new_bullet_info.bullet_id and bullet.source_id == new_bullet_info.source_id:
                         contained = True
                         break
                 if not contained:
@@ -94,11 +124,54 @@ class OnlineWorldSim(WorldSim):
             for dead in dead_bullets:
                 # print("removing bullet " + str(dead.bullet_id) + " from robot " + str(dead.source_id))
                 dead.physics_world.world.DestroyBody(dead.physics_body)
+                dead.release_store_slot()
                 self.bullets.remove(dead)
             dead_bullets.clear()
 
+    def interpolate_remote(self):
+        """Sets the remote robots & bullets to the buffered server state at the render time,
+        which is behind the server by the interpolation delay."""
+        render_frame = ((self.curr_world_time_ns - self.server_client_latency_ns - GameInfo.interpolation_delay_ns)
+                        / FIXED_DELTA_TIME_NS)
+        from_snapshot, to_snapshot, t = self.interpolation_buffer.sample(render_frame)
+        if from_snapshot is None:
+            return
+
+        physics_frame = -1  # deaths are only applied once, not every time the same snapshot is held
+        if from_snapshot.physics_frame != self.last_interpolated_frame:
+            physics_frame = from_snapshot.physics_frame
+            self.last_interpolated_frame = physics_frame
+        self.set_robots(list(from_snapshot.robots.values()), local=False, physics_frame=physics_frame)
+        self.set_bullets(list(from_snapshot.bullets.values()), local=False)
+
+        for robot in self.robots:
+            if robot is self.local_player_robot:
+                continue
+            robot.interpolated = True
+            if to_snapshot is None or robot.is_dead or robot.physics_body is None:
+                continue
+            target = to_snapshot.robots.get(robot.robot_id)
+            if target is not None and not target.is_dead:
+                interpolate_body(robot.sim_body, target.robot_body, t)
+                robot.extrapolation_body.set(robot.sim_body)
+                robot.set_physics_body()
+
+        for bullet in self.bullets:
+            if bullet.source_id == GameInfo.local_player_id:
+                continue
+            bullet.interpolated = True
+            if to_snapshot is None:
+                continue
+            target = to_snapshot.bullets.get((bullet.source_id, bullet.bullet_id))
+            if target is not None:
+                interpolate_body(bullet.sim_body, target.bullet_body, t)
+                bullet.extrapolation_body.set(bullet.sim_body)
+                collider_pos = bullet.get_collider_pos()
+                bullet.physics_body.transform = ((collider_pos.x, collider_pos.y), bullet.sim_body.rotation)
+
     def extrapolate(self, packet_frame, extrapolation_count):
-        """Extrapolates the full physics simulation to sync with the server."""
+        """Extrapolates the full physics simulation (or just the local robot) to sync with the server."""
+        local_rollback = GameInfo.use_local_rollback or GameInfo.use_interpolation
         if self.local_player_robot is not None:
             extrapolation_count = limit(extrapolation_count, 0, MAX_EXTRAPOLATION_STEPS)
 
@@ -121,18 +194,93 @@ class OnlineWorldSim(WorldSim):
                     self.set_seed()
                     if self.local_player_robot is not None:
                         self.local_player_robot.input = frame_inputs[i]
-                    super().fixed_update(FIXED_DELTA_TIME, catchup_frame=(i < extrapolation_count - 1))
+                    if local_rollback:
+                        self.replay_local_frame(FIXED_DELTA_TIME, catchup_frame=(i < extrapolation_count - 1))
+                    else:
+                        super().fixed_update(FIXED_DELTA_TIME, catchup_frame=(i < extrapolation_count - 1))
                     # self.physics_frame_count += 1
                     # self.physics_world_time_ns = FIXED_DELTA_TIME_NS * self.physics_frame_count
 
                 if self.local_player_robot is not None:
                     self.local_player_robot.input = self.player_input
 
-            i = len(self.previous_inputs) - 1
-            while i >= 0:
-                if self.previous_inputs[i][1] < packet_frame:
-                    self.previous_inputs.pop(i)
-                i -= 1
+    def drop_acknowledged_inputs(self, input_ack_frame):
+        """Drops the inputs already processed by the server, as they are part of its state now."""
+        self.previous_inputs = [previous for previous in self.previous_inputs if previous[1] > input_ack_frame]
+
+    def get_prediction_physics_world(self):
+        """Returns the physics world with just the static arena colliders & a stand-in body for the local robot."""
+        if self.prediction_physics_world is None:
+            self.prediction_physics_world = PhysicsWorld()
+            add_physics(self.arena, self.prediction_physics_world)
+            self.prediction_body = self.prediction_physics_world.add_rect(Vector(0, 0), Robot.size.x, Robot.size.y,
+                                                                          static=False)
+        return self.prediction_physics_world
+
+    def get_local_bullets(self):
+        robot_id = self.local_player_robot.robot_id
+        return [bullet for bullet in self.bullets if bullet.source_id == robot_id and not bullet.interpolated]
+
+    def stop_bullets_at_robots(self, bullets):
+        """Destroys the bullets overlapping another living robot, without damage, as hits are left to the server."""
+        robots = [robot for robot in self.robots if not robot.is_dead and robot is not self.local_player_robot]
+        if not robots or not bullets:
+            return
+        transforms = np.array([(robot.sim_body.position.x, robot.sim_body.position.y, robot.sim_body.rotation)
+                               for robot in robots])
+        robot_half_size = Robot.size.copy()
+        robot_half_size.div(2)
+        robot_half_size.round()
+        for bullet in bullets:
+            if bullet.to_destroy:
+                continue
+            collider_pos = bullet.get_collider_pos()
+            if get_overlapping(collider_pos.x, collider_pos.y, bullet.sim_body.rotation,
+                               round(bullet.collider_size.x / 2), round(bullet.collider_size.y / 2),
+                               transforms, robot_half_size).any():
+                bullet.destroy()
+
+    def replay_local_frame(self, delta_time, catchup_frame=False):
+        """Re-simulates a frame of just the local robot & its bullets against the static arena colliders,
+        leaving everything else at server state, so the cost is independent of the player count.
+        The physics world isn't stepped, so the bullets are stopped at the wall tiles & the other robots here."""
+        self.catchup_frame = catchup_frame
+        SoundManager.instance.catchup_frame = catchup_frame
+        random.seed(self.current_frame_seed)
+
+        robot = self.local_player_robot
+        self.bullet_manager.update(self.get_local_bullets(), delta_time)
+
+        # deaths are left to the server, as die() would destroy the stand-in body in the wrong world
+        if not robot.is_dead and int(robot.health) > 0 and robot.physics_body is not None:
+            physics_world = self.get_prediction_physics_world()
+            world_body = robot.physics_body
+            self.prediction_body.userData = robot
+            self.prediction_body.linearVelocity = world_body.linearVelocity
+            self.prediction_body.angularVelocity = world_body.angularVelocity
+            robot.physics_body = self.prediction_body
+            robot.set_physics_body()
+
+            robot.update(delta_time)
+            physics_world.world.Step(delta_time, 0, 4)
+            robot.refresh_from_physics()
+            physics_world.do_collisions()
+
+            world_body.linearVelocity = self.prediction_body.linearVelocity
+            world_body.angularVelocity = self.prediction_body.angularVelocity
+            robot.physics_body = world_body
+            robot.set_physics_body()
+
+        local_bullets = self.get_local_bullets()  # including the ones just shot
+        self.bullet_manager.resolve_wall_hits(local_bullets)
+        self.stop_bullets_at_robots(local_bullets)
+        self.clear_dead_bullets()
+
+        self.physics_frame_count += 1
+        self.physics_world_time_ns = FIXED_DELTA_TIME_NS * self.physics_frame_count
+
+        SoundManager.instance.catchup_frame = False
+        self.catchup_frame = False
 
     def fixed_update(self, delta_time, catchup_frame=False):
         # print(self.curr_time_ns - self.udp_socket.curr_time_ns)
@@ -141,8 +289,10 @@ class OnlineWorldSim(WorldSim):
 
         if self.local_player_robot is not None:
             input_delay_frames = round(self.server_client_latency_ns / FIXED_DELTA_TIME_NS)
-            if len(self.previous_inputs) <= MAX_EXTRAPOLATION_STEPS * 2 and self.player_input is not None:
+            if self.player_input is not None:
                 self.previous_inputs.append((self.player_input.copy(), self.physics_frame_count + input_delay_frames))
+                if len(self.previous_inputs) > MAX_EXTRAPOLATION_STEPS * 2:
+                    self.previous_inputs.pop(0)
 
             input_to_use = self.player_input
             for player_input in self.previous_inputs:
@@ -151,19 +301,24 @@ class OnlineWorldSim(WorldSim):
                     break
             self.local_player_robot.input = input_to_use
 
-        if self.local_player_robot is None or self.player_input is None:
-            packet = ClientPacket(creation_time=self.curr_time_ns, player_name=GameInfo.local_player_name)
-        else:
-            packet = ClientPacket(creation_time=self.curr_time_ns, player_input=self.player_input,
-                                  player_name=GameInfo.local_player_name)
+        ack_frame = -1
+        if self.received_first_packet:
+            ack_frame = self.last_packet_physics_frame
+        # the inputs not yet acknowledged by the server are resent until they are, up to the redundancy count
+        inputs = None
+        if self.local_player_robot is not None and self.player_input is not None:
+            inputs = [(frame, player_input) for player_input, frame in self.previous_inputs[-INPUT_REDUNDANCY_COUNT:]]
+        packet = ClientPacket(creation_time=self.curr_time_ns, inputs=inputs,
+                              player_name=GameInfo.local_player_name, ack_frame=ack_frame)
         # print("sending packet on frame " + str(self.physics_frame_count))
         self.udp_socket.send_packet(None, packet)
 
         self.player_input.shoot_pressed = False
 
-        new_packets = []
-        while self.udp_socket.get_packet_available():
-            new_packets.append(self.udp_socket.get_packet())
+        new_packets = self.udp_socket.get_packets()
+        if GameInfo.use_interpolation:
+            for packet in new_packets:
+                self.interpolation_buffer.add(packet.physics_frame, packet.robots, packet.bullets)
 
         if new_packets:
             last_packet = new_packets[0]
@@ -173,7 +328,7 @@ class OnlineWorldSim(WorldSim):
 
             if last_packet.physics_frame < self.last_packet_physics_frame:
                 # print("received older packet")
-                super().fixed_update(delta_time)
+                self.simulate(delta_time, catchup_frame=catchup_frame)
                 return
 
             self.server_world_start_time_ns = last_packet.world_start_time
@@ -189,6 +344,8 @@ class OnlineWorldSim(WorldSim):
                 self.world_start_time_ns = lerp(self.world_start_time_ns, new_wst, TIME_SYNC_LERP_AMOUNT)
             self.curr_world_time_ns = self.curr_time_ns - self.world_start_time_ns
             self.last_packet_physics_frame = last_packet.physics_frame
+            self.received_first_packet = True
+            self.drop_acknowledged_inputs(last_packet.input_ack_frame)
             physics_frames_ahead = self.physics_frame_count - self.last_packet_physics_frame
             if physics_frames_ahead < 0:
                 physics_frames_ahead = 0
@@ -198,17 +355,38 @@ class OnlineWorldSim(WorldSim):
 
             # Set all variables from last packet
             GameInfo.local_player_id = last_packet.player_id
-            self.set_robots(last_packet.robots)
-            self.set_bullets(last_packet.bullets)
+            if GameInfo.use_interpolation:
+                # only the own robot (& its bullets) is reset & predicted, the rest is interpolated afterwards
+                self.set_robots(last_packet.robots, local=True)
+                self.set_bullets(last_packet.bullets, local=True)
+            else:
+                self.set_robots(last_packet.robots)
+                self.set_bullets(last_packet.bullets)
             decompress_power_ups(last_packet.power_ups, self.arena)
+            if last_packet.scores is not None:
+                self.scores = last_packet.scores
 
             self.extrapolate(self.last_packet_physics_frame, physics_frames_ahead + 1)
+            if GameInfo.use_interpolation:
+                self.interpolate_remote()
 
             # print("got packet")
 
         else:
             # print("no packet")
-            super().fixed_update(delta_time)
+            self.simulate(delta_time, catchup_frame=catchup_frame)
+
+    def simulate(self, delta_time, catchup_frame=False):
+        """Simulates a frame without new server state."""
+        super().fixed_update(delta_time, catchup_frame=catchup_frame)
+        if GameInfo.use_interpolation:
+            self.interpolate_remote()
+
+    def get_scores(self):
+        """Uses the server's scores, as not all robots are sent to the client."""
+        if self.scores is not None:
+            return self.scores
+        return super().get_scores()
 
     def set_seed(self):
-        GameInfo.current_frame_seed = self.server_world_start_time_ns + self.physics_frame_count
+        self.current_frame_seed = self.server_world_start_time_ns + self.physics_frame_count
@@ -23,15 +23,43 @@ ROBOT_COLLISION_SOUND_SPEED_FACTOR = 0.5
 MIN_SOUND_DELAY_FRAMES = 15
 RESPAWN_DELAY = round(3 / FIXED_DELTA_TIME)  # 3s in fixed frames
 GAME_OVER_DELAY = round(1 / FIXED_DELTA_TIME)
+BODY_STORE_CAPACITY = 64  # initial robot/bullet slots of a world's body stores (grow if needed)
+
+# Physics (Box2D collision categories, bullets don't collide with walls in Box2D, see BulletManager)
+DEFAULT_CATEGORY = 0x0001
+WALL_CATEGORY = 0x0002
+ALL_CATEGORIES = 0xFFFF
 
 # AI
-MAX_ASTART_ITER = 320
+FLOW_FIELD_CACHE_SIZE = 4  # flow fields of recent target tiles kept per world (see FlowFields)
+FLOW_FIELD_SETTLE_BUDGET = 1000  # flow field tiles settled per fixed frame & world (a few ms)
+PATH_PLANNER_WORKERS = 2  # threads of the path planner pool shared by all worlds of the process
+PATH_RESULT_DELAY_FRAMES = 1  # fixed frames between a path request & its delivery
+PATH_REFINED_CLUSTERS = 2  # clusters at the start of hierarchical paths that are refined with the grid A*
+PATH_CLUSTER_SIZE = 10  # tiles per side of the clusters of the hierarchical pathfinding (see PathGraph)
+MAX_SINGLE_ENTRANCE_LENGTH = 5  # longer open cluster borders get an entrance at both ends
 
 # Networking
 CLIENT_DISCONNECT_TIMEOUT_NS = s_to_ns(5)
 SIMULATED_PING = 0  # 800  # ms
 SIMULATED_PING_NS = SIMULATED_PING * 1000000
 TIME_SYNC_LERP_AMOUNT = 0.01
+WIRE_PROTOCOL_VERSION = 6  # first byte of binary packets, must never be 0x80 (pickle protocol marker)
+SNAPSHOT_HISTORY_LENGTH = FIXED_FPS  # snapshots kept as delta baselines, older acks get a full snapshot
+INTEREST_RADIUS = 32  # in tiles around a client's robot, robots & bullets outside are not sent (0 = send all)
+INTEREST_CELL_SIZE = 8  # in tiles, cell size of the spatial grid for interest management
+FRAGMENT_TIMEOUT_NS = s_to_ns(0.25)  # incomplete fragmented messages are dropped after this
+MAX_PENDING_MESSAGES = 64  # incomplete fragmented messages kept per socket
+MAX_FRAGMENT_COUNT = 64  # fragments per message, larger messages are not sent
+INTERPOLATION_BUFFER_LENGTH = FIXED_FPS  # received snapshots kept for interpolating remote robots & bullets
+DATAGRAM_BATCH_SIZE = 64  # datagrams sent/received per sendmmsg/recvmmsg syscall
+INPUT_REDUNDANCY_COUNT = 8  # last inputs sent in every client packet, so lost packets don't lose inputs
+MAX_PENDING_INPUTS = MAX_EXTRAPOLATION_STEPS * 2  # received inputs of future frames buffered per client
+LAG_COMPENSATION_FRAMES = FIXED_FPS  # robot transforms kept to rewind bullet hits to the shooter's view
+LAG_COMPENSATION_ROBOTS = 64  # initial robots per frame of the transform history (grows if needed)
+
+# Replay
+REPLAY_FORMAT_VERSION = 1
 
 # Text/Font
 MAX_PLAYER_NAME_LENGTH = 728
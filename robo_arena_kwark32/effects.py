@@ -371,3 +371,13 @@ effect_classes = {}
 for name, obj in globals().copy().items():
     if name.endswith("Effect") and hasattr(obj, "id"):
         effect_classes[obj.id] = obj
+
+
+# All keys used in robot.effect_data, indexed for network optimization
+effect_data_keys = [
+    ("HoleTileEffect", "start_rotation"),
+    ("HoleTileEffect", "duration"),
+    ("PortalTileEffect", "last_tp_frame"),
+    ("PortalTileEffect", "last_tp_type"),
+]
+effect_data_key_ids = {key: i for i, key in enumerate(effect_data_keys)}
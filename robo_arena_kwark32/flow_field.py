@@ -0,0 +1,112 @@
+from heapq import heappush, heappop
+
+from constants import FLOW_FIELD_CACHE_SIZE, FLOW_FIELD_SETTLE_BUDGET
+
+
+UNREACHABLE = -1
+PENDING = -2  # the tile is not settled yet, as the settle budget of the frame is used up
+
+
+class FlowField:
+    """Reverse Dijkstra map towards a target tile: the cost of the cheapest path from every tile to the target
+    & the next tile on it. Tiles are settled lazily, the search only expands until the tiles asked for are settled
+    & continues from there on later queries (& frames), so it only grows as far as the robots chasing the target are."""
+    def __init__(self, costs, width, height, target_index):
+        self.costs = costs
+        self.width = width
+        self.height = height
+        self.target_index = target_index
+        tile_count = width * height
+        self.distances = [-1] * tile_count  # cost of the path to the target (-1 = not reached yet)
+        self.next_indices = [-1] * tile_count  # next tile on the path to the target
+        self.settled = bytearray(tile_count)
+        self.distances[target_index] = 0
+        self.next_indices[target_index] = target_index
+        self.open_heap = [(0, target_index)]
+
+        # Metrics
+        self.expanded_tiles = 0
+
+    def settle(self, index=-1, max_tiles=-1):
+        """Settles the open tiles in order of their distance until the given tile (or all reachable tiles) is
+        or max_tiles tiles were settled (-1 = no limit), returns whether the given tile is settled."""
+        open_heap = self.open_heap
+        settled = self.settled
+        distances = self.distances
+        next_indices = self.next_indices
+        costs = self.costs
+        width = self.width
+        height = self.height
+        while open_heap and max_tiles != 0:
+            distance, current_index = heappop(open_heap)
+            if settled[current_index]:
+                continue
+            settled[current_index] = 1
+            self.expanded_tiles += 1
+            max_tiles -= 1
+            cost = costs[current_index]  # of driving onto this tile from its neighbours
+            if cost >= 0:  # blocked tiles are only settled for robots standing on them
+                x = current_index % width
+                y = current_index // width
+                next_distance = distance + cost
+                for neighbor_x, neighbor_y in ((x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)):
+                    if neighbor_x < 0 or neighbor_y < 0 or neighbor_x >= width or neighbor_y >= height:
+                        continue
+                    neighbor_index = neighbor_y * width + neighbor_x
+                    if settled[neighbor_index] or 0 <= distances[neighbor_index] <= next_distance:
+                        continue
+                    distances[neighbor_index] = next_distance
+                    next_indices[neighbor_index] = current_index
+                    heappush(open_heap, (next_distance, neighbor_index))
+            if current_index == index:
+                return True
+        return index >= 0 and settled[index] == 1
+
+
+class FlowFields:
+    """Flow fields of a world's arena, shared by all AI robots chasing a robot on the same target tile,
+    so a target moving to another tile costs one (partial) Dijkstra search instead of an A* per chasing robot.
+    The fields of the last few target tiles are kept, as targets often move back & forth between tiles.
+    At most FLOW_FIELD_SETTLE_BUDGET tiles are settled per fixed frame over all fields, so a far chaser
+    of a target on a new tile can take a few frames to get its next tile, without stalling the frame."""
+    def __init__(self, world_sim):
+        self.world_sim = world_sim
+        self.fields = {}  # (target tile index, low health) -> FlowField, least recently used first
+        self.settle_budget = FLOW_FIELD_SETTLE_BUDGET  # tiles left to settle in the current fixed frame
+
+        # Metrics
+        self.built_fields = 0
+
+    def get_field(self, target_x, target_y, low_health=False):
+        """Returns the flow field towards the target tile for the healthy or low health tile costs."""
+        arena = self.world_sim.arena
+        width = arena.tile_count.x
+        key = (target_y * width + target_x, low_health)
+        field = self.fields.pop(key, None)
+        if field is None:
+            field = FlowField(arena.get_path_costs(low_health=low_health), width, arena.tile_count.y, key[0])
+            self.built_fields += 1
+            if len(self.fields) >= FLOW_FIELD_CACHE_SIZE:
+                self.fields.pop(next(iter(self.fields)))
+        self.fields[key] = field
+        return field
+
+    def get_next(self, field, x, y):
+        """Returns the index (y * width + x) of the next tile from the given one towards the field's target,
+        UNREACHABLE or PENDING (settled in a later frame). O(1) once the tile is settled."""
+        index = y * field.width + x
+        if not field.settled[index]:
+            if self.settle_budget <= 0:
+                return PENDING
+            expanded_tiles = field.expanded_tiles
+            reached = field.settle(index, max_tiles=self.settle_budget)
+            self.settle_budget -= field.expanded_tiles - expanded_tiles
+            if not reached:
+                return PENDING if field.open_heap else UNREACHABLE
+        return field.next_indices[index]
+
+    def begin_frame(self):
+        self.settle_budget = FLOW_FIELD_SETTLE_BUDGET
+
+    def clear(self):
+        self.fields.clear()
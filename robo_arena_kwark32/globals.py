@@ -26,6 +26,7 @@ class Menus:
 class GameInfo:
     """Holds global info about the game."""
     is_headless = False
+    use_asyncio_server = False  # headless server runs on an asyncio event loop instead of the selectors loop
 
     window_reference_size = None
     window_size = None
@@ -45,18 +46,29 @@ class GameInfo:
     robot_max_accel = robot_max_velocity * 2
     robot_max_ang_accel = robot_max_ang_velocity * 8
 
-    current_frame_seed = 0
-
     placeholder_name = "Player"
     local_player_name = placeholder_name
 
     local_player_id = 0
-    next_player_id = local_player_id + 1
 
     default_ip = "127.0.0.1"  # "202.61.239.116"
     server_ip = default_ip
     port = 54345
+    room_id = 0  # room joined on the server, multiple matches can share one server process & port
+    server_room_count = 1  # rooms hosted by a headless server
+    server_worker_count = 1  # processes the rooms are sharded across (0 = one per CPU core, 1 = no sharding)
     buffer_size = 4096
+    use_interpolation = False  # interpolate remote robots & bullets between server snapshots, only predict own robot
+    use_local_rollback = False  # re-simulate only the own robot on server packets (always with interpolation)
+    interpolation_delay_ns = 100000000  # how far remote robots & bullets are shown behind the newest server state
+    use_mmsg = True  # batch datagrams into sendmmsg/recvmmsg syscalls where available (Linux)
+    use_pickle_protocol = False  # send packets pickled instead of in the binary wire format
+    replay_record_path = None  # records the player inputs of singleplayer & server worlds to this replay file
+    replay_path = None  # replays this replay file headless as fast as possible instead of starting the game
+    simulation_frame_count = None  # simulates AI only matches of this many frames headless as fast as possible
+    simulation_robot_count = 8
+    simulation_match_count = 1
+    simulation_seed = None  # seed of the first simulated match (+1 per match), random if None
 
     score_per_kill = 600  # = 10s survival
     local_player_score = 0
@@ -0,0 +1,80 @@
+from globals import GameInfo
+from constants import INTEREST_RADIUS, INTEREST_CELL_SIZE
+
+
+class SpatialGrid:
+    """Buckets positioned entries into square cells of arena tiles for fast radius queries."""
+    def __init__(self, cell_size=INTEREST_CELL_SIZE):
+        self.cell_size_px = cell_size * GameInfo.arena_tile_size
+        self.cells = {}  # (cell x, cell y) -> list of (key, x, y)
+
+    def clear(self):
+        self.cells.clear()
+
+    def insert(self, key, x, y):
+        cell = (int(x // self.cell_size_px), int(y // self.cell_size_px))
+        entries = self.cells.get(cell)
+        if entries is None:
+            entries = []
+            self.cells[cell] = entries
+        entries.append((key, x, y))
+
+    def query(self, x, y, radius, result):
+        """Adds the keys of all entries within radius (in px) around x, y to the result set."""
+        radius_sq = radius * radius
+        min_cell_x = int((x - radius) // self.cell_size_px)
+        max_cell_x = int((x + radius) // self.cell_size_px)
+        min_cell_y = int((y - radius) // self.cell_size_px)
+        max_cell_y = int((y + radius) // self.cell_size_px)
+        for cell_y in range(min_cell_y, max_cell_y + 1):
+            for cell_x in range(min_cell_x, max_cell_x + 1):
+                entries = self.cells.get((cell_x, cell_y))
+                if entries is None:
+                    continue
+                for key, entry_x, entry_y in entries:
+                    dx = entry_x - x
+                    dy = entry_y - y
+                    if dx * dx + dy * dy <= radius_sq:
+                        result.add(key)
+        return result
+
+
+class InterestManager:
+    """Selects the robots & bullets relevant to each client, based on the distance to the client's robot."""
+    def __init__(self, radius=INTEREST_RADIUS, cell_size=INTEREST_CELL_SIZE):
+        self.radius_px = radius * GameInfo.arena_tile_size
+        self.robot_grid = SpatialGrid(cell_size=cell_size)
+        self.bullet_grid = SpatialGrid(cell_size=cell_size)
+        self.robot_positions = {}
+
+    @property
+    def enabled(self):
+        return self.radius_px > 0
+
+    def update(self, robot_infos, bullet_infos):
+        """Rebuilds the grids from this frame's robot & bullet infos."""
+        self.robot_grid.clear()
+        self.bullet_grid.clear()
+        self.robot_positions.clear()
+        if not self.enabled:
+            return
+
+        for info in robot_infos:
+            x, y = info.robot_body.position
+            self.robot_positions[info.player_id] = (x, y)
+            self.robot_grid.insert(info.player_id, x, y)
+        for info in bullet_infos:
+            x, y = info.bullet_body.position
+            self.bullet_grid.insert((info.source_id, info.bullet_id), x, y)
+
+    def get_relevant(self, robot_id):
+        """Returns the sets of relevant robot IDs & bullet keys for a client's robot,
+        or None, None if everything is relevant."""
+        position = self.robot_positions.get(robot_id)
+        if position is None:
+            return None, None
+
+        robot_ids = self.robot_grid.query(position[0], position[1], self.radius_px, set())
+        robot_ids.add(robot_id)
+        bullet_keys = self.bullet_grid.query(position[0], position[1], self.radius_px, set())
+        return robot_ids, bullet_keys
@@ -0,0 +1,59 @@
+from util import lerp, lerp_rot
+from constants import INTERPOLATION_BUFFER_LENGTH
+
+
+class InterpolationSnapshot:
+    """Robot & bullet infos of one received server packet."""
+    def __init__(self, physics_frame, robot_infos, bullet_infos):
+        self.physics_frame = physics_frame
+        self.robots = {info.player_id: info for info in robot_infos}
+        self.bullets = {(info.source_id, info.bullet_id): info for info in bullet_infos}
+
+
+class InterpolationBuffer:
+    """Buffers received server snapshots ordered by physics frame, to show remote robots & bullets
+    interpolated between the two snapshots around a render frame."""
+    def __init__(self, max_length=INTERPOLATION_BUFFER_LENGTH):
+        self.max_length = max_length
+        self.snapshots = []
+
+    def add(self, physics_frame, robot_infos, bullet_infos):
+        i = len(self.snapshots)
+        while i > 0 and self.snapshots[i - 1].physics_frame >= physics_frame:
+            if self.snapshots[i - 1].physics_frame == physics_frame:
+                return
+            i -= 1
+        self.snapshots.insert(i, InterpolationSnapshot(physics_frame, robot_infos, bullet_infos))
+        if len(self.snapshots) > self.max_length:
+            self.snapshots.pop(0)
+
+    def sample(self, render_frame):
+        """Returns the snapshots before & after the (fractional) render frame and the interpolation factor
+        between them. Without a snapshot after it, the last one is held with the second one being None."""
+        from_snapshot = None
+        to_snapshot = None
+        for snapshot in self.snapshots:
+            if snapshot.physics_frame <= render_frame:
+                from_snapshot = snapshot
+            else:
+                to_snapshot = snapshot
+                break
+
+        if from_snapshot is None:
+            return to_snapshot, None, 0
+        while self.snapshots[0] is not from_snapshot:
+            self.snapshots.pop(0)  # older ones are never needed again
+        if to_snapshot is None:
+            return from_snapshot, None, 0
+        t = (render_frame - from_snapshot.physics_frame) / (to_snapshot.physics_frame - from_snapshot.physics_frame)
+        return from_snapshot, to_snapshot, t
+
+    def clear(self):
+        self.snapshots.clear()
+
+
+def interpolate_body(body, target_body, t):
+    """Moves a body's position & rotation towards those of a target info body (with tuple position)."""
+    body.position.x = lerp(body.position.x, target_body.position[0], t)
+    body.position.y = lerp(body.position.y, target_body.position[1], t)
+    body.rotation = lerp_rot(body.rotation, target_body.rotation, t)
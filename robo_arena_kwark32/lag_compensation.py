@@ -0,0 +1,136 @@
+import math
+
+import numpy as np
+
+from combat import hit_shell
+from robot import Robot
+from constants import LAG_COMPENSATION_FRAMES, LAG_COMPENSATION_ROBOTS
+
+
+class TransformHistory:
+    """Ring buffer of the robot transforms (x, y, rotation) of the last physics frames.
+    Every frame is a fixed slot of preallocated arrays, so recording never allocates
+    (64 robots & a one second window are ~60 KB)."""
+    def __init__(self, length=LAG_COMPENSATION_FRAMES, robot_capacity=LAG_COMPENSATION_ROBOTS):
+        self.length = length
+        self.frames = np.full(length, -1, dtype=np.int64)  # physics frame per slot (-1 = empty)
+        self.counts = np.zeros(length, dtype=np.int32)  # robots per slot
+        self.robot_ids = np.zeros((length, robot_capacity), dtype=np.int32)
+        self.transforms = np.zeros((length, robot_capacity, 3), dtype=np.float32)
+
+    def grow(self, robot_capacity):
+        robot_ids = np.zeros((self.length, robot_capacity), dtype=np.int32)
+        transforms = np.zeros((self.length, robot_capacity, 3), dtype=np.float32)
+        robot_ids[:, :self.robot_ids.shape[1]] = self.robot_ids
+        transforms[:, :self.transforms.shape[1]] = self.transforms
+        self.robot_ids = robot_ids
+        self.transforms = transforms
+
+    def record(self, frame, robots):
+        """Stores the transforms of all living robots as the state of the physics frame."""
+        if len(robots) > self.robot_ids.shape[1]:
+            self.grow(max(len(robots), self.robot_ids.shape[1] * 2))
+        slot = frame % self.length
+        robot_ids = self.robot_ids[slot]
+        transforms = self.transforms[slot]
+        count = 0
+        for robot in robots:
+            if robot.is_dead:
+                continue
+            robot_ids[count] = robot.robot_id
+            position = robot.sim_body.position
+            transforms[count] = (position.x, position.y, robot.sim_body.rotation)
+            count += 1
+        self.counts[slot] = count
+        self.frames[slot] = frame
+
+    def get(self, frame):
+        """Returns (robot IDs, transforms) of the physics frame, or None if it is not in the history."""
+        slot = frame % self.length
+        if frame < 0 or self.frames[slot] != frame:
+            return None
+        count = self.counts[slot]
+        return self.robot_ids[slot, :count], self.transforms[slot, :count]
+
+    def clear(self):
+        self.frames.fill(-1)
+        self.counts.fill(0)
+
+
+def get_overlapping(center_x, center_y, rotation, half_width, half_height, transforms, robot_half_size):
+    """Returns a bool array of which robot rectangles (all of robot_half_size) overlap the rectangle,
+    using the separating axis test of all 4 rectangle axes at once for all robots."""
+    cos_a, sin_a = math.cos(rotation), math.sin(rotation)
+    cos_b, sin_b = np.cos(transforms[:, 2]), np.sin(transforms[:, 2])
+    dx = transforms[:, 0] - center_x
+    dy = transforms[:, 1] - center_y
+
+    # dot products between the rectangle's axes (cos, sin) & (-sin, cos) and the robots' axes
+    ax_bx = cos_a * cos_b + sin_a * sin_b
+    ax_by = -cos_a * sin_b + sin_a * cos_b
+    ay_bx = -sin_a * cos_b + cos_a * sin_b
+    ay_by = sin_a * sin_b + cos_a * cos_b
+
+    separated = np.abs(dx * cos_a + dy * sin_a) > (
+        half_width + robot_half_size.x * np.abs(ax_bx) + robot_half_size.y * np.abs(ax_by))
+    separated |= np.abs(-dx * sin_a + dy * cos_a) > (
+        half_height + robot_half_size.x * np.abs(ay_bx) + robot_half_size.y * np.abs(ay_by))
+    separated |= np.abs(dx * cos_b + dy * sin_b) > (
+        robot_half_size.x + half_width * np.abs(ax_bx) + half_height * np.abs(ay_bx))
+    separated |= np.abs(-dx * sin_b + dy * cos_b) > (
+        robot_half_size.y + half_width * np.abs(ax_by) + half_height * np.abs(ay_by))
+    return ~separated
+
+
+class LagCompensation:
+    """Resolves the robot hits of bullets shot by lagging players against the robot positions
+    the shooter saw when shooting, instead of the current ones."""
+    def __init__(self, length=LAG_COMPENSATION_FRAMES):
+        self.history = TransformHistory(length=length)
+        self.robot_half_size = Robot.size.copy()
+        self.robot_half_size.div(2)
+        self.robot_half_size.round()
+
+        # Metrics
+        self.rewound_hits = 0
+
+    def clamp_rewind_frames(self, rewind_frames):
+        return max(0, min(rewind_frames, self.history.length - 1))
+
+    def record(self, frame, robots):
+        self.history.record(frame, robots)
+
+    def resolve_hits(self, frame, bullets, robots):
+        """Checks the bullets with rewind frames against the recorded robot transforms of that many frames
+        before the physics frame, hitting the (current) robot of the first overlapping one."""
+        living_robots = None
+        for bullet in bullets:
+            if bullet.rewind_frames <= 0 or bullet.to_destroy or bullet.interpolated:
+                continue
+            if living_robots is None:
+                living_robots = {robot.robot_id: robot for robot in robots if not robot.is_dead}
+
+            recorded = self.history.get(frame - bullet.rewind_frames)
+            if recorded is None:  # not recorded (yet), e.g. right after the server started
+                recorded = self.history.get(frame - 1)
+                if recorded is None:
+                    continue
+            robot_ids, transforms = recorded
+            if len(robot_ids) == 0:
+                continue
+
+            collider_pos = bullet.get_collider_pos()
+            overlapping = get_overlapping(collider_pos.x, collider_pos.y, bullet.sim_body.rotation,
+                                          round(bullet.collider_size.x / 2), round(bullet.collider_size.y / 2),
+                                          transforms, self.robot_half_size)
+            for index in np.flatnonzero(overlapping):
+                robot_id = int(robot_ids[index])
+                robot = living_robots.get(robot_id)
+                if robot is None or robot_id == bullet.source_id:
+                    continue
+                hit_shell(bullet, robot)
+                self.rewound_hits += 1
+                break
+
+    def clear(self):
+        self.history.clear()
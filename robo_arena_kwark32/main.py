@@ -4,10 +4,38 @@ import time
 from globals import GameInfo, Settings
 
 headless_args = []
+i = 0
 for arg in sys.argv:
     if arg == "--headless":
         headless_args.append(arg)
         GameInfo.is_headless = True
+    elif arg == "--asyncio":
+        headless_args.append(arg)
+        GameInfo.use_asyncio_server = True
+    elif arg == "--record":
+        if len(sys.argv) > i + 1:
+            headless_args += [arg, sys.argv[i + 1]]
+            GameInfo.replay_record_path = sys.argv[i + 1]
+    elif arg == "--simulate":
+        if len(sys.argv) > i + 1:
+            headless_args += [arg, sys.argv[i + 1]]
+            GameInfo.simulation_frame_count = int(sys.argv[i + 1])
+            GameInfo.is_headless = True
+    elif arg in ("--bots", "--matches", "--seed"):
+        if len(sys.argv) > i + 1:
+            headless_args += [arg, sys.argv[i + 1]]
+            if arg == "--bots":
+                GameInfo.simulation_robot_count = int(sys.argv[i + 1])
+            elif arg == "--matches":
+                GameInfo.simulation_match_count = int(sys.argv[i + 1])
+            else:
+                GameInfo.simulation_seed = int(sys.argv[i + 1])
+    elif arg == "--replay":
+        if len(sys.argv) > i + 1:
+            headless_args += [arg, sys.argv[i + 1]]
+            GameInfo.replay_path = sys.argv[i + 1]
+            GameInfo.is_headless = True
+    i += 1
 for arg in headless_args:
     sys.argv.remove(arg)
 headless_args.clear()
@@ -129,6 +157,12 @@ if not GameInfo.is_headless:
 
 else:
     from server_world_sim import ServerWorldSim
+    from server_loop import ServerLoop
+    from async_server import AsyncServerLoop, AsyncServerSocket
+    from networking import ServerSocket, UDPServer
+    from server_shards import ShardSupervisor
+    from replay import play_replay
+    from simulation import run_simulations
 
 
 def main():
@@ -181,9 +215,28 @@ def main():
         Settings.instance = Settings(get_data_path())
         SoundManager.instance = HeadlessSound()
 
-        world_sim = ServerWorldSim()
-        while True:
-            update_headless(world_sim)
+        if GameInfo.replay_path is not None:
+            play_replay(GameInfo.replay_path)
+            return
+
+        if GameInfo.simulation_frame_count is not None:
+            run_simulations(GameInfo.simulation_frame_count, GameInfo.simulation_robot_count,
+                            match_count=GameInfo.simulation_match_count, seed=GameInfo.simulation_seed)
+            return
+
+        if GameInfo.server_worker_count != 1:
+            ShardSupervisor(GameInfo.server_room_count, GameInfo.server_worker_count).run()
+            return
+
+        if GameInfo.use_asyncio_server:
+            server_loop = AsyncServerLoop()
+            server_socket = AsyncServerSocket()
+        else:
+            server_loop = ServerLoop()
+            server_socket = ServerSocket()
+        for room_id in range(GameInfo.server_room_count):
+            server_loop.add_world_sim(ServerWorldSim(udp_socket=UDPServer(room_id, server_socket)))
+        server_loop.run()
 
 
 def update_graphics(app, window):
@@ -1,12 +1,17 @@
 import sys
 import time
 import socket
-import select
 import pickle
+import struct
 
 from globals import GameInfo
-from constants import SIMULATED_PING_NS
+from constants import SIMULATED_PING_NS, FRAGMENT_TIMEOUT_NS, MAX_PENDING_MESSAGES, MAX_FRAGMENT_COUNT
+from constants import MAX_PENDING_INPUTS
 from powerups import compress_power_ups
+from wire_protocol import STATE_PACKET_KIND, CLIENT_PACKET_KIND, PICKLE_MARKER, get_packet_kind
+from wire_protocol import write_state_packet, read_state_packet, write_client_packet, read_client_packet
+from wire_protocol import SnapshotHistory
+from batched_io import create_datagram_io
 
 
 i = 0
@@ -14,10 +19,35 @@ for arg in sys.argv:
     if arg == "--ip":
         if len(sys.argv) > i + 1:
             GameInfo.server_ip = sys.argv[i + 1]
-            break
+    elif arg == "--pickle":
+        GameInfo.use_pickle_protocol = True
+    elif arg == "--local-rollback":
+        GameInfo.use_local_rollback = True
+    elif arg == "--interpolate":
+        GameInfo.use_interpolation = True
+    elif arg == "--interpolation-delay":
+        if len(sys.argv) > i + 1:
+            GameInfo.interpolation_delay_ns = int(float(sys.argv[i + 1]) * 1000000)
+    elif arg == "--no-mmsg":
+        GameInfo.use_mmsg = False
+    elif arg == "--room":
+        if len(sys.argv) > i + 1:
+            GameInfo.room_id = int(sys.argv[i + 1])
+    elif arg == "--rooms":
+        if len(sys.argv) > i + 1:
+            GameInfo.server_room_count = int(sys.argv[i + 1])
+    elif arg == "--workers":
+        if len(sys.argv) > i + 1:
+            GameInfo.server_worker_count = int(sys.argv[i + 1])
     i += 1
 
 
+# message sequence, fragment index, fragment count
+FRAGMENT_HEADER = struct.Struct("<IHH")
+# room ID, in front of every (reassembled) message
+ROOM_HEADER = struct.Struct("<H")
+
+
 class Packet:
     """Base class for all network packets."""
     def __init__(self, creation_time=0):
@@ -30,12 +60,13 @@ class Packet:
 class StatePacket(Packet):
     """Network packet sent by the server with all the relevant world state info."""
     def __init__(self, creation_time=0, world_start_time=0, physics_frame=0, player_id=0,
-                 robots=None, bullets=None, power_ups=None):
+                 robots=None, bullets=None, power_ups=None, scores=None):
         super().__init__(creation_time=creation_time)
         self.world_start_time = world_start_time
         self.client_rtt_start = 0
         self.physics_frame = physics_frame
         self.player_id = player_id
+        self.input_ack_frame = -1  # physics frame of the client's last input processed by the server
         self.robots = robots
         if self.robots is None:
             self.robots = []
@@ -45,6 +76,9 @@ class StatePacket(Packet):
         self.power_ups = None
         if power_ups is not None:
             self.power_ups = compress_power_ups(power_ups)
+        self.scores = scores  # (name, kills) of all robots, even those not relevant to the client
+        self.snapshot = None  # packed world state (wire protocol only)
+        self.baseline = None  # snapshot acknowledged by the client, to only send changes since then
 
     def semi_copy(self):
         """Special copy method to just copy what the server changes between client sends."""
@@ -53,6 +87,9 @@ class StatePacket(Packet):
         cp.physics_frame = self.physics_frame
         cp.robots = self.robots
         cp.bullets = self.bullets
+        cp.power_ups = self.power_ups
+        cp.scores = self.scores
+        cp.snapshot = self.snapshot
         return cp
 
     def to_string(self):
@@ -73,124 +110,344 @@ class StatePacket(Packet):
 
 class ClientPacket(Packet):
     """Network packet sent by the client wit the input and player info."""
-    def __init__(self, creation_time=0, player_input=None, player_name="", disconnect=False):
+    def __init__(self, creation_time=0, inputs=None, player_name="", disconnect=False, ack_frame=-1):
         super().__init__(creation_time=creation_time)
-        self.player_input = player_input
+        self.ack_frame = ack_frame  # physics frame of the last applied state packet
+        # (physics frame, input) of the last few frames, so lost packets don't lose inputs
+        self.inputs = inputs
+        if self.inputs is None:
+            self.inputs = []
         self.player_name = player_name
         self.disconnect = disconnect
 
     def to_string(self):
-        p_input = "None"
-        if self.player_input is not None:
-            p_input = self.player_input.to_string()
-        return ("{\n  input: " + p_input + "\n  name: "
-                + self.player_name + "\n  disconnect: " + str(self.disconnect) + "\n}")
+        ret = "{\n  ack frame: " + str(self.ack_frame) + "\n  inputs: {"
+        for frame, player_input in self.inputs:
+            ret += "\n    " + str(frame) + ": " + player_input.to_string()
+        ret += ("}\n  name: " + self.player_name + "\n  disconnect: " + str(self.disconnect) + "\n}")
+        return ret
 
 
 class Client:
     """Holds info of a single client."""
     def __init__(self, address, player_id=-1, player_name=""):
         self.address = address
-        self.player_id = player_id
-        if player_id < 0:
-            self.player_id = GameInfo.next_player_id
-            GameInfo.next_player_id += 1
+        self.player_id = player_id  # assigned by the room's world sim if negative
 
         self.player_name = player_name
         self.last_rx_packet = None
         self.robot = None
 
+        self.snapshot_history = SnapshotHistory()  # snapshots sent to this client, as delta baselines
+
+        self.pending_inputs = {}  # physics frame -> received input not yet processed
+        self.last_input = None
+        self.input_ack_frame = -1  # physics frame of the last processed input
+        self.input_window_frame = -1  # inputs are buffered up to MAX_PENDING_INPUTS frames after this one
+
+    def add_inputs(self, inputs):
+        """Buffers the received inputs of frames not processed yet, ignoring already received ones
+        & those too far ahead of the last processed frame (or the first received input before any is processed)."""
+        for frame, player_input in inputs:
+            if self.input_window_frame < 0:
+                self.input_window_frame = frame - 1
+            if (self.input_ack_frame < frame <= self.input_window_frame + MAX_PENDING_INPUTS
+                    and frame not in self.pending_inputs):
+                self.pending_inputs[frame] = player_input
+
+    def pop_input(self, frame):
+        """Returns the input for the physics frame, processing all buffered inputs up to it.
+        Shoot presses of all processed inputs are kept, as they would be lost when only the last one is used.
+        If no input is processed, the last one is repeated without its shoot press."""
+        frame_input = None
+        shoot_pressed = False
+        self.input_window_frame = frame
+        for input_frame in sorted(self.pending_inputs):
+            if input_frame > frame:
+                break
+            frame_input = self.pending_inputs.pop(input_frame)
+            shoot_pressed = shoot_pressed or frame_input.shoot_pressed
+            self.input_ack_frame = input_frame
+        if frame_input is not None:
+            if shoot_pressed and not frame_input.shoot_pressed:
+                frame_input = frame_input.copy()
+                frame_input.shoot_pressed = True
+            self.last_input = frame_input
+            return frame_input
+        if self.last_input is not None and self.last_input.shoot_pressed:
+            self.last_input = self.last_input.copy()
+            self.last_input.shoot_pressed = False
+        return self.last_input
+
+
+def encode_packet(packet):
+    """Packs a packet into bytes, in the binary wire format or pickled if selected."""
+    if GameInfo.use_pickle_protocol:
+        return pickle.dumps(packet)
+    if isinstance(packet, StatePacket):
+        return write_state_packet(packet)
+    return write_client_packet(packet)
+
+
+def decode_packet(message, snapshot_history=None):
+    """Creates a packet from bytes in either format, returning None for unknown formats/versions,
+    malformed/truncated packets or delta packets with an unknown baseline.
+    Pickled packets are only accepted if the pickle protocol is selected, as unpickling runs the sender's code."""
+    if len(message) == 0:
+        return None
+    if message[0] == PICKLE_MARKER:
+        if not GameInfo.use_pickle_protocol:
+            print("WARN: Received pickled packet, but the pickle protocol is not selected!")
+            return None
+        return pickle.loads(message)
+
+    kind = get_packet_kind(message)
+    try:
+        if kind == STATE_PACKET_KIND:
+            return read_state_packet(message, StatePacket(), snapshot_history)
+        elif kind == CLIENT_PACKET_KIND:
+            return read_client_packet(message, ClientPacket())
+    except (struct.error, IndexError, KeyError, ValueError) as e:
+        print("WARN: Received malformed packet: " + str(e))
+        return None
+
+    print("WARN: Received packet with unknown wire protocol version or kind!")
+    return None
+
+
+class FragmentBuffer:
+    """Reassembles fragmented messages in any order, dropping incomplete ones after a timeout/when full."""
+    def __init__(self, timeout_ns=FRAGMENT_TIMEOUT_NS, max_pending=MAX_PENDING_MESSAGES):
+        self.timeout_ns = timeout_ns
+        self.max_pending = max_pending
+        self.pending = {}  # (address, sequence) -> [fragment count, received count, fragments, first receive time]
+
+        # Metrics
+        self.completed_messages = 0
+        self.invalid_fragments = 0
+        self.duplicate_fragments = 0
+        self.timed_out_messages = 0
+        self.evicted_messages = 0
+
+    def add(self, address, datagram, curr_time_ns):
+        """Adds a received datagram, returning the full message once all of its fragments arrived."""
+        if len(datagram) < FRAGMENT_HEADER.size:
+            self.invalid_fragments += 1
+            return None
+        sequence, index, count = FRAGMENT_HEADER.unpack_from(datagram, 0)
+        if count == 0 or index >= count or count > MAX_FRAGMENT_COUNT:
+            self.invalid_fragments += 1
+            return None
+        if count == 1:
+            self.completed_messages += 1
+            return datagram[FRAGMENT_HEADER.size:]
+
+        self.drop_timed_out(curr_time_ns)
+
+        key = (address, sequence)
+        entry = self.pending.get(key)
+        if entry is None:
+            while len(self.pending) >= self.max_pending:
+                self.pending.pop(next(iter(self.pending)))
+                self.evicted_messages += 1
+            entry = [count, 0, [None] * count, curr_time_ns]
+            self.pending[key] = entry
+        elif entry[0] != count:
+            self.invalid_fragments += 1
+            return None
+
+        fragments = entry[2]
+        if fragments[index] is not None:
+            self.duplicate_fragments += 1
+            return None
+        fragments[index] = datagram[FRAGMENT_HEADER.size:]
+        entry[1] += 1
+        if entry[1] < count:
+            return None
+
+        self.pending.pop(key)
+        self.completed_messages += 1
+        return b"".join(fragments)
+
+    def drop_timed_out(self, curr_time_ns):
+        """Drops all incomplete messages older than the timeout (pending is ordered by first receive time)."""
+        while self.pending:
+            key = next(iter(self.pending))
+            if self.pending[key][3] + self.timeout_ns >= curr_time_ns:
+                break
+            self.pending.pop(key)
+            self.timed_out_messages += 1
+
+
+def split_message(message, sequence):
+    """Splits a message into datagrams with fragment headers, fitting the buffer size."""
+    payload_size = GameInfo.buffer_size - FRAGMENT_HEADER.size
+    count = max(1, -(-len(message) // payload_size))
+    if count > MAX_FRAGMENT_COUNT:
+        print("ERROR: Message of " + str(len(message)) + " bytes is too large to send!")
+        return []
+    return [FRAGMENT_HEADER.pack(sequence, i, count) + message[i * payload_size:(i + 1) * payload_size]
+            for i in range(count)]
+
 
 class UDPSocket:
     """Base class for server & client UDP sockets."""
-    def __init__(self):
-        self.udp_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-        self._udp_socket_list = [self.udp_socket]
-
-        self._buffered_message_address = None
+    def __init__(self, udp_socket=None):
+        self.udp_socket = udp_socket
+        if self.udp_socket is None:
+            self.udp_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self.udp_socket.setblocking(False)
+        self.send_socket = self.udp_socket
+        self.datagram_io = create_datagram_io(self.udp_socket)
+
+        self.fragment_buffer = FragmentBuffer()
+        self.next_message_sequence = 0
+        self.received_messages = []  # (room ID, address, message) of completed messages not yet handled
+        self.send_queue = []  # (datagram, address) to send on the next flush
 
         self.curr_time_ns = 0
 
-    def get_packet_available(self):
-        read_sockets, write_sockets, error_sockets = select.select(self._udp_socket_list, [], [], 0)
-        return len(read_sockets) > 0 or self._buffered_message_address is not None
-
-    def get_packet(self):
-        """Gets available packets and combines & buffers them for split packets."""
-        if self._buffered_message_address is not None:
-            bytes_address_tuple = self._buffered_message_address
-            self._buffered_message_address = None
-            buffer_count = bytes_address_tuple[0][1] - 1
-        else:
-            bytes_address_tuple = self.udp_socket.recvfrom(GameInfo.buffer_size)
-            buffer_count = bytes_address_tuple[0][1] - 1
-
-        packet_id = bytes_address_tuple[0][0]
-        message = bytes_address_tuple[0][2:]
-        address = bytes_address_tuple[1]
-
-        while buffer_count > 0 and self.get_packet_available():
-            bytes_address_tuple = self.udp_socket.recvfrom(GameInfo.buffer_size)
-            new_packet_id = bytes_address_tuple[0][0]
-            if new_packet_id == packet_id and address == bytes_address_tuple[1]:
-                message += bytes_address_tuple[0][2:]
-                buffer_count -= 1
-            else:
-                self._buffered_message_address = bytes_address_tuple
-                break
-
-        return address, message
-
-    def send_packet(self, address, packet):
-        """Sends a packet to the specified address."""
-        dump = pickle.dumps(packet)
-        size = len(dump)
-        header_size = 2
-        buffer_count = int(size / (GameInfo.buffer_size - header_size))
-        if size % (GameInfo.buffer_size - header_size) > 0:
-            buffer_count += 1
-        packet_header = bytes([(packet.creation_time >> 20) % 256, buffer_count])
-        while size > 0:
-            to_send = packet_header
-            if size > GameInfo.buffer_size - header_size:
-                to_send += dump[:(GameInfo.buffer_size - header_size)]
-                dump = dump[(GameInfo.buffer_size - header_size):]
-                size -= GameInfo.buffer_size - header_size
-            else:
-                to_send += dump
-                size = 0
-            self.udp_socket.sendto(to_send, address)
+        # Metrics
+        self.dropped_send_datagrams = 0
+        self.invalid_messages = 0
+
+    def receive_datagrams(self):
+        """Reads all waiting datagrams in batches without blocking, queueing the completed messages."""
+        while True:
+            datagrams = self.datagram_io.receive(self.udp_socket)
+            for datagram, address in datagrams:
+                self.add_datagram(datagram, address)
+            if len(datagrams) < self.datagram_io.batch_size:
+                return
+
+    def add_datagram(self, datagram, address):
+        """Adds a received datagram to the fragment buffer, queueing the message it completed (if any)."""
+        message = self.fragment_buffer.add(address, datagram, self.curr_time_ns)
+        if message is None:
+            return
+        if len(message) < ROOM_HEADER.size:
+            self.invalid_messages += 1
+            return
+        room_id, = ROOM_HEADER.unpack_from(message, 0)
+        self.add_message(room_id, address, message[ROOM_HEADER.size:])
+
+    def add_message(self, room_id, address, message):
+        self.received_messages.append((room_id, address, message))
+
+    def get_messages(self):
+        """Returns all completed messages since the last call as (room ID, address, message) tuples."""
+        self.receive_datagrams()
+        messages = self.received_messages
+        self.received_messages = []
+        return messages
+
+    def queue_packet(self, address, packet, room_id=0):
+        """Queues the datagrams of a packet to the specified address until the next flush."""
+        message = ROOM_HEADER.pack(room_id) + encode_packet(packet)
+        for datagram in split_message(message, self.next_message_sequence):
+            self.send_queue.append((datagram, address))
+        self.next_message_sequence = (self.next_message_sequence + 1) & 0xFFFFFFFF
+
+    def flush(self):
+        """Sends all queued datagrams in batches, dropping the rest if the send buffer is full."""
+        if not self.send_queue:
+            return
+        sent = self.datagram_io.send(self.send_socket, self.send_queue)
+        self.dropped_send_datagrams += len(self.send_queue) - sent
+        self.send_queue.clear()
+
+    def send_packet(self, address, packet, room_id=0):
+        """Sends a packet to the specified address right away."""
+        self.queue_packet(address, packet, room_id)
+        self.flush()
+
+    def get_metrics(self):
+        """Returns the socket's counters (including its fragment buffer's & batched IO's) by name."""
+        fragment_buffer = self.fragment_buffer
+        return {"completed_messages": fragment_buffer.completed_messages,
+                "invalid_fragments": fragment_buffer.invalid_fragments,
+                "duplicate_fragments": fragment_buffer.duplicate_fragments,
+                "timed_out_messages": fragment_buffer.timed_out_messages,
+                "evicted_messages": fragment_buffer.evicted_messages,
+                "invalid_messages": self.invalid_messages,
+                "dropped_send_datagrams": self.dropped_send_datagrams,
+                "send_errors": self.datagram_io.send_errors,
+                "receive_errors": self.datagram_io.receive_errors}
+
+    def print_metrics(self, name):
+        print("INFO: " + name + " metrics: "
+              + ", ".join(key + "=" + str(value) for key, value in self.get_metrics().items()))
 
     def close(self):
         self.udp_socket.close()
 
 
-class UDPServer(UDPSocket):
-    """UDP socket for the server."""
-    def __init__(self):
-        super().__init__()
+class ServerSocket(UDPSocket):
+    """Server UDP socket shared by all rooms of the process, routing received messages by their room ID."""
+    def __init__(self, udp_socket=None):
+        super().__init__(udp_socket=udp_socket)
+        if udp_socket is None:
+            self.udp_socket.bind(("", GameInfo.port))
+        self.rooms = {}  # room ID -> UDPServer
+
+        # Metrics
+        self.unknown_room_messages = 0
+
+    def add_room(self, udp_server):
+        if udp_server.room_id in self.rooms:
+            print("ERROR: Room " + str(udp_server.room_id) + " already exists!")
+            return
+        self.rooms[udp_server.room_id] = udp_server
+
+    def remove_room(self, udp_server):
+        if self.rooms.get(udp_server.room_id) is udp_server:
+            self.rooms.pop(udp_server.room_id)
+
+    def get_metrics(self):
+        metrics = super().get_metrics()
+        metrics["unknown_room_messages"] = self.unknown_room_messages
+        return metrics
+
+    def add_message(self, room_id, address, message):
+        room = self.rooms.get(room_id)
+        if room is None:
+            self.unknown_room_messages += 1
+            return
+        room.received_messages.append((address, message))
+
+
+class UDPServer:
+    """Client handling of a single server room, on its own or a shared server socket."""
+    def __init__(self, room_id=0, server_socket=None):
+        self.room_id = room_id
+        self.owns_server_socket = server_socket is None
+        self.server_socket = server_socket
+        if self.owns_server_socket:
+            self.server_socket = ServerSocket()
+        self.server_socket.add_room(self)
+
+        self.received_messages = []  # (address, message) routed to this room by the server socket
         self.packets_in = []
         self.packets_out = []
 
-        self.udp_socket.bind(("", GameInfo.port))
         self.clients = {}  # client dict: address (str) -> client
 
+        self.curr_time_ns = 0
+
     def update_socket(self):
         """Sends and receives packets from/to buffer when they are due, simulating ping if necessary."""
         # Check get list
-        address, packet = None, None
         # TODO: < should be <=, but that causes stuttering
         while (len(self.packets_in) > 0
                and self.packets_in[0][1].receive_time + int(SIMULATED_PING_NS >> 1) < self.curr_time_ns):
             address, packet = self.packets_in.pop(0)
-
-        if address and packet:
             packet.receive_time = self.curr_time_ns
             client = self.clients.get(address)
             if client is None and not packet.disconnect:
                 client = Client(address, player_name=packet.player_name)
                 self.clients[address] = client
             if client is not None:
+                client.add_inputs(packet.inputs)  # of every packet, even out of order ones
                 if client.last_rx_packet is None or packet.creation_time >= client.last_rx_packet.creation_time:
                     client.last_rx_packet = packet
 
@@ -199,13 +456,19 @@ class UDPServer(UDPSocket):
         while (len(self.packets_out) > 0
                and self.packets_out[0][1].creation_time + int(SIMULATED_PING_NS >> 1) < self.curr_time_ns):
             pkt = self.packets_out.pop(0)
-            super().send_packet(pkt[0], pkt[1])
+            self.server_socket.queue_packet(pkt[0], pkt[1], self.room_id)
+        self.server_socket.flush()  # all due packets of all clients in as few syscalls as possible
 
     def get_client_packets(self):
         """Gets all packets from all clients, setting the corresponding clients' info."""
-        while self.get_packet_available():
-            address, message = self.get_packet()
-            packet = pickle.loads(message)
+        self.server_socket.curr_time_ns = self.curr_time_ns
+        self.server_socket.receive_datagrams()
+        messages = self.received_messages
+        self.received_messages = []
+        for address, message in messages:
+            packet = decode_packet(message)
+            if packet is None:
+                continue
             packet.receive_time = self.curr_time_ns
             # print("received client packet:\n" + packet.to_string() + "\n")
 
@@ -217,18 +480,30 @@ class UDPServer(UDPSocket):
         self.packets_out.append((client.address, state_packet))
         self.update_socket()
 
+    def close(self):
+        self.server_socket.remove_room(self)
+        if self.owns_server_socket:
+            self.server_socket.close()
+
 
 class UDPClient(UDPSocket):
     def __init__(self):
         super().__init__()
 
-    def get_packet(self):
-        """Gets the newest packet from the server."""
-        server_address, message = super().get_packet()
-        state_packet = pickle.loads(message)
-        state_packet.receive_time = self.curr_time_ns
-        return state_packet
+        self.snapshot_history = SnapshotHistory()
+
+    def get_packets(self):
+        """Gets all new packets from the server room joined."""
+        packets = []
+        for room_id, server_address, message in self.get_messages():
+            if room_id != GameInfo.room_id:
+                continue
+            state_packet = decode_packet(message, self.snapshot_history)
+            if state_packet is not None:
+                state_packet.receive_time = self.curr_time_ns
+                packets.append(state_packet)
+        return packets
 
     def send_packet(self, server, client_packet):
-        """Sends the packet to the server."""
-        super().send_packet((GameInfo.server_ip, GameInfo.port), client_packet)
+        """Sends the packet to the server room joined."""
+        super().send_packet((GameInfo.server_ip, GameInfo.port), client_packet, GameInfo.room_id)
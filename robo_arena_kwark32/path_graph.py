@@ -0,0 +1,346 @@
+from heapq import heappush, heappop
+
+import numpy as np
+
+from robot_AI import astar
+from constants import PATH_CLUSTER_SIZE, MAX_SINGLE_ENTRANCE_LENGTH, PATH_REFINED_CLUSTERS
+
+
+class Cluster:
+    """The tiles of a square part of the arena, with cluster local tile indices (y * width + x within the cluster)."""
+    def __init__(self, graph, min_x, min_y, max_x, max_y):
+        self.min_x = min_x
+        self.min_y = min_y
+        self.width = max_x - min_x
+        self.height = max_y - min_y
+        self.costs = [graph.costs[y * graph.width + x] for y in range(min_y, max_y) for x in range(min_x, max_x)]
+        self.neighbors = []  # cluster local indices of the adjacent tiles within the cluster
+        for y in range(self.height):
+            for x in range(self.width):
+                self.neighbors.append([(neighbor_y * self.width + neighbor_x)
+                                       for neighbor_x, neighbor_y in ((x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y))
+                                       if 0 <= neighbor_x < self.width and 0 <= neighbor_y < self.height])
+        self.nodes = []
+
+    def get_local(self, x, y):
+        return (y - self.min_y) * self.width + x - self.min_x
+
+    def get_tile(self, local):
+        return self.min_x + local % self.width, self.min_y + local // self.width
+
+    def search(self, start, reverse=False):
+        """Dijkstra search over all tiles of the cluster from the local start tile.
+        Returns the cost of the paths from start to each tile (-1 = unreachable) & the previous tile of each
+        on its path. With reverse the costs & paths lead from each tile to start & the next tile is returned."""
+        costs = self.costs
+        neighbors = self.neighbors
+        tile_count = len(costs)
+        distances = [-1] * tile_count
+        links = [-1] * tile_count
+        settled = bytearray(tile_count)
+        distances[start] = 0
+        open_heap = [(0, start)]
+        while open_heap:
+            distance, local = heappop(open_heap)
+            if settled[local]:
+                continue
+            settled[local] = 1
+            if reverse:
+                if costs[local] < 0:
+                    continue
+                next_distance = distance + costs[local]
+            for neighbor in neighbors[local]:
+                if settled[neighbor]:
+                    continue
+                if not reverse:
+                    if costs[neighbor] < 0:
+                        continue
+                    next_distance = distance + costs[neighbor]
+                if 0 <= distances[neighbor] <= next_distance:
+                    continue
+                distances[neighbor] = next_distance
+                links[neighbor] = local
+                heappush(open_heap, (next_distance, neighbor))
+        return distances, links
+
+    def get_path(self, links, start, end, reverse=False):
+        """Returns the tile positions of the path from start to end excluding start, from the links of search
+        from start (with reverse the links of a reverse search from end)."""
+        path = []
+        if reverse:
+            local = start
+            while local != end:
+                local = links[local]
+                path.append(self.get_tile(local))
+        else:
+            local = end
+            while local != start:
+                path.append(self.get_tile(local))
+                local = links[local]
+            path.reverse()
+        return path
+
+
+class PathGraph:
+    """Abstract graph of an arena's tile costs for hierarchical pathfinding (HPA*).
+    The tiles are partitioned into square clusters, the graph's nodes are the entrance tiles on the cluster borders
+    & its edges the steps across the borders and the cheapest paths between the entrances within each cluster.
+    The search trees of all entrances within their clusters are kept, so a query only looks up how start & end
+    connect to the entrances of their clusters, routes across the graph & expands the edges to tiles.
+    As the cluster borders can only be crossed at the entrances, the start of each path (the part followed before
+    the next query) is refined with the grid A*.
+    Tile costs are indexed by y * width + x (-1 = blocked), see Arena.get_path_costs."""
+    def __init__(self, costs, width, height, cluster_size=PATH_CLUSTER_SIZE):
+        self.costs = costs
+        self.width = width
+        self.height = height
+        self.cluster_size = cluster_size
+        self.cluster_count_x = (width + cluster_size - 1) // cluster_size
+        self.clusters = [Cluster(self, min_x, min_y, min(min_x + cluster_size, width),
+                                 min(min_y + cluster_size, height))
+                         for min_y in range(0, height, cluster_size) for min_x in range(0, width, cluster_size)]
+        self.components = self.get_components()
+
+        self.node_positions = []  # tile position of each node
+        self.node_clusters = []
+        self.tile_nodes = {}  # tile position -> node
+        self.edges = []  # of each node: (next node, cost)
+        self.add_entrances()
+
+        # forward & reverse search trees of each node within its cluster, see Cluster.search
+        self.trees = []
+        for node, (x, y) in enumerate(self.node_positions):
+            cluster = self.node_clusters[node]
+            local = cluster.get_local(x, y)
+            self.trees.append((cluster.search(local), cluster.search(local, reverse=True)))
+        for node, cluster in enumerate(self.node_clusters):
+            distances = self.trees[node][0][0]
+            for other_node in cluster.nodes:
+                distance = distances[cluster.get_local(*self.node_positions[other_node])]
+                if other_node != node and distance >= 0:
+                    self.edges[node].append((other_node, distance))
+
+    def get_components(self):
+        """Returns the connected area ID of every tile as NumPy array (-1 = blocked)."""
+        costs = self.costs
+        components = [-1] * len(costs)
+        component = 0
+        for index in range(len(costs)):
+            if costs[index] < 0 or components[index] >= 0:
+                continue
+            components[index] = component
+            stack = [index]
+            while stack:
+                current_index = stack.pop()
+                for neighbor_index in self.get_neighbors(current_index):
+                    if costs[neighbor_index] >= 0 and components[neighbor_index] < 0:
+                        components[neighbor_index] = component
+                        stack.append(neighbor_index)
+            component += 1
+        return np.array(components, dtype=np.int32)
+
+    def get_neighbors(self, index):
+        """Returns the tile indices of the adjacent tiles within the arena."""
+        width = self.width
+        x = index % width
+        neighbors = []
+        if index >= width:
+            neighbors.append(index - width)
+        if index + width < len(self.costs):
+            neighbors.append(index + width)
+        if x > 0:
+            neighbors.append(index - 1)
+        if x + 1 < width:
+            neighbors.append(index + 1)
+        return neighbors
+
+    def get_cluster(self, x, y):
+        return self.clusters[(y // self.cluster_size) * self.cluster_count_x + x // self.cluster_size]
+
+    def get_node(self, x, y):
+        node = self.tile_nodes.get((x, y))
+        if node is None:
+            node = len(self.node_positions)
+            self.node_positions.append((x, y))
+            self.tile_nodes[(x, y)] = node
+            cluster = self.get_cluster(x, y)
+            cluster.nodes.append(node)
+            self.node_clusters.append(cluster)
+            self.edges.append([])
+        return node
+
+    def add_entrances(self):
+        """Adds the nodes & edges of the crossings between adjacent clusters, one per run of open border tiles,
+        or two at the ends of runs longer than MAX_SINGLE_ENTRANCE_LENGTH."""
+        size = self.cluster_size
+        for border_x in range(size, self.width, size):  # vertical borders, between border_x - 1 & border_x
+            self.add_border_entrances([(border_x - 1, y) for y in range(self.height)], 1, 0)
+        for border_y in range(size, self.height, size):  # horizontal borders
+            self.add_border_entrances([(x, border_y - 1) for x in range(self.width)], 0, 1)
+
+    def add_border_entrances(self, border_tiles, step_x, step_y):
+        """Adds the entrances of the border between the given tiles & the adjacent tiles in step direction."""
+        costs = self.costs
+        width = self.width
+        run = []
+        for i, (x, y) in enumerate(border_tiles):
+            if i % self.cluster_size == 0:  # runs end at the cluster corners
+                self.add_run_entrances(run, step_x, step_y)
+                run = []
+            if costs[y * width + x] >= 0 and costs[(y + step_y) * width + x + step_x] >= 0:
+                run.append((x, y))
+            else:
+                self.add_run_entrances(run, step_x, step_y)
+                run = []
+        self.add_run_entrances(run, step_x, step_y)
+
+    def add_run_entrances(self, run, step_x, step_y):
+        """Adds the entrance(s) of a run of border tiles open on both sides."""
+        if not run:
+            return
+        crossings = [run[(len(run) - 1) // 2]]
+        if len(run) > MAX_SINGLE_ENTRANCE_LENGTH:
+            crossings = [run[0], run[-1]]
+        for x, y in crossings:
+            node = self.get_node(x, y)
+            other_node = self.get_node(x + step_x, y + step_y)
+            self.edges[node].append((other_node, self.costs[(y + step_y) * self.width + x + step_x]))
+            self.edges[other_node].append((node, self.costs[y * self.width + x]))
+
+    def get_start_components(self, start_index):
+        """Returns the connected areas reachable from the start tile (the ones next to it, if it is blocked)."""
+        component = int(self.components[start_index])
+        if component >= 0:
+            return [component]
+        return [component for component in self.components[self.get_neighbors(start_index)].tolist()
+                if component >= 0]
+
+    def get_closest_reachable(self, start_components, end_x, end_y):
+        """Returns the tile of the start's connected areas closest to the end tile (Manhattan distance),
+        -1 if there is none."""
+        reachable = np.flatnonzero(np.isin(self.components, start_components))
+        if len(reachable) == 0:
+            return -1
+        distances = np.abs(reachable % self.width - end_x) + np.abs(reachable // self.width - end_y)
+        return int(reachable[np.argmin(distances)])
+
+    def find_path(self, start, end):
+        """Calculates a path of tile positions from start to end (both included), like astar.
+        If end can't be reached, the path leads to the reachable tile closest to it."""
+        width = self.width
+        start_x, start_y = start
+        end_x, end_y = end
+        if not (0 <= start_x < width and 0 <= start_y < self.height):
+            return [start]
+        start_index = start_y * width + start_x
+        start_components = self.get_start_components(start_index)
+        if not (0 <= end_x < width and 0 <= end_y < self.height) \
+                or self.components[end_y * width + end_x] not in start_components:
+            end_index = self.get_closest_reachable(start_components, end_x, end_y)
+            if end_index < 0:
+                return [start]
+            end_x = end_index % width
+            end_y = end_index // width
+        if start_x == end_x and start_y == end_y:
+            return [start]
+
+        # connect start & end to the entrances of their clusters
+        start_cluster = self.get_cluster(start_x, start_y)
+        end_cluster = self.get_cluster(end_x, end_y)
+        start_local = start_cluster.get_local(start_x, start_y)
+        end_local = end_cluster.get_local(end_x, end_y)
+        node_count = len(self.node_positions)
+        start_node = node_count
+        end_node = node_count + 1
+        start_edges = []
+        for node in start_cluster.nodes:
+            distance = self.trees[node][1][0][start_local]
+            if distance >= 0:
+                start_edges.append((node, distance))
+        start_links = None
+        if start_cluster is end_cluster:
+            start_distances, start_links = start_cluster.search(start_local)
+            if start_distances[end_local] >= 0:
+                start_edges.append((end_node, start_distances[end_local]))
+        end_distances = [-1] * node_count
+        for node in end_cluster.nodes:
+            end_distances[node] = self.trees[node][0][0][end_local]
+
+        # A* over the abstract graph
+        node_positions = self.node_positions
+        g_scores = [-1] * (node_count + 2)
+        links = [-1] * (node_count + 2)  # previous node
+        closed = bytearray(node_count + 2)
+        g_scores[start_node] = 0
+        open_heap = [(abs(start_x - end_x) + abs(start_y - end_y), start_node)]
+        while open_heap:
+            f, node = heappop(open_heap)
+            if closed[node]:
+                continue
+            closed[node] = 1
+            if node == end_node:
+                break
+            g = g_scores[node]
+            if node == start_node:
+                edges = start_edges
+            else:
+                edges = self.edges[node]
+                if end_distances[node] >= 0:
+                    edges = edges + [(end_node, end_distances[node])]
+            for next_node, cost in edges:
+                if closed[next_node]:
+                    continue
+                next_g = g + cost
+                if 0 <= g_scores[next_node] <= next_g:
+                    continue
+                g_scores[next_node] = next_g
+                links[next_node] = node
+                next_h = 0
+                if next_node != end_node:
+                    next_x, next_y = node_positions[next_node]
+                    next_h = abs(next_x - end_x) + abs(next_y - end_y)
+                heappush(open_heap, (next_g + next_h, next_node))
+
+        if not closed[end_node]:  # only if the graph misses a connection
+            return astar(self.costs, (width, self.height), start, (end_x, end_y))
+
+        # expand the abstract path to tiles
+        nodes = [end_node]
+        while nodes[-1] != start_node:
+            nodes.append(links[nodes[-1]])
+        nodes.reverse()
+        path = [start]
+        for node, next_node in zip(nodes, nodes[1:]):
+            if node == start_node:
+                if next_node == end_node:
+                    path.extend(start_cluster.get_path(start_links, start_local, end_local))
+                else:
+                    path.extend(start_cluster.get_path(self.trees[next_node][1][1], start_local,
+                                                       start_cluster.get_local(*node_positions[next_node]),
+                                                       reverse=True))
+            elif next_node == end_node:
+                path.extend(end_cluster.get_path(self.trees[node][0][1],
+                                                 end_cluster.get_local(*node_positions[node]), end_local))
+            elif self.node_clusters[node] is not self.node_clusters[next_node]:  # border crossing
+                path.append(node_positions[next_node])
+            else:
+                cluster = self.node_clusters[node]
+                path.extend(cluster.get_path(self.trees[node][0][1], cluster.get_local(*node_positions[node]),
+                                             cluster.get_local(*node_positions[next_node])))
+        return self.refine(path)
+
+    def refine(self, path):
+        """Replaces the part of the path within its first PATH_REFINED_CLUSTERS clusters by the cheapest path
+        to the last tile of it, searched with the grid A*."""
+        clusters = []
+        waypoint = 0
+        for index, (x, y) in enumerate(path):
+            cluster = self.get_cluster(x, y)
+            if cluster not in clusters:
+                if len(clusters) == PATH_REFINED_CLUSTERS:
+                    break
+                clusters.append(cluster)
+            waypoint = index
+        if waypoint < 2:
+            return path
+        return astar(self.costs, (self.width, self.height), path[0], path[waypoint]) + path[waypoint + 1:]
@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from robot_AI import astar
+from constants import PATH_PLANNER_WORKERS, PATH_RESULT_DELAY_FRAMES
+
+
+_executor = None
+_graph_executor = None
+
+
+def get_executor():
+    """Returns the path planning worker pool shared by all worlds, created on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PATH_PLANNER_WORKERS, thread_name_prefix="path_planner")
+    return _executor
+
+
+def get_graph_executor():
+    """Returns the single thread pool building the path graphs, created on first use.
+    Separate from the search workers, so the (slow) builds don't hold up the searches."""
+    global _graph_executor
+    if _graph_executor is None:
+        _graph_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="path_graph_builder")
+    return _graph_executor
+
+
+class PathRequest:
+    """A pending path request of a robot AI."""
+    def __init__(self, end, deliver_frame, future):
+        self.end = end
+        self.deliver_frame = deliver_frame
+        self.future = future
+
+
+class PathPlanner:
+    """Plans the (hierarchical A*) paths of a world's AI robots on the shared worker pool.
+    Each robot has at most one pending request: requests for the same target tile are coalesced
+    & a request for another target tile replaces (cancels) the stale one.
+    Results are handed to the robots at the start of the fixed frame PATH_RESULT_DELAY_FRAMES after the request,
+    waiting for the worker if needed, so the AI doesn't depend on the worker timing (e.g. in replays)
+    & the paths are only written by the simulation thread.
+    The path graph of a cost variant is built off-thread when it's first requested & the grid A* is searched
+    until the build is done, so the simulation thread never waits for a build. Which search is used therefore
+    depends on the build timing (both find the way to the same target, but not always the same tiles)."""
+    def __init__(self, world_sim):
+        self.world_sim = world_sim
+        self.requests = {}  # RobotAI -> PathRequest, in request order
+        self.graph_futures = {}  # low health -> future of the path graph build
+
+        # Metrics
+        self.submitted_requests = 0
+        self.coalesced_requests = 0
+        self.cancelled_requests = 0
+
+    def request(self, robot_ai, start, end, low_health=False):
+        """Requests the path from start to end (tile tuples) on the path costs of the robot AI's health,
+        see PathGraph.find_path & astar."""
+        request = self.requests.get(robot_ai)
+        if request is not None:
+            if request.end == end:
+                self.coalesced_requests += 1
+                return
+            request.future.cancel()  # the result of an already running search is dropped
+            self.cancelled_requests += 1
+
+        arena = self.world_sim.arena
+        graph_future = self.graph_futures.get(low_health)
+        if graph_future is None:
+            graph_future = self.graph_futures[low_health] = get_graph_executor().submit(arena.get_path_graph,
+                                                                                        low_health=low_health)
+        if graph_future.done() and graph_future.exception() is None:  # else the build failed, keep the grid A*
+            future = get_executor().submit(graph_future.result().find_path, start, end)
+        else:
+            future = get_executor().submit(astar, arena.get_path_costs(low_health=low_health),
+                                           arena.tile_count.as_tuple(), start, end)
+        self.requests[robot_ai] = PathRequest(end, self.world_sim.physics_frame_count + PATH_RESULT_DELAY_FRAMES,
+                                              future)
+        self.submitted_requests += 1
+
+    def cancel(self, robot_ai):
+        """Cancels the pending request of the robot AI, e.g. when its robot is removed."""
+        request = self.requests.pop(robot_ai, None)
+        if request is not None:
+            request.future.cancel()
+            self.cancelled_requests += 1
+
+    def deliver(self):
+        """Hands the paths due in the current physics frame to their robot AIs."""
+        if not self.requests:
+            return
+        frame = self.world_sim.physics_frame_count
+        due = [robot_ai for robot_ai, request in self.requests.items() if request.deliver_frame <= frame]
+        for robot_ai in due:
+            request = self.requests.pop(robot_ai)
+            robot_ai.set_path(request.future.result(), request.end)
+
+    def clear(self):
+        for request in self.requests.values():
+            request.future.cancel()
+        self.requests.clear()
+        self.graph_futures.clear()
@@ -1,7 +1,13 @@
-from Box2D import b2World, b2ContactListener, b2PolygonShape
+from Box2D import b2World, b2ContactListener
 from combat import hit_shell
 from weapons import Bullet
 from robot import Robot, collide_robot
+from constants import DEFAULT_CATEGORY, ALL_CATEGORIES
+
+
+def is_rewound_hit(bullet, other):
+    """Robot hits of lag compensated bullets are resolved against past robot positions instead."""
+    return bullet.rewind_frames > 0 and isinstance(other, Robot)
 
 
 class ContactListener(b2ContactListener):
@@ -35,15 +41,18 @@ class PhysicsWorld:
 
         self.new_contacts = []
 
-    def add_rect(self, position, width, height, rotation=0, static=True, sensor=False, user_data=None):
+    def add_rect(self, position, width, height, rotation=0, static=True, sensor=False, user_data=None,
+                 category_bits=DEFAULT_CATEGORY, mask_bits=ALL_CATEGORIES):
         """Adds a rectangle with specified dimensions & properties to the physics world and returns it."""
         if static:
-            return self.world.CreateStaticBody(
+            static_body = self.world.CreateStaticBody(
                 position=(position.x, position.y),
-                shapes=b2PolygonShape(box=(round(width / 2), round(height / 2))),
                 angle=rotation,
                 userData=user_data
             )
+            static_body.CreatePolygonFixture(box=(round(width / 2), round(height / 2)),
+                                             categoryBits=category_bits, maskBits=mask_bits)
+            return static_body
 
         dynamic = self.world.CreateDynamicBody(
             position=(position.x, position.y),
@@ -52,7 +61,8 @@ class PhysicsWorld:
         )
 
         dynamic.CreatePolygonFixture(box=(round(width / 2), round(height / 2)),
-                                     density=1000000, friction=1000000, isSensor=sensor)
+                                     density=1000000, friction=1000000, isSensor=sensor,
+                                     categoryBits=category_bits, maskBits=mask_bits)
         # dynamic.bullet = not sensor
 
         return dynamic
@@ -63,10 +73,11 @@ class PhysicsWorld:
             data_a = contact.fixtureA.body.userData
             data_b = contact.fixtureB.body.userData
 
-            if isinstance(data_a, Bullet):
+            # interpolated bullets only hit on the server
+            if isinstance(data_a, Bullet) and not data_a.interpolated and not is_rewound_hit(data_a, data_b):
                 hit_shell(data_a, data_b)
 
-            if isinstance(data_b, Bullet):
+            if isinstance(data_b, Bullet) and not data_b.interpolated and not is_rewound_hit(data_b, data_a):
                 hit_shell(data_b, data_a)
 
             if isinstance(data_a, Robot):
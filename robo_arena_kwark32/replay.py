@@ -0,0 +1,231 @@
+import time
+import struct
+
+from world_sim import WorldSim
+from wire_protocol import pack_input, unpack_input, pack_string, unpack_string
+from lag_compensation import LagCompensation
+from util import Vector
+from globals import GameInfo
+from simulation import print_run_stats
+from constants import REPLAY_FORMAT_VERSION
+
+
+# Replay files are a header followed by an append-only stream of records, written during fixed_update.
+# Only what can't be simulated is recorded: robots joining/leaving & the changes of player inputs,
+# everything else is re-simulated from the same per frame random seeds.
+
+REPLAY_MAGIC = b"RARP"
+# magic, format version, replay flags (see REPLAY_* bits), world start time (frame seeds),
+# followed by the arena name
+REPLAY_HEADER = struct.Struct("<4sBBq")
+# physics frame, robot ID, record kind (see RECORD_* kinds), followed by the kind's values
+RECORD_HEADER = struct.Struct("<iiB")
+# position, rotation, robot flags (see ROBOT_* bits), followed by the player name
+ROBOT_JOIN = struct.Struct("<dddB")
+# input flags, turret rotation (own struct, so the replay format doesn't change with the wire format)
+REPLAY_INPUT = struct.Struct("<Bd")
+# lag compensation rewind frames of the robot's bullets
+REWIND_FRAMES = struct.Struct("<H")
+
+REPLAY_LAG_COMPENSATION = 1
+REPLAY_AI_TARGETS_AI = 2
+
+RECORD_JOIN = 1
+RECORD_INPUT = 2
+RECORD_LEAVE = 3
+RECORD_END = 4
+
+ROBOT_IS_PLAYER = 1
+ROBOT_HAS_AI = 2
+ROBOT_SHOULD_RESPAWN = 4
+
+
+class ReplayRecorder:
+    """Streams the robots joining & leaving and the player input changes of a world sim to a replay file."""
+    def __init__(self, file_path, world_start_time_ns, lag_compensation=False, ai_targets_ai=False):
+        self.file = open(file_path, "wb")
+        flags = (REPLAY_LAG_COMPENSATION if lag_compensation else 0) | (REPLAY_AI_TARGETS_AI if ai_targets_ai else 0)
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_FORMAT_VERSION, flags, world_start_time_ns))
+        self.file.write(pack_string(GameInfo.active_arena))
+
+        self.robot_inputs = {}  # robot ID -> last recorded input values (None for AI robots)
+        self.present_robot_ids = set()
+        self.last_frame = -1
+
+    def record_frame(self, frame, robots):
+        """Records the changes since the last frame, before the robots are updated."""
+        self.last_frame = frame
+        self.present_robot_ids.clear()
+        for robot in robots:
+            self.present_robot_ids.add(robot.robot_id)
+            if robot.robot_id not in self.robot_inputs:
+                self.robot_inputs[robot.robot_id] = None
+                flags = ((ROBOT_IS_PLAYER if robot.is_player else 0) | (ROBOT_HAS_AI if robot.has_ai else 0)
+                         | (ROBOT_SHOULD_RESPAWN if robot.should_respawn else 0))
+                position = robot.sim_body.position
+                self.file.write(b"".join([RECORD_HEADER.pack(frame, robot.robot_id, RECORD_JOIN),
+                                          ROBOT_JOIN.pack(position.x, position.y, robot.sim_body.rotation, flags),
+                                          pack_string(robot.player_name)]))
+            if robot.has_ai:  # AI inputs are re-simulated
+                continue
+            robot_input = pack_input(robot.input, REPLAY_INPUT) + REWIND_FRAMES.pack(robot.rewind_frames)
+            if robot_input != self.robot_inputs[robot.robot_id]:
+                self.robot_inputs[robot.robot_id] = robot_input
+                self.file.write(RECORD_HEADER.pack(frame, robot.robot_id, RECORD_INPUT) + robot_input)
+
+        if len(self.robot_inputs) > len(self.present_robot_ids):
+            for robot_id in [robot_id for robot_id in self.robot_inputs if robot_id not in self.present_robot_ids]:
+                self.robot_inputs.pop(robot_id)
+                self.file.write(RECORD_HEADER.pack(frame, robot_id, RECORD_LEAVE))
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.write(RECORD_HEADER.pack(self.last_frame + 1, -1, RECORD_END))
+        self.file.close()
+        self.file = None
+
+
+class ReplayRecord:
+    """A single record of a replay file."""
+    def __init__(self, frame, robot_id, kind):
+        self.frame = frame
+        self.robot_id = robot_id
+        self.kind = kind
+        self.position = None
+        self.rotation = 0
+        self.robot_flags = 0
+        self.player_name = ""
+        self.input = None
+        self.rewind_frames = 0
+
+
+class Replay:
+    """All records of a replay file."""
+    def __init__(self, world_start_time_ns=0, arena_name="", flags=0):
+        self.world_start_time_ns = world_start_time_ns
+        self.arena_name = arena_name
+        self.flags = flags
+        self.records = []
+        self.end_frame = 0  # physics frames the recorded match ran for
+
+
+def load_replay(file_path):
+    """Reads a replay file, returning None if it is not a (supported) replay.
+    Replays of crashed matches have no end record & end after their last record."""
+    with open(file_path, "rb") as f:
+        buffer = f.read()
+    if len(buffer) < REPLAY_HEADER.size:
+        print("ERROR: " + file_path + " is not a replay file!")
+        return None
+    magic, version, flags, world_start_time_ns = REPLAY_HEADER.unpack_from(buffer, 0)
+    if magic != REPLAY_MAGIC or version != REPLAY_FORMAT_VERSION:
+        print("ERROR: " + file_path + " is not a replay file of format version " + str(REPLAY_FORMAT_VERSION) + "!")
+        return None
+    arena_name, offset = unpack_string(buffer, REPLAY_HEADER.size)
+    replay = Replay(world_start_time_ns=world_start_time_ns, arena_name=arena_name, flags=flags)
+
+    try:
+        while offset < len(buffer):
+            record = ReplayRecord(*RECORD_HEADER.unpack_from(buffer, offset))
+            offset += RECORD_HEADER.size
+            if record.kind == RECORD_JOIN:
+                x, y, record.rotation, record.robot_flags = ROBOT_JOIN.unpack_from(buffer, offset)
+                record.position = Vector(x, y)
+                record.player_name, offset = unpack_string(buffer, offset + ROBOT_JOIN.size)
+            elif record.kind == RECORD_INPUT:
+                record.input, offset = unpack_input(buffer, offset, REPLAY_INPUT)
+                record.rewind_frames = REWIND_FRAMES.unpack_from(buffer, offset)[0]
+                offset += REWIND_FRAMES.size
+            elif record.kind == RECORD_END:
+                replay.end_frame = record.frame
+                break
+            elif record.kind != RECORD_LEAVE:
+                print("ERROR: Unknown replay record kind " + str(record.kind) + "!")
+                break
+            replay.records.append(record)
+            replay.end_frame = record.frame + 1
+    except struct.error:
+        print("WARN: Replay file " + file_path + " is truncated, replaying its complete records.")
+    return replay
+
+
+class ReplayWorldSim(WorldSim):
+    """Re-simulates a recorded match from its replay, without any wall clock coupling."""
+    def __init__(self, replay):
+        self.replay = replay
+        GameInfo.active_arena = replay.arena_name
+        super().__init__()
+
+        self.world_start_time_ns = replay.world_start_time_ns
+        self.ai_targets_ai = replay.flags & REPLAY_AI_TARGETS_AI != 0
+        self.record_index = 0
+
+        self.lag_compensation = None
+        if replay.flags & REPLAY_LAG_COMPENSATION:
+            self.lag_compensation = LagCompensation()
+
+    def apply_records(self):
+        """Applies all records of the current physics frame, as they were recorded before the robots' update."""
+        records = self.replay.records
+        removed_robot = False
+        while self.record_index < len(records) and records[self.record_index].frame <= self.physics_frame_count:
+            record = records[self.record_index]
+            self.record_index += 1
+            if record.kind == RECORD_JOIN:
+                robot = self.robot_class(self, robot_id=record.robot_id,
+                                         is_player=record.robot_flags & ROBOT_IS_PLAYER != 0,
+                                         has_ai=record.robot_flags & ROBOT_HAS_AI != 0,
+                                         should_respawn=record.robot_flags & ROBOT_SHOULD_RESPAWN != 0,
+                                         position=record.position, rotation=record.rotation,
+                                         player_name=record.player_name)
+                self.robots.append(robot)
+                continue
+
+            robot = self.get_robot(record.robot_id)
+            if robot is None:
+                continue
+            if record.kind == RECORD_INPUT:
+                robot.input = record.input
+                robot.rewind_frames = record.rewind_frames
+            elif record.kind == RECORD_LEAVE and not robot.to_remove:  # e.g. disconnected
+                if not robot.is_dead:
+                    robot.die()
+                robot.remove()
+                removed_robot = True
+        if removed_robot:
+            self.clear_dead_robots()
+
+    def get_robot(self, robot_id):
+        for robot in self.robots:
+            if robot.robot_id == robot_id:
+                return robot
+        return None
+
+    def fixed_update(self, delta_time, catchup_frame=False):
+        self.set_seed()
+        self.apply_records()
+        super().fixed_update(delta_time, catchup_frame=catchup_frame)
+        if self.lag_compensation is not None:
+            self.lag_compensation.record(self.physics_frame_count, self.robots)
+
+    def resolve_rewound_hits(self):
+        if self.lag_compensation is not None:
+            self.lag_compensation.resolve_hits(self.physics_frame_count + 1, self.bullets, self.robots)
+
+    def run(self):
+        """Replays the whole match as fast as possible."""
+        self.step(self.replay.end_frame - self.physics_frame_count)
+
+
+def play_replay(file_path):
+    """Replays a replay file headless as fast as possible, printing the final scores."""
+    replay = load_replay(file_path)
+    if replay is None:
+        return None
+    world_sim = ReplayWorldSim(replay)
+    start_time_ns = time.perf_counter_ns()
+    world_sim.run()
+    print_run_stats("Replayed", world_sim, time.perf_counter_ns() - start_time_ns)
+    world_sim.clean_mem()
+    return world_sim
@@ -3,9 +3,9 @@ import math
 import pixmap_resource_manager as prm
 
 from os import path
-from transform import SimBody
+from body_store import SimBodyView, ROBOT_BODY, ROBOT_EXTRAPOLATION_BODY, ROBOT_HEALTH
 from weapons import TankCannonWeapon, weapon_classes
-from util import Vector, draw_img_with_rot, painter_transform_with_rot
+from util import Vector, draw_img_with_rot, painter_transform_with_rot, limit
 from globals import GameInfo, Fonts
 from constants import FIXED_DELTA_TIME, MAX_ROBOT_HEALTH, DEBUG_MODE, ROBOT_COLLISION_SOUND_SPEED_FACTOR
 from constants import MIN_SOUND_DELAY_FRAMES, RESPAWN_DELAY
@@ -25,7 +25,24 @@ robot_texture_path = path.join("textures", "moving", "tanks")
 
 class RobotInfo:
     """Holds all robot info required for full state synchronization of a robot."""
-    def __init__(self, robot):
+    def __init__(self, robot=None):
+        if robot is None:
+            self.robot_body = None
+            self.player_id = -1
+            self.next_bullet_id = 0
+            self.health = 0
+            self.weapon_class_id = 0
+            self.last_shot_frame = 0
+            self.player_name = ""
+            self.last_position = (0, 0)
+            self.effects = []
+            self.effect_data = {}
+            self.input = None
+            self.kills = 0
+            self.is_dead = False
+            self.last_death_frame = 0
+            return
+
         self.robot_body = robot.sim_body.as_tuples()
         self.player_id = robot.robot_id
         self.next_bullet_id = robot.next_bullet_id
@@ -49,7 +66,9 @@ class RobotInfo:
         robot.sim_body.set_tuples(self.robot_body)
         robot.extrapolation_body.set(robot.sim_body)
         robot.revert_effects()
-        robot.effects = [get_effect_from_data_list(e, robot.world_sim) for e in self.effects]
+        # copies, as the data lists are consumed & the same info can be applied repeatedly (interpolation)
+        robot.effects = [get_effect_from_data_list(list(e), robot.world_sim) for e in self.effects]
+        robot.effects = [effect for effect in robot.effects if effect is not None]
         robot.effect_data = self.effect_data
         robot.health = self.health
         robot.kills = self.kills
@@ -82,11 +101,7 @@ class Robot:
 
         self.robot_id = robot_id
         if robot_id < 0:
-            for robot in world_sim.robots:
-                if robot.robot_id >= GameInfo.next_player_id:
-                    GameInfo.next_player_id = robot.robot_id + 1
-            self.robot_id = GameInfo.next_player_id
-            GameInfo.next_player_id += 1
+            self.robot_id = world_sim.get_next_player_id()
         self.next_bullet_id = 0
 
         self.player_name = player_name
@@ -96,10 +111,14 @@ class Robot:
         self.max_accel = GameInfo.robot_max_accel
         self.max_ang_accel = GameInfo.robot_max_ang_accel
 
-        self.sim_body = SimBody(position=position, rotation=rotation,
-                                max_velocity=self.max_velocity, max_ang_velocity=self.max_ang_velocity,
-                                max_accel=self.max_accel, max_ang_accel=self.max_ang_accel)
-        self.extrapolation_body = self.sim_body.copy()
+        # the bodies & health are views onto the robot's row of the world's robot store
+        slot = world_sim.robot_store.allocate()
+        self.sim_body = SimBodyView(world_sim.robot_store, slot, offset=ROBOT_BODY,
+                                    position=position, rotation=rotation,
+                                    max_velocity=self.max_velocity, max_ang_velocity=self.max_ang_velocity,
+                                    max_accel=self.max_accel, max_ang_accel=self.max_ang_accel)
+        self.extrapolation_body = SimBodyView(world_sim.robot_store, slot, offset=ROBOT_EXTRAPOLATION_BODY)
+        self.extrapolation_body.set(self.sim_body)
 
         self.effects = []
         self.effect_data = {}
@@ -112,6 +131,7 @@ class Robot:
         self.size = Robot.size.copy()
 
         self.real_velocity = Vector(0, 0)
+        self.real_local_velocity = Vector(0, 0)
         self.collider_push = Vector(0, 0)
 
         self.last_position = position.copy()
@@ -137,6 +157,8 @@ class Robot:
         self.to_remove = False
         self.is_dead = False
         self.last_death_frame = 0
+        self.interpolated = False  # set by the client from server snapshots instead of simulated
+        self.rewind_frames = 0  # how far behind the server the player sees the other robots (lag compensation)
 
         self.kills = 0
 
@@ -145,6 +167,14 @@ class Robot:
         if has_ai:
             self.robot_ai = RobotAI(self)
 
+    @property
+    def health(self):
+        return self.sim_body.store.values[self.sim_body.row + ROBOT_HEALTH]
+
+    @health.setter
+    def health(self, value):
+        self.sim_body.store.values[self.sim_body.row + ROBOT_HEALTH] = value
+
     @property
     def get_next_bullet_id(self):
         self.next_bullet_id += 1
@@ -183,10 +213,8 @@ class Robot:
         draw_img_with_rot(qp, body_texture, body_texture.width(), body_texture.height(),
                           self.extrapolation_body.position, self.extrapolation_body.rotation)
 
-        turret_pos = self.extrapolation_body.position.copy()
-        turret_offset = Robot.turret_texture_center_offset.copy()
-        turret_offset.rotate(turret_rot)
-        turret_pos.add(turret_offset)
+        turret_pos = Robot.turret_texture_center_offset.rotated(turret_rot)
+        turret_pos.add(self.extrapolation_body.position)
 
         draw_img_with_rot(qp, turret_texture, turret_texture.width(), turret_texture.height(), turret_pos, turret_rot)
 
@@ -211,31 +239,41 @@ class Robot:
 
     def update(self, delta_time):
         """Update the robot position, velocity, weapon, AI if it has one etc."""
+        if self.update_controls(delta_time):
+            self.sim_body.step(delta_time)
+            self.update_from_body()
+
+    def update_controls(self, delta_time, tile_info=None):
+        """Update everything but the body step: respawn, health, effects, AI & input.
+        Returns if the body has to be stepped. The (tile position, tile effect class) under the robot
+        can be passed if they were already looked up for many robots at once."""
         if self.is_dead:
             if self.world_sim.physics_frame_count >= self.last_death_frame + RESPAWN_DELAY:
                 self.respawn()
+                tile_info = None  # looked up before the respawn
             else:
-                return
+                return False
 
         if int(self.health) <= 0:
             self.health = 0
             self.die()
-            return
+            return False
         elif self.health > self.max_health:
             self.health = self.max_health
 
         self.revert_effects()
 
-        tile_position = self.sim_body.position.copy()
-        tile_position.div(GameInfo.arena_tile_size)
-        tile_position.floor()
-        power_up = self.world_sim.arena.power_ups.get((tile_position.x, tile_position.y))
+        if tile_info is None:
+            tile_position = (int(self.sim_body.position.x / GameInfo.arena_tile_size),
+                             int(self.sim_body.position.y / GameInfo.arena_tile_size))
+            tile_info = (tile_position, self.get_center_tile().effect_class)
+        tile_position, tile_effect_class = tile_info
+        power_up = self.world_sim.arena.power_ups.get(tile_position)
         if power_up is not None:
             power_up.apply(self)
 
-        current_tile = self.get_center_tile()
-        if current_tile.effect_class is not None:
-            effect = current_tile.effect_class(FIXED_DELTA_TIME / 2)
+        if tile_effect_class is not None:
+            effect = tile_effect_class(FIXED_DELTA_TIME / 2)
             self.effects.append(effect)
             effect.world_sim = self.world_sim
 
@@ -243,11 +281,9 @@ class Robot:
 
         # last_forward_velocity_goal = self.forward_velocity_goal
 
-        self.real_velocity = self.sim_body.position.copy()
-        self.real_velocity.sub(self.last_position)
+        self.last_position.diff(self.sim_body.position, out=self.real_velocity)
         self.real_velocity.div(FIXED_DELTA_TIME)
-        real_local_velocity = self.real_velocity.copy()
-        real_local_velocity.rotate(-self.sim_body.rotation)
+        real_local_velocity = self.real_velocity.rotated(-self.sim_body.rotation, out=self.real_local_velocity)
 
         self.sim_body.local_velocity.y = real_local_velocity.y
 
@@ -289,10 +325,13 @@ class Robot:
             self.sim_body.local_accel.y = (self.forward_velocity_goal - self.sim_body.local_velocity.y) / delta_time
             self.sim_body.ang_accel = (ang_velocity_goal - self.sim_body.ang_velocity) / delta_time
 
-        self.sim_body.step(delta_time)
+        return True
+
+    def update_from_body(self):
+        """Sync the extrapolation & physics bodies after the body step."""
         self.extrapolation_body.set(self.sim_body)
 
-        self.last_position = Vector(self.physics_body.position[0], self.physics_body.position[1])
+        self.last_position.set_xy(self.physics_body.position[0], self.physics_body.position[1])
 
         self.set_physics_body()
 
@@ -306,27 +345,24 @@ class Robot:
         """Gets the TileType instance currently under the robot."""
         tile_size = GameInfo.arena_tile_size
         tile_count = self.world_sim.arena.tile_count
-        tile_position = self.sim_body.position.copy()
-        tile_position.div(tile_size)
-        tile_position.floor()
-        tile_position.limit_range(Vector(0, 0), tile_count)
-        return self.world_sim.arena.tiles[tile_position.y][tile_position.x]
+        tile_x = limit(int(self.sim_body.position.x / tile_size), 0, tile_count.x - 1)
+        tile_y = limit(int(self.sim_body.position.y / tile_size), 0, tile_count.y - 1)
+        return self.world_sim.arena.tiles[tile_y][tile_x]
 
     def set_physics_body(self):
         """Sync position & rotation from robot to physics body."""
         self.physics_body.transform = ((self.sim_body.position.x, self.sim_body.position.y), self.sim_body.rotation)
-        self.collider_push = self.sim_body.position.copy()
+        self.collider_push.set(self.sim_body.position)
 
     def refresh_from_physics(self):
         """Sync the new position & rotation from the physics body to the robot."""
         if self.physics_body is not None:
-            new_pos = Vector(self.physics_body.position[0], self.physics_body.position[1])
-            self.collider_push = self.collider_push.diff(new_pos)
-            self.sim_body.position = new_pos
+            new_pos = self.sim_body.position
+            new_pos.set_xy(self.physics_body.position[0], self.physics_body.position[1])
+            self.collider_push.diff(new_pos, out=self.collider_push)
 
-            push_vel = self.collider_push.copy()
-            push_vel.mult(FIXED_DELTA_TIME)
-            self.real_velocity.add(push_vel)
+            self.real_velocity.x += self.collider_push.x * FIXED_DELTA_TIME
+            self.real_velocity.y += self.collider_push.y * FIXED_DELTA_TIME
 
     def apply_effects(self, delta_time):
         for effect in self.effects:
@@ -390,10 +426,17 @@ class Robot:
 
     def remove(self):
         self.to_remove = True
+        if self.robot_ai is not None:
+            self.world_sim.path_planner.cancel(self.robot_ai)
         if self.physics_body is not None:
             self.physics_world.world.DestroyBody(self.physics_body)
             self.physics_body = None
 
+    def release_store_slot(self):
+        """Frees the robot's row of the robot store once it is removed from the world."""
+        if self.sim_body.store is self.world_sim.robot_store:
+            self.world_sim.robot_store.detach(self.sim_body.slot, [self.sim_body, self.extrapolation_body])
+
     def set_position(self, position, stop_robot=False, stop_robot_rotation=False):
         """Changes the robot's position with optional velocity reset & changes last_pos to prevent glitches."""
         self.last_position = position.copy()
@@ -402,9 +445,9 @@ class Robot:
         self.last_position.sub(last_pos_change)
         self.sim_body.position = position.copy()
         if stop_robot:
-            self.real_velocity = (0, 0)
-            self.sim_body.velocity = (0, 0)
-            self.sim_body.local_velocity = (0, 0)
+            self.real_velocity = Vector(0, 0)
+            self.sim_body.velocity = Vector(0, 0)
+            self.sim_body.local_velocity = Vector(0, 0)
         if stop_robot_rotation:
             self.sim_body.ang_velocity = 0
         self.extrapolation_body.set(self.sim_body)
@@ -2,27 +2,50 @@ import math
 import random
 import threading
 
+from heapq import heappush, heappop
 from util import Vector
-from constants import MAX_ASTART_ITER
+from flow_field import UNREACHABLE, PENDING
 from globals import GameInfo
 
 
 class RobotAI:
-    """Makes a robot act on its own with A* pathfinding & shooting."""
+    """Makes a robot act on its own with pathfinding & shooting: follows the world's shared flow field
+    towards its target, falling back to its own (hierarchical) A* path if the target can't be reached that way."""
     def __init__(self, robot):
         self.robot = robot
         self.world_sim = robot.world_sim
-        self.shortest_path = None
+        self.shortest_path = None  # A* path, only if the target's flow field doesn't lead to it
+        self.path_end = None  # end tile of shortest_path
+        self.flow_field_path = None  # last path from the flow field, followed while the field is not settled
         self.walkable_check = DrivableTileCheck(self.world_sim.arena, self.robot)
-        self.last_target_position = Vector(-1000000, -1000000)
-        self.calculating_astar = False
         self.target_robot = None
 
-    def calc_astar(self, start, end, arena_size):
-        self.calculating_astar = True
-        self.shortest_path = astar(self.world_sim.arena.tiles, arena_size,
-                                   (start.x, start.y), (end.x, end.y), self.walkable_check)
-        self.calculating_astar = False
+        # scratch vectors of update
+        self.diff = Vector(0, 0)
+        self.target = Vector(0, 0)
+
+    def set_path(self, path, end):
+        """Sets the A* path to the end tile, delivered by the world's path planner."""
+        self.shortest_path = path
+        self.path_end = end
+
+    def get_flow_field_path(self, start, end, arena_size):
+        """Returns the next tiles (start included) towards end from the shared flow field,
+        UNREACHABLE if end can't be reached from start or either is outside the arena,
+        PENDING if the field is not settled up to start yet."""
+        width, height = arena_size
+        if not (0 <= start.x < width and 0 <= start.y < height and 0 <= end.x < width and 0 <= end.y < height):
+            return UNREACHABLE
+        flow_fields = self.world_sim.flow_fields
+        field = flow_fields.get_field(end.x, end.y, low_health=self.walkable_check.low_health)
+        path = [(start.x, start.y)]
+        index = start.y * width + start.x
+        while len(path) < 3 and index != field.target_index:  # a corner ahead can be cut
+            index = flow_fields.get_next(field, index % width, index // width)
+            if index < 0:
+                return index
+            path.append((index % width, index // width))
+        return path
 
     def update(self, delta_time):
         """Calculates new path if necessary & sets robot input for currently needed actions."""
@@ -34,9 +57,9 @@ class RobotAI:
             shortest_distance = 1000000
             closest_player = None
             for other_robot in self.world_sim.robots:
-                if other_robot.is_dead:
+                if other_robot.is_dead or other_robot is self.robot:
                     continue
-                if not other_robot.has_ai:
+                if not other_robot.has_ai or self.world_sim.ai_targets_ai:
                     current_distance = self.robot.sim_body.position.dist(other_robot.sim_body.position)
                     if current_distance < shortest_distance:
                         closest_player = other_robot
@@ -45,7 +68,7 @@ class RobotAI:
 
         # get the shortest path to the closest player
         if self.target_robot is not None:
-            pos_diff = self.robot.sim_body.position.diff(self.target_robot.sim_body.position)
+            pos_diff = self.robot.sim_body.position.diff(self.target_robot.sim_body.position, out=self.diff)
             self.robot.input.turret_rot = pos_diff.signed_angle() + (random.random() - 0.5) * 0.5
 
             arena_size = self.world_sim.arena.tile_count.as_tuple()
@@ -56,39 +79,45 @@ class RobotAI:
             end.div(GameInfo.arena_tile_size)
             end.floor()
 
-            if self.shortest_path is None or not end.equal(self.last_target_position):
-                if not self.calculating_astar:
-                    self.last_target_position = end.copy()
-                    threading.Thread(target=self.calc_astar, args=(start, end, arena_size)).start()
-            elif (len(self.shortest_path) >= 2
-                  and start.equal(Vector(self.shortest_path[1][0], self.shortest_path[1][1]))):
-                self.shortest_path.pop(0)
+            path = self.get_flow_field_path(start, end, arena_size)
+            if path == PENDING:
+                path = self.shortest_path
+                if self.flow_field_path is not None:
+                    path = list(self.flow_field_path)
+            elif path == UNREACHABLE:
+                if self.shortest_path is None or (end.x, end.y) != self.path_end:
+                    self.world_sim.path_planner.request(self, (start.x, start.y), (end.x, end.y),
+                                                        low_health=self.walkable_check.low_health)
+                elif (len(self.shortest_path) >= 2
+                      and start.x == self.shortest_path[1][0] and start.y == self.shortest_path[1][1]):
+                    self.shortest_path.pop(0)
+                path = self.shortest_path
+            else:
+                self.flow_field_path = list(path)
 
             index = 0
-            while self.shortest_path is not None and index + 2 < len(self.shortest_path):
-                tuple_vecs = self.shortest_path[index:index + 3]
-                start = Vector(tuple_vecs[0][0], tuple_vecs[0][1])
-                corner = Vector(tuple_vecs[1][0], tuple_vecs[1][1])
-                end = Vector(tuple_vecs[2][0], tuple_vecs[2][1])
-                direct = start.diff(end)
-                if direct.magnitude() > 1.5:
+            costs = self.walkable_check.get_costs()
+            width = arena_size[0]
+            while path is not None and index + 2 < len(path):
+                (start_x, start_y), (corner_x, corner_y), (end_x, end_y) = path[index:index + 3]
+                if math.sqrt((end_x - start_x) ** 2 + (end_y - start_y) ** 2) > 1.5:
                     index += 1
                     continue
-                inner = start.copy()
-                inner.add(corner.diff(end))
-                if 0 <= self.walkable_check.get_walkable(inner.x, inner.y) <= 2:  # 2 = cut corner cost threshold
-                    self.shortest_path.pop(index + 1)
+                inner_x = start_x + end_x - corner_x
+                inner_y = start_y + end_y - corner_y
+                if 0 <= costs[inner_y * width + inner_x] <= 2:  # 2 = cut corner cost threshold
+                    path.pop(index + 1)
                 index += 1
 
             # take the shortest path to the closest player
             bearing = 0
-            if self.shortest_path is not None:
-                target = self.target_robot.sim_body.position.copy()
-                if len(self.shortest_path) >= 2:
-                    target = Vector(self.shortest_path[1][0], self.shortest_path[1][1])
-                    target.mult(GameInfo.arena_tile_size)
-                    target.add_scalar(GameInfo.arena_tile_size / 2)
-                diff = self.robot.sim_body.position.diff(target)
+            if path is not None:
+                target = self.target_robot.sim_body.position
+                if len(path) >= 2:
+                    target = self.target
+                    target.set_xy(path[1][0] * GameInfo.arena_tile_size + GameInfo.arena_tile_size / 2,
+                                  path[1][1] * GameInfo.arena_tile_size + GameInfo.arena_tile_size / 2)
+                diff = self.robot.sim_body.position.diff(target, out=self.diff)
                 bearing = diff.signed_angle() - self.robot.sim_body.rotation
                 if bearing <= -math.pi:
                     bearing += 2 * math.pi
@@ -116,148 +145,121 @@ class RobotAI:
 
 class WalkableTerrainCheck:
     """Interface to implement a check for walkable terrain for the A* algorithm."""
+    def get_costs(self):
+        """Returns the cost of every tile as flat list, indexed by y * width + x (-1 = blocked)."""
+        return []
+
     def get_walkable(self, x, y):
         return -1
 
 
 class DrivableTileCheck(WalkableTerrainCheck):
-    """Walkable check for this arena setup, checking if blocked & calculating cost otherwise."""
+    """Walkable check for this arena setup, reading the arena's precomputed cost grid of the robot's health."""
     def __init__(self, arena, robot):
         self.arena = arena
         self.robot = robot
 
+    @property
+    def low_health(self):
+        return self.robot.health < self.robot.max_health / 2
+
+    def get_costs(self):
+        return self.arena.get_path_costs(low_health=self.low_health)
+
     def get_walkable(self, x, y):
-        tile = self.arena.tiles[y][x]
-        blocked = tile.has_collision or tile.name == "hole"
-        if blocked:
-            return -1
-        cost = 1
-        if tile.name == "lava":
-            cost = 26
-        elif tile.name == "water":
-            if self.robot.health < self.robot.max_health / 2:
-                cost = 15
-            else:
-                cost = 4
-        elif tile.name == "earth":
-            cost = 2
-        elif tile.name == "fire":
-            cost = 4
-        elif tile.name.startswith("portal_"):
-            cost = 15
-        return cost
-
-
-class Node:
-    """Node for the A* algorithm."""
-    def __init__(self, parent=None, position=None):
-        self.parent = parent
-        self.position = position
-
-        self.g = 0
-        self.h = 0
-        self.f = 0
-
-    def __eq__(self, other):
-        return self.position == other.position
-
-
-def astar(tiles, arena_size, start, end, walkable_check):
-    """Calculates the shortest path from start to end, stopping after maximum iteration count."""
-    # Create start and end node
-    start_node = Node(None, start)
-    start_node.g = start_node.h = start_node.f = 0
-    end_node = Node(None, end)
-    end_node.g = end_node.h = end_node.f = 0
-
-    # Initialize open and closed list
-    open_list = []
-    closed_list = []
-
-    # Add start node
-    open_list.append(start_node)
-
-    # Loop until end found
-    max_loop_count = MAX_ASTART_ITER
-    while len(open_list) > 0 and max_loop_count > 0:
-        max_loop_count -= 1
-
-        # Get current node
-        current_node = open_list[0]
-        current_index = 0
-        for index, item in enumerate(open_list):
-            if item.f < current_node.f:
-                current_node = item
-                current_index = index
-
-        # Pop current off open list, add to closed list
-        open_list.pop(current_index)
-        closed_list.append(current_node)
-
-        # Found destination
-        if current_node == end_node:
-            path = []
-            current = current_node
-            while current is not None:
-                path.append(current.position)
-                current = current.parent
-            return path[::-1]  # Return reversed path
-
-        # Generate children
-        children = []
-        for new_position in [(0, -1), (0, 1), (-1, 0), (1, 0)]:  # Adjacent squares
-
-            # Get node position
-            node_position = (current_node.position[0] + new_position[0], current_node.position[1] + new_position[1])
-
-            # Make sure within range
-            if node_position[0] > (arena_size[1] - 1) or node_position[0] < 0 or node_position[1] > (
-                    arena_size[0] - 1) or node_position[1] < 0:
+        return self.get_costs()[y * self.arena.tile_count.x + x]
+
+
+class SearchArena:
+    """Preallocated per tile arrays of the A* search (indexed by y * width + x), reused by all searches
+    of a thread on arenas of the same size. Entries are only valid if their generation is the current search's,
+    so they never have to be cleared."""
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        tile_count = width * height
+        self.g_scores = [0] * tile_count
+        self.parents = [-1] * tile_count
+        self.generations = [0] * tile_count  # search generation of the g score & parent
+        self.closed = [0] * tile_count  # search generation the tile was expanded in
+        self.generation = 0
+
+
+_search_arenas = threading.local()
+
+
+def get_search_arena(width, height):
+    """Returns the calling thread's search arena for arenas of the given tile count."""
+    search_arena = getattr(_search_arenas, "search_arena", None)
+    if search_arena is None or search_arena.width != width or search_arena.height != height:
+        search_arena = SearchArena(width, height)
+        _search_arenas.search_arena = search_arena
+    return search_arena
+
+
+def astar(costs, arena_size, start, end):
+    """Calculates the cheapest path of tile positions from start to end (both included) with a binary heap A*.
+    The Manhattan distance heuristic is admissible, as moves are 4-connected & tiles cost at least 1.
+    The tile costs are a flat list indexed by y * width + x (-1 = blocked), see Arena.get_path_costs.
+    If end can't be reached, the path leads to the reached tile closest to it."""
+    width, height = arena_size
+    start_x, start_y = start
+    end_x, end_y = end
+    if not (0 <= start_x < width and 0 <= start_y < height):
+        return [start]
+
+    search_arena = get_search_arena(width, height)
+    search_arena.generation += 1
+    generation = search_arena.generation
+    g_scores = search_arena.g_scores
+    parents = search_arena.parents
+    generations = search_arena.generations
+    closed = search_arena.closed
+
+    start_index = start_y * width + start_x
+    end_index = end_y * width + end_x
+    g_scores[start_index] = 0
+    parents[start_index] = -1
+    generations[start_index] = generation
+
+    closest_index = start_index
+    closest_h = abs(start_x - end_x) + abs(start_y - end_y)
+    open_heap = [(closest_h, closest_h, start_index)]  # f, h (prefers nodes closer to end on equal f), tile index
+    while open_heap:
+        f, h, index = heappop(open_heap)
+        if closed[index] == generation:  # already expanded with a lower f
+            continue
+        closed[index] = generation
+        if h < closest_h:
+            closest_h = h
+            closest_index = index
+        if index == end_index:
+            break
+
+        x = index % width
+        y = index // width
+        g = g_scores[index]
+        for next_x, next_y in ((x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)):  # adjacent tiles
+            if next_x < 0 or next_y < 0 or next_x >= width or next_y >= height:
                 continue
-
-            # Make sure walkable terrain
-            if walkable_check.get_walkable(node_position[0], node_position[1]) < 0:
+            next_index = next_y * width + next_x
+            if closed[next_index] == generation:
                 continue
-
-            # Create new node
-            new_node = Node(current_node, node_position)
-
-            # Append
-            children.append(new_node)
-
-        # Loop through children
-        for child in children:
-
-            # Child is on the closed list
-            to_continue = False
-            for closed_child in closed_list:
-                if child == closed_child:
-                    to_continue = True
-                    break
-            if to_continue:
+            cost = costs[next_index]
+            if cost < 0:
                 continue
-
-            # Create f, g, and h values
-            child.g = current_node.g + walkable_check.get_walkable(child.position[0], child.position[1])
-            child.h = ((child.position[0] - end_node.position[0]) ** 2) + (
-                    (child.position[1] - end_node.position[1]) ** 2)
-            child.f = child.g + child.h
-
-            # Child is already in the open list
-            to_continue = False
-            for open_node in open_list:
-                if child == open_node and child.g > open_node.g:
-                    to_continue = True
-                    break
-            if to_continue:
+            next_g = g + cost
+            if generations[next_index] == generation and next_g >= g_scores[next_index]:
                 continue
-
-            # Add the child to the open list
-            open_list.append(child)
+            g_scores[next_index] = next_g
+            parents[next_index] = index
+            generations[next_index] = generation
+            next_h = abs(next_x - end_x) + abs(next_y - end_y)
+            heappush(open_heap, (next_g + next_h, next_h, next_index))
 
     path = []
-    current = current_node
-    while current is not None:
-        path.append(current.position)
-        current = current.parent
-    return path[::-1]  # Return reversed path
+    index = closest_index
+    while index >= 0:
+        path.append((index % width, index // width))
+        index = parents[index]
+    return path[::-1]
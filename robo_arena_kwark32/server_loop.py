@@ -0,0 +1,52 @@
+import selectors
+
+
+class ServerLoop:
+    """Event driven main loop for headless server world sims, blocking on their sockets until datagrams arrive
+    or the next fixed frame is due instead of polling."""
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.world_sims = []
+        self.room_counts = {}  # server socket -> number of world sims (rooms) using it
+        self.server_sockets = []  # all server sockets ever used, to log their metrics when the loop ends
+        self.running = True
+
+    def add_world_sim(self, world_sim):
+        self.world_sims.append(world_sim)
+        server_socket = world_sim.udp_socket.server_socket
+        room_count = self.room_counts.get(server_socket, 0)
+        if server_socket not in self.server_sockets:
+            self.server_sockets.append(server_socket)
+        if room_count == 0:
+            self.selector.register(server_socket.udp_socket, selectors.EVENT_READ, server_socket)
+        self.room_counts[server_socket] = room_count + 1
+
+    def remove_world_sim(self, world_sim):
+        self.world_sims.remove(world_sim)
+        server_socket = world_sim.udp_socket.server_socket
+        self.room_counts[server_socket] -= 1
+        if self.room_counts[server_socket] == 0:
+            self.room_counts.pop(server_socket)
+            self.selector.unregister(server_socket.udp_socket)
+
+    def run(self):
+        try:
+            while self.running and self.world_sims:
+                self.update()
+        finally:
+            self.selector.close()
+            for server_socket in self.server_sockets:
+                server_socket.print_metrics("Server socket")
+
+    def update(self):
+        """Waits for datagrams until a fixed frame is due, draining each ready socket in one batch,
+        then updates all world sims that are due."""
+        timeout_ns = min(world_sim.get_time_until_fixed_update_ns() for world_sim in self.world_sims)
+        if timeout_ns > 0:
+            for key, events in self.selector.select(timeout_ns / 1000000000):
+                key.data.receive_datagrams()
+            return
+
+        for world_sim in self.world_sims:
+            if world_sim.get_time_until_fixed_update_ns() <= 0:
+                world_sim.update_world()
@@ -0,0 +1,148 @@
+import os
+import time
+import socket
+import struct
+import selectors
+import multiprocessing
+
+from globals import GameInfo
+from networking import UDPSocket, ServerSocket, UDPServer
+from server_loop import ServerLoop
+from server_world_sim import ServerWorldSim
+from batched_io import create_datagram_io
+from constants import s_to_ns
+
+
+# client IPv4 address, client port, room ID, in front of every message forwarded to a worker
+FORWARD_HEADER = struct.Struct("<4sHH")
+FORWARD_BUFFER_SIZE = 1 << 18
+WORKER_CHECK_INTERVAL_NS = s_to_ns(1)
+
+
+class ShardSocket(ServerSocket):
+    """Server socket of a worker process, receiving the messages of its rooms from the dispatcher
+    & sending directly from the shared public socket."""
+    def __init__(self, public_socket, channel):
+        super().__init__(udp_socket=channel)
+        self.send_socket = public_socket
+        self.send_socket.setblocking(False)
+        self.datagram_io = create_datagram_io(self.send_socket)
+
+    def receive_datagrams(self):
+        while True:
+            try:
+                data = self.udp_socket.recv(FORWARD_BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            if len(data) < FORWARD_HEADER.size:
+                self.invalid_messages += 1
+                continue
+            ip, port, room_id = FORWARD_HEADER.unpack_from(data, 0)
+            self.add_message(room_id, (socket.inet_ntoa(ip), port), data[FORWARD_HEADER.size:])
+
+
+def run_worker(room_ids, public_socket, channel):
+    """Worker process main, running its rooms in a server loop."""
+    shard_socket = ShardSocket(public_socket, channel)
+    server_loop = ServerLoop()
+    for room_id in room_ids:
+        server_loop.add_world_sim(ServerWorldSim(udp_socket=UDPServer(room_id, shard_socket)))
+    try:
+        server_loop.run()
+    except KeyboardInterrupt:
+        pass
+
+
+class ShardSupervisor(UDPSocket):
+    """Shards the rooms across worker processes, restarting them if they die.
+    Owns the public socket & dispatches the reassembled client messages to the worker running their room."""
+    def __init__(self, room_count, worker_count=0):
+        super().__init__()
+        self.udp_socket.bind(("", GameInfo.port))
+
+        if worker_count <= 0:
+            worker_count = os.cpu_count() or 1
+        worker_count = min(worker_count, room_count)
+        self.worker_room_ids = [list(range(i, room_count, worker_count)) for i in range(worker_count)]
+
+        # fork, so workers inherit the headless setup & public socket (sharding is only supported on Unix)
+        self.context = multiprocessing.get_context("fork")
+        self.workers = [None] * worker_count  # process per worker
+        self.channels = [None] * worker_count  # dispatcher end of the socket pair per worker
+        self.room_channels = {}  # room ID -> dispatcher end of its worker's socket pair
+
+        self.selector = selectors.DefaultSelector()
+        self.running = True
+
+        # Metrics
+        self.unknown_room_messages = 0
+        self.dropped_forward_messages = 0
+        self.restarted_workers = 0
+
+    def start_worker(self, index):
+        if self.channels[index] is not None:
+            self.channels[index].close()
+        channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        channel.setblocking(False)
+        process = self.context.Process(target=run_worker, daemon=True, name="robo-arena-worker-" + str(index),
+                                       args=(self.worker_room_ids[index], self.udp_socket, worker_channel))
+        process.start()
+        worker_channel.close()
+
+        self.workers[index] = process
+        self.channels[index] = channel
+        for room_id in self.worker_room_ids[index]:
+            self.room_channels[room_id] = channel
+
+    def check_workers(self):
+        for i, process in enumerate(self.workers):
+            if not process.is_alive():
+                print("ERROR: Worker " + str(i) + " exited with code " + str(process.exitcode) + ", restarting it!")
+                self.restarted_workers += 1
+                self.start_worker(i)
+
+    def get_metrics(self):
+        metrics = super().get_metrics()
+        metrics["unknown_room_messages"] = self.unknown_room_messages
+        metrics["dropped_forward_messages"] = self.dropped_forward_messages
+        metrics["restarted_workers"] = self.restarted_workers
+        return metrics
+
+    def add_message(self, room_id, address, message):
+        channel = self.room_channels.get(room_id)
+        if channel is None:
+            self.unknown_room_messages += 1
+            return
+        try:
+            channel.send(FORWARD_HEADER.pack(socket.inet_aton(address[0]), address[1], room_id) + message)
+        except (BlockingIOError, ConnectionRefusedError):  # worker is busy or dead
+            self.dropped_forward_messages += 1
+        except OSError as e:  # e.g. message too large for the socket pair, mustn't stop the dispatcher
+            self.dropped_forward_messages += 1
+            print("WARN: Could not forward message to room " + str(room_id) + ": " + str(e))
+
+    def run(self):
+        for i in range(len(self.workers)):
+            self.start_worker(i)
+        self.selector.register(self.udp_socket, selectors.EVENT_READ)
+
+        next_check_time_ns = time.time_ns() + WORKER_CHECK_INTERVAL_NS
+        try:
+            while self.running:
+                timeout_ns = next_check_time_ns - time.time_ns()
+                if timeout_ns <= 0:
+                    self.check_workers()
+                    next_check_time_ns += WORKER_CHECK_INTERVAL_NS
+                    continue
+                if self.selector.select(timeout_ns / 1000000000):
+                    self.curr_time_ns = time.time_ns()
+                    self.receive_datagrams()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.selector.close()
+            self.print_metrics("Dispatcher socket")
+            for process in self.workers:
+                if process is not None and process.is_alive():
+                    process.terminate()
+            self.close()
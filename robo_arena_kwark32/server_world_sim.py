@@ -1,5 +1,9 @@
 from world_sim import WorldSim
 from networking import UDPServer, StatePacket
+from globals import GameInfo
+from wire_protocol import build_snapshot
+from interest import InterestManager
+from lag_compensation import LagCompensation
 from constants import CLIENT_DISCONNECT_TIMEOUT_NS
 from robot import RobotInfo
 from weapons import BulletInfo
@@ -7,10 +11,21 @@ from weapons import BulletInfo
 
 class ServerWorldSim(WorldSim):
     """Additions/overrides for multiplayer server (graphical host or headless) world sim."""
-    def __init__(self):
+    def __init__(self, udp_socket=None):
         super().__init__()
 
-        self.udp_socket = UDPServer()
+        self.udp_socket = udp_socket
+        if self.udp_socket is None:
+            self.udp_socket = UDPServer()
+        self.interest = InterestManager()
+        self.lag_compensation = LagCompensation()
+
+        if GameInfo.replay_record_path is not None:
+            replay_path = GameInfo.replay_record_path
+            if GameInfo.server_room_count > 1:
+                replay_path += "." + str(self.udp_socket.room_id)
+            self.start_replay_recording(replay_path, lag_compensation=True)
+        self.last_full_snapshot = None
 
     def clean_mem(self):
         super().clean_mem()
@@ -22,11 +37,17 @@ class ServerWorldSim(WorldSim):
         self.set_seed()
 
         self.udp_socket.update_socket()
+        if self.last_full_snapshot is not None:
+            # last frame's packets are sent now, so their shared packed records aren't needed anymore
+            self.last_full_snapshot.clear_caches()
+            self.last_full_snapshot = None
 
         self.udp_socket.get_client_packets()
 
         disconnected_clients = []
         for client in self.udp_socket.clients.values():
+            if client.player_id < 0:
+                client.player_id = self.get_next_player_id()
             if client.last_rx_packet is None:
                 continue
             if (client.last_rx_packet.receive_time + CLIENT_DISCONNECT_TIMEOUT_NS < self.curr_time_ns
@@ -42,7 +63,13 @@ class ServerWorldSim(WorldSim):
                     existing_robot = self.create_enemy_robot(robot_id=client.player_id, has_ai=False,
                                                              should_respawn=True, player_name=client.player_name)
                     client.robot = existing_robot
-                existing_robot.input = client.last_rx_packet.player_input
+                existing_robot.input = client.pop_input(self.physics_frame_count)
+                # the client last saw the world at its acknowledged frame, this frame's state is the next one
+                ack_frame = client.last_rx_packet.ack_frame
+                existing_robot.rewind_frames = 0
+                if ack_frame >= 0:
+                    existing_robot.rewind_frames = self.lag_compensation.clamp_rewind_frames(
+                        self.physics_frame_count + 1 - ack_frame)
         for disconnected in disconnected_clients:
             if disconnected.robot is not None:
                 disconnected.robot.die()
@@ -52,9 +79,10 @@ class ServerWorldSim(WorldSim):
 
         self.clear_dead_robots()
 
-        super().fixed_update(delta_time)
+        super().fixed_update(delta_time, catchup_frame=catchup_frame)
+        self.lag_compensation.record(self.physics_frame_count, self.robots)
 
-        # TODO: maybe not build robot and bullet info lists fresh every frame
+        # Infos & snapshot are built once per frame and shared by all clients, only the header is per client
         robot_info_list = []
         for robot in self.robots:
             robot_info_list.append(RobotInfo(robot))
@@ -62,13 +90,49 @@ class ServerWorldSim(WorldSim):
         for bullet in self.bullets:
             bullet_info_list.append(BulletInfo(bullet))
 
+        self.interest.update(robot_info_list, bullet_info_list)
+
         state_packet = StatePacket(creation_time=self.curr_time_ns, world_start_time=self.world_start_time_ns,
                                    physics_frame=self.physics_frame_count, robots=robot_info_list,
-                                   bullets=bullet_info_list, power_ups=self.arena.power_ups)
+                                   bullets=bullet_info_list, power_ups=self.arena.power_ups,
+                                   scores=self.get_scores())
+        full_snapshot = None
+        if not GameInfo.use_pickle_protocol:
+            full_snapshot = build_snapshot(self.physics_frame_count, robot_info_list, bullet_info_list,
+                                           state_packet.power_ups, state_packet.scores)
 
         for client in self.udp_socket.clients.values():
             if client.last_rx_packet is not None:
                 state_packet.player_id = client.player_id
                 state_packet.client_rtt_start = client.last_rx_packet.creation_time
+                state_packet.input_ack_frame = client.input_ack_frame
+                self.set_relevant_state(client, state_packet, robot_info_list, bullet_info_list, full_snapshot)
                 self.udp_socket.send_packet(client, state_packet)
                 state_packet = state_packet.semi_copy()
+
+        self.last_full_snapshot = full_snapshot
+
+    def resolve_rewound_hits(self):
+        # the bullets already moved, so their positions are compared to the robots of the next frame's state
+        self.lag_compensation.resolve_hits(self.physics_frame_count + 1, self.bullets, self.robots)
+
+    def set_relevant_state(self, client, state_packet, robot_info_list, bullet_info_list, full_snapshot):
+        """Sets only the robots & bullets relevant to the client, and the delta baseline for its packet."""
+        robot_ids, bullet_keys = self.interest.get_relevant(client.player_id)
+        if robot_ids is None:
+            state_packet.robots = robot_info_list
+            state_packet.bullets = bullet_info_list
+            snapshot = full_snapshot
+        else:
+            state_packet.robots = [info for info in robot_info_list if info.player_id in robot_ids]
+            state_packet.bullets = [info for info in bullet_info_list
+                                    if (info.source_id, info.bullet_id) in bullet_keys]
+            snapshot = None
+            if full_snapshot is not None:
+                snapshot = full_snapshot.subset(robot_ids, bullet_keys)
+
+        if snapshot is not None:
+            state_packet.snapshot = snapshot
+            # only send changes since the client's last applied snapshot, or all if it is too old
+            state_packet.baseline = client.snapshot_history.get(client.last_rx_packet.ack_frame)
+            client.snapshot_history.add(snapshot)
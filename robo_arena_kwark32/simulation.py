@@ -0,0 +1,52 @@
+import time
+import random
+
+from world_sim import WorldSim
+from globals import GameInfo
+
+
+class SimulationWorldSim(WorldSim):
+    """Headless AI only free for all, stepped as fast as possible for bots, tests & balance simulations."""
+    def __init__(self, robot_count, seed=None):
+        super().__init__()
+
+        self.ai_targets_ai = True
+        if seed is not None:
+            self.world_start_time_ns = seed  # the frame seeds only depend on it, so matches are reproducible
+
+        random.seed(self.world_start_time_ns)
+        for i in range(robot_count):
+            self.spawn_random_enemy(should_respawn=True)
+
+    def fixed_update(self, delta_time, catchup_frame=False):
+        self.set_seed()
+        super().fixed_update(delta_time, catchup_frame=catchup_frame)
+
+
+def print_run_stats(action, world_sim, duration_ns):
+    """Prints how fast the frames of a headless run were simulated & the final scores."""
+    duration_s = max(duration_ns / 1000000000, 1e-9)
+    print("INFO: " + action + " " + str(world_sim.physics_frame_count) + " frames in " + str(round(duration_s, 3))
+          + "s (" + str(round(world_sim.physics_frame_count / duration_s)) + " frames/s)")
+    for name, kills in world_sim.get_scores():
+        print("  " + (name if name else "(AI)") + ": " + str(kills) + " kills")
+
+
+def run_simulations(frame_count, robot_count, match_count=1, seed=None):
+    """Simulates matches of frame_count frames back to back, recording a replay of each if selected."""
+    for match in range(match_count):
+        match_seed = seed
+        if seed is not None:
+            match_seed = seed + match
+        world_sim = SimulationWorldSim(robot_count, seed=match_seed)
+        if GameInfo.replay_record_path is not None:
+            replay_path = GameInfo.replay_record_path
+            if match_count > 1:
+                replay_path += "." + str(match)
+            world_sim.start_replay_recording(replay_path)
+
+        start_time_ns = time.perf_counter_ns()
+        world_sim.step(frame_count)
+        print_run_stats("Simulated match " + str(match) + " (seed " + str(world_sim.world_start_time_ns) + "):",
+                        world_sim, time.perf_counter_ns() - start_time_ns)
+        world_sim.clean_mem()
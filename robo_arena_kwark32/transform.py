@@ -1,8 +1,14 @@
+import math
+
+import numpy as np
+
 from util import Vector, limit, limit_rot
 
 
-def pos_change_from_velocity_accel(delta_time, velocity, accel, max_velocity, max_accel, dont_modify=False):
-    """Calculates the position change from a given velocity & acceleration (can update accel & velocity if needed)."""
+def pos_change_from_velocity_accel(delta_time, velocity, accel, max_velocity, max_accel, dont_modify=False,
+                                   out=None):
+    """Calculates the position change from a given velocity & acceleration (can update accel & velocity if needed).
+    The position change is written to out instead of a new vector if given."""
     if dont_modify:
         accel = accel.copy()
 
@@ -17,9 +23,12 @@ def pos_change_from_velocity_accel(delta_time, velocity, accel, max_velocity, ma
 
     velocity.limit_magnitude(max_velocity)
 
-    position_change = velocity.copy()
-    position_change.mult(delta_time)
-    return position_change
+    if out is None:
+        out = velocity.copy()
+    else:
+        out.set(velocity)
+    out.mult(delta_time)
+    return out
 
 
 def rot_change_from_velocity_accel(delta_time, ang_velocity, ang_accel, max_ang_velocity, max_ang_accel,
@@ -42,6 +51,12 @@ def rot_change_from_velocity_accel(delta_time, ang_velocity, ang_accel, max_ang_
     return ang_velocity * delta_time
 
 
+# scratch vectors of the body steps, which only run on the main thread
+_movement = Vector(0, 0)
+_pos_change = Vector(0, 0)
+_local_pos_change = Vector(0, 0)
+
+
 class SimpleBody:
     """Simple transform & body (without physics) for bullets."""
     def __init__(self, position=Vector(0, 0), rotation=0):
@@ -80,8 +95,7 @@ class SimpleBody:
             self._was_reset = True
             return
 
-        movement = self.local_velocity.copy()
-        movement.rotate(self.rotation)
+        movement = self.local_velocity.rotated(self.rotation, out=_movement)
         movement.mult(delta_time)
         self.position.add(movement)
 
@@ -177,14 +191,13 @@ class SimBody:
             self.max_ang_accel = 0
 
         pos_change = pos_change_from_velocity_accel(delta_time, self.velocity, self.accel,
-                                                    self.max_velocity, self.max_accel)
+                                                    self.max_velocity, self.max_accel, out=_pos_change)
         local_pos_change = pos_change_from_velocity_accel(delta_time, self.local_velocity, self.local_accel,
-                                                          self.max_velocity, self.max_accel)
+                                                          self.max_velocity, self.max_accel, out=_local_pos_change)
         local_pos_change.rotate(self.rotation)
         pos_change.add(local_pos_change)
         pos_change.limit_magnitude(self.max_velocity * delta_time)
-        pos_change.add(self.position)
-        self.position = pos_change
+        self.position.add(pos_change)
 
         rot_change = rot_change_from_velocity_accel(delta_time, self.ang_velocity, self.ang_accel,
                                                     self.max_ang_velocity, self.max_ang_accel, body=self)
@@ -205,3 +218,97 @@ class SimBody:
         self.local_velocity = Vector(0, 0)  # in px/s, local to robot
 
         self._was_reset = True
+
+
+def limit_magnitudes(x, y, max_magnitude):
+    """Vectorized Vector.limit_magnitude for arrays of x & y values (in place)."""
+    magnitude = np.sqrt(x * x + y * y)
+    over = magnitude > max_magnitude
+    factor = np.divide(max_magnitude, magnitude, out=np.ones_like(magnitude), where=over)
+    x *= factor
+    y *= factor
+
+
+def integrate_sim_body_values(values, delta_time):
+    """Steps the SimBody values of an array with one row per body, vectorized with NumPy but with the same math
+    (& quirks) as SimBody.step. The columns are position x & y, rotation, velocity x & y, accel x & y,
+    local velocity x & y, local accel x & y, angular velocity, angular accel and the 4 max values.
+    Results can differ in the last bits from SimBody.step, as NumPy's sin & cos may be implemented differently."""
+    (x, y, rotation, vx, vy, ax, ay, local_vx, local_vy, local_ax, local_ay,
+     ang_velocity, ang_accel, max_velocity, max_ang_velocity, max_accel, max_ang_accel) = values.T
+    max_values = values[:, 13:17]
+    np.maximum(max_values, 0, out=max_values)
+
+    # pos_change_from_velocity_accel, whose velocity change is the (limited) accel itself, scaled by delta time
+    limit_magnitudes(ax, ay, max_accel)
+    ax *= delta_time
+    ay *= delta_time
+    vx += ax
+    vy += ay
+    limit_magnitudes(vx, vy, max_velocity)
+    limit_magnitudes(local_ax, local_ay, max_accel)
+    local_ax *= delta_time
+    local_ay *= delta_time
+    local_vx += local_ax
+    local_vy += local_ay
+    limit_magnitudes(local_vx, local_vy, max_velocity)
+
+    cos = np.cos(rotation)
+    sin = np.sin(rotation)
+    change_x = vx * delta_time + (local_vx * delta_time * cos - local_vy * delta_time * sin)
+    change_y = vy * delta_time + (local_vx * delta_time * sin + local_vy * delta_time * cos)
+    limit_magnitudes(change_x, change_y, max_velocity * delta_time)
+    x[:] = change_x + x
+    y[:] = change_y + y
+
+    # rot_change_from_velocity_accel & limit_rot
+    np.clip(ang_accel, -max_ang_accel, max_ang_accel, out=ang_accel)
+    ang_velocity += ang_accel * delta_time
+    np.clip(ang_velocity, -max_ang_velocity, max_ang_velocity, out=ang_velocity)
+    rotation += ang_velocity * delta_time
+    while True:
+        over = rotation >= math.tau
+        under = rotation < 0
+        if not over.any() and not under.any():
+            break
+        rotation[over] -= math.tau
+        rotation[under] += math.tau
+
+
+def step_sim_bodies(bodies, delta_time):
+    """Steps many SimBodies at once with integrate_sim_body_values.
+    Bodies of a BodyStore are better stepped with body_store.step_body_views, which skips the attribute copies."""
+    stepped = []
+    for body in bodies:
+        if body._was_reset:
+            body._was_reset = False
+        else:
+            stepped.append(body)
+    if not stepped:
+        return
+
+    values = np.array([(body.position.x, body.position.y, body.rotation,
+                        body.velocity.x, body.velocity.y, body.accel.x, body.accel.y,
+                        body.local_velocity.x, body.local_velocity.y, body.local_accel.x, body.local_accel.y,
+                        body.ang_velocity, body.ang_accel,
+                        body.max_velocity, body.max_ang_velocity, body.max_accel, body.max_ang_accel)
+                       for body in stepped], dtype=np.float64)
+    limited_max_values = (values[:, 13:17] < 0).any()
+    integrate_sim_body_values(values, delta_time)
+
+    for body, (x, y, rotation, vx, vy, ax, ay, local_vx, local_vy, local_ax, local_ay, ang_velocity, ang_accel) \
+            in zip(stepped, values[:, :13].tolist()):
+        body.position = Vector(x, y)
+        body.rotation = rotation
+        body.velocity.x, body.velocity.y = vx, vy
+        body.accel.x, body.accel.y = ax, ay
+        body.local_velocity.x, body.local_velocity.y = local_vx, local_vy
+        body.local_accel.x, body.local_accel.y = local_ax, local_ay
+        body.ang_velocity = ang_velocity
+        body.ang_accel = ang_accel
+    if limited_max_values:
+        for body, (max_velocity, max_ang_velocity, max_accel, max_ang_accel) in zip(stepped, values[:, 13:17].tolist()):
+            body.max_velocity = max_velocity
+            body.max_ang_velocity = max_ang_velocity
+            body.max_accel = max_accel
+            body.max_ang_accel = max_ang_accel
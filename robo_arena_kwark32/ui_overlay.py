@@ -68,11 +68,9 @@ class Scoreboard:
         self.font_color = Fonts.score_board_color
         self.font_metrics = QFontMetricsF(self.font)
 
-    def set_scores(self, robots):
-        """Updates scores to draw from the robots."""
-        scores = []
-        for robot in robots:
-            scores.append((robot.player_name, robot.kills))
+    def set_scores(self, scores):
+        """Updates scores to draw from (name, kills) tuples."""
+        scores = list(scores)
         scores.sort(key=lambda tup: tup[1], reverse=True)
         self.score_list = []
         for name, score in scores:
@@ -6,7 +6,11 @@ from globals import GameInfo
 
 
 class Vector:
-    """2D vector class, used in most places where 2D vectors/x-y-values are needed."""
+    """2D vector class, used in most places where 2D vectors/x-y-values are needed.
+    Slotted to keep the many short lived vectors of the simulation small & cheap to allocate,
+    hot paths use the in place & out parameter variants (set, diff(out=...), rotated(out=...)) to avoid them."""
+    __slots__ = ("x", "y", "_x_for_mag", "_y_for_mag", "_mag")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -20,6 +24,14 @@ class Vector:
     def copy(self):
         return Vector(self.x, self.y)
 
+    def set(self, other):
+        self.x = other.x
+        self.y = other.y
+
+    def set_xy(self, x, y):
+        self.x = x
+        self.y = y
+
     def equal(self, other):
         return self.x == other.x and self.y == other.y
 
@@ -58,8 +70,22 @@ class Vector:
     def rotate(self, angle):
         x = self.x
         y = self.y
-        self.x = x * math.cos(angle) - y * math.sin(angle)
-        self.y = x * math.sin(angle) + y * math.cos(angle)
+        cos = math.cos(angle)
+        sin = math.sin(angle)
+        self.x = x * cos - y * sin
+        self.y = x * sin + y * cos
+
+    def rotated(self, angle, out=None):
+        """Returns a rotated copy, written to out instead if given."""
+        if out is None:
+            out = Vector(0, 0)
+        x = self.x
+        y = self.y
+        cos = math.cos(angle)
+        sin = math.sin(angle)
+        out.x = x * cos - y * sin
+        out.y = x * sin + y * cos
+        return out
 
     def magnitude(self):
         if self.x != self._x_for_mag or self.y != self._y_for_mag:
@@ -96,28 +122,31 @@ class Vector:
         self.x = lerp(self.x, other.x, amount)
         self.y = lerp(self.y, other.y, amount)
 
-    def diff(self, other):
-        diff = other.copy()
-        diff.sub(self)
-        return diff
+    def diff(self, other, out=None):
+        """Returns other - self, written to out instead of a new vector if given (can be self or other)."""
+        if out is None:
+            return Vector(other.x - self.x, other.y - self.y)
+        out.x, out.y = other.x - self.x, other.y - self.y
+        return out
 
     def dist(self, other):
-        diff = self.diff(other)
-        return diff.magnitude()
+        x = other.x - self.x
+        y = other.y - self.y
+        return math.sqrt(x * x + y * y)
 
     def dot(self, other):
         return self.x * other.x + self.y * other.y
 
     def signed_angle(self, from_vec=None):
         if from_vec is None:
-            from_vec = Vector(0, 1)
+            from_vec = UP
         dot = from_vec.dot(self)
         det = from_vec.x * self.y - from_vec.y * self.x
         return math.atan2(det, dot)
 
     def angle(self, from_vec=None):
         if from_vec is None:
-            from_vec = Vector(0, 1)
+            from_vec = UP
         mags = self.magnitude() * from_vec.magnitude()
         if mags > 0:
             cos = (self.x * from_vec.x + self.y * from_vec.y) / mags
@@ -128,6 +157,9 @@ class Vector:
         return self.x, self.y
 
 
+UP = Vector(0, 1)  # default reference direction of the angles, never to be changed in place
+
+
 def ns_to_s(ns):
     return (round(ns) >> 10) / 976562.5  # shift to ~us, then float division
 
@@ -169,25 +201,21 @@ def is_object_on_screen(pos, radius=None):
         return True
     if radius is None:
         radius = CameraState.max_object_radius
-    half_screen = GameInfo.window_reference_size.copy()
-    half_screen.div(2)
-    half_screen.add_scalar(radius)
-    return (CameraState.position.x - half_screen.x <= pos.x <= CameraState.position.x + half_screen.x
-            and CameraState.position.y - half_screen.y <= pos.y <= CameraState.position.y + half_screen.y)
+    half_width = GameInfo.window_reference_size.x / 2 + radius
+    half_height = GameInfo.window_reference_size.y / 2 + radius
+    return (CameraState.position.x - half_width <= pos.x <= CameraState.position.x + half_width
+            and CameraState.position.y - half_height <= pos.y <= CameraState.position.y + half_height)
 
 
 def painter_transform_with_rot(qp, position, rotation):
     """Transforms the painter qp to a given position & rotation."""
     qp.save()
-    cam_pos = Vector(0, 0)
+    cam_x = 0
+    cam_y = 0
     if CameraState.position is not None:
-        cam_pos = GameInfo.window_reference_size.copy()
-        cam_pos.div(2)
-        cam_pos.sub(CameraState.position)
-        cam_pos.round()
-    position = position.copy()
-    position.x += CameraState.x_offset
-    qp.translate(round(position.x) + round(cam_pos.x), round(position.y) + round(cam_pos.y))
+        cam_x = round(GameInfo.window_reference_size.x / 2 - CameraState.position.x)
+        cam_y = round(GameInfo.window_reference_size.y / 2 - CameraState.position.y)
+    qp.translate(round(position.x + CameraState.x_offset) + cam_x, round(position.y) + cam_y)
     if rotation != 0:
         qp.rotate(rad_to_deg(rotation))
 
@@ -228,3 +256,11 @@ def is_point_inside_rect(point, top_left, bottom_right):
 
 def lerp(a, b, t):
     return a + t * (b - a)
+
+
+def lerp_rot(a, b, t):
+    """Interpolates between two rotations (in rad) along the shorter direction."""
+    diff = limit_rot(b - a)
+    if diff > math.pi:
+        diff -= math.tau
+    return limit_rot(a + t * diff)
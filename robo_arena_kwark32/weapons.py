@@ -1,18 +1,31 @@
+import math
+
 import pixmap_resource_manager as prm
 
 from os import path
-from transform import SimpleBody
+from body_store import SimpleBodyView, BULLET_BODY, BULLET_EXTRAPOLATION_BODY, BULLET_COLLIDER_OFFSET
+from body_store import BULLET_COLLIDER_HALF_WIDTH, BULLET_COLLIDER_HALF_HEIGHT
 from util import Vector, draw_img_with_rot, limit_rot
-from constants import FIXED_FPS, FIXED_DELTA_TIME
+from constants import FIXED_FPS, FIXED_DELTA_TIME, ALL_CATEGORIES, WALL_CATEGORY
 from sound_manager import SoundManager
 
 
 bullet_texture_path = path.join("textures", "moving", "bullets")
 
+_collider_pos = Vector(0, 0)  # scratch vector of the bullet updates, which only run on the main thread
+
 
 class BulletInfo:
     """Holds all bullet info required for full state synchronization of a bullet."""
-    def __init__(self, bullet):
+    def __init__(self, bullet=None):
+        if bullet is None:
+            self.bullet_id = -1
+            self.bullet_body = None
+            self.bullet_class_id = 0
+            self.source_id = -1
+            self.creation_frame = 0
+            return
+
         self.bullet_id = bullet.bullet_id
         self.bullet_body = bullet.sim_body.as_tuples()
         self.bullet_class_id = bullet.bullet_type.id
@@ -57,19 +70,30 @@ class Bullet:
         self.speed = self.bullet_type.speed
         self.damage = self.bullet_type.damage * damage_factor
 
-        self.sim_body = SimpleBody(position=pos, rotation=rotation)
+        # the bodies are views onto the bullet's row of the world's bullet store
+        slot = world_sim.bullet_store.allocate()
+        self.sim_body = SimpleBodyView(world_sim.bullet_store, slot, offset=BULLET_BODY,
+                                       position=pos, rotation=rotation)
         self.sim_body.local_velocity.y = self.speed
-        self.extrapolation_body = self.sim_body.copy()
+        self.extrapolation_body = SimpleBodyView(world_sim.bullet_store, slot, offset=BULLET_EXTRAPOLATION_BODY)
+        self.extrapolation_body.set(self.sim_body)
 
         self.to_destroy = False
+        self.interpolated = False  # set by the client from server snapshots instead of simulated
+        # robot hits are resolved against the robot positions this many frames ago (lag compensation)
+        self.rewind_frames = 0 if robot is None else robot.rewind_frames
 
         self.world_sim = world_sim
         self.physics_world = world_sim.physics_world
 
+        # wall hits are resolved against the arena grid by the BulletManager instead of Box2D
         self.physics_body = self.physics_world.add_rect(Vector(pos.x, pos.y),
                                                         self.collider_size.x, self.collider_size.y,
                                                         rotation=self.sim_body.rotation,
-                                                        static=False, sensor=True, user_data=self)
+                                                        static=False, sensor=True, user_data=self,
+                                                        mask_bits=ALL_CATEGORIES & ~WALL_CATEGORY)
+        self.collider_set = False
+        self.store_collider()
 
         self.world_sim.bullets.append(self)
 
@@ -82,23 +106,44 @@ class Bullet:
         return self.bullet_type.texture
 
     def set_collider(self):
-        """Makes the bullet collider size larger for higher speeds to prevent tunneling."""
+        """Makes the bullet collider larger for higher speeds to prevent tunneling (once, after the first frame)."""
+        self.collider_set = True
         frame_dist = self.bullet_type.speed * FIXED_DELTA_TIME
         if frame_dist > self.size.y:
             self.collider_size.y = frame_dist
         self.physics_body.fixtures[0].shape.box = (round(self.collider_size.x / 2), round(self.collider_size.y / 2))
+        self.store_collider()
 
-    def get_collider_pos(self):
-        pos = self.sim_body.position.copy()
+    def store_collider(self):
+        """Writes the collider offset & (Box2D) half size to the bullet store, for the BulletManager."""
+        values = self.sim_body.store.values
+        row = self.sim_body.row
+        values[row + BULLET_COLLIDER_OFFSET] = 0
+        if self.collider_size.y > self.size.y:
+            values[row + BULLET_COLLIDER_OFFSET] = (self.size.y - self.collider_size.y) / 2
+        values[row + BULLET_COLLIDER_HALF_WIDTH] = round(self.collider_size.x / 2)
+        values[row + BULLET_COLLIDER_HALF_HEIGHT] = round(self.collider_size.y / 2)
+
+    def get_collider_pos(self, out=None):
+        """Returns the collider center, written to out instead of a new vector if given."""
+        if out is None:
+            out = Vector(0, 0)
+        out.set(self.sim_body.position)
         if self.collider_size.y > self.size.y:
-            offset = Vector(0, (self.size.y - self.collider_size.y) / 2)
-            offset.rotate(self.sim_body.rotation)
-            pos.add(offset)
-        return pos
+            offset = (self.size.y - self.collider_size.y) / 2
+            rotation = self.sim_body.rotation
+            out.x -= offset * math.sin(rotation)  # (0, offset) rotated
+            out.y += offset * math.cos(rotation)
+        return out
 
     def destroy(self):
         self.to_destroy = True
 
+    def release_store_slot(self):
+        """Frees the bullet's row of the bullet store once it is removed from the world."""
+        if self.sim_body.store is self.world_sim.bullet_store:
+            self.world_sim.bullet_store.detach(self.sim_body.slot, [self.sim_body, self.extrapolation_body])
+
     def apply_effect(self, robot):
         pass
 
@@ -107,11 +152,12 @@ class Bullet:
         robot.hit_bullet(self.damage, self.robot)
 
     def update(self, delta_time):
-        if self.world_sim.physics_frame_count > self.creation_frame:
+        """Updates a single bullet, BulletManager.update updates all of a world at once."""
+        if not self.collider_set and self.world_sim.physics_frame_count > self.creation_frame:
             self.set_collider()
         self.sim_body.step(delta_time)
         self.extrapolation_body.set(self.sim_body)
-        collider_pos = self.get_collider_pos()
+        collider_pos = self.get_collider_pos(out=_collider_pos)
         self.physics_body.transform = ((collider_pos.x, collider_pos.y), self.sim_body.rotation)
 
     def draw(self, qp, delta_time):
@@ -0,0 +1,633 @@
+import struct
+
+from robot import RobotInfo, PlayerInput
+from weapons import BulletInfo
+from transform import SimBody, SimpleBody
+from effects import effect_data_keys, effect_data_key_ids
+from constants import WIRE_PROTOCOL_VERSION, SNAPSHOT_HISTORY_LENGTH
+
+
+# Binary wire format (little endian) for state & client packets, replacing pickle.
+# Every packet starts with PACKET_HEADER, the first byte being the protocol version,
+# so pickled packets (starting with 0x80) can still be told apart during the transition.
+# Robots & bullets are sent as records of an ID, a mask of the included field groups and those groups,
+# so delta packets can leave out all groups that are unchanged since the client's acknowledged baseline
+# (e.g. the player name is only sent in full packets, for robots new to the client & when it changes).
+# The simulation state (bodies, health, effect values, turret rotation) is sent without loss of precision
+# (bodies per changed field, as float where exact), so the client's prediction re-simulates from exactly
+# the server's state.
+
+STATE_PACKET_KIND = 1
+CLIENT_PACKET_KIND = 2
+
+PICKLE_MARKER = 0x80
+
+# version, packet kind
+PACKET_HEADER = struct.Struct("<BB")
+# Per-client state packet header:
+# creation time, world start time, client rtt start, physics frame, baseline frame (-1 = full), player ID,
+# input ack frame (-1 = none)
+STATE_HEADER = struct.Struct("<qqqiiii")
+# Shared state packet body, packed once per tick & baseline:
+# robot count, bullet count, power-up byte count, scoreboard byte count
+# (byte counts of -1 = unchanged since baseline/no info), followed by power-ups, scoreboard & records
+STATE_BODY = struct.Struct("<HHii")
+# creation time, acknowledged physics frame (-1 = none), disconnect, input count (followed by frame & input each)
+CLIENT_HEADER = struct.Struct("<qi?B")
+INPUT_FRAME = struct.Struct("<i")
+
+# scoreboard entry count, followed by kills & name per entry
+SCORE_COUNT = struct.Struct("<H")
+SCORE_KILLS = struct.Struct("<I")
+
+# bit i set = field group i is included in the record
+GROUP_MASK = struct.Struct("<B")
+# Groups of doubles (bodies) are sent per field: 2 bit codes per field (see FIELD_*, packed into whole bytes),
+# followed by the fields that differ from the baseline group (all zero without baseline).
+# Doubles that are exact as float (e.g. the positions from Box2D) are sent as float, so nothing is lost.
+FIELD_UNCHANGED = 0
+FIELD_ZERO = 1
+FIELD_FLOAT = 2
+FIELD_DOUBLE = 3
+FLOAT = struct.Struct("<f")
+DOUBLE = struct.Struct("<d")
+FLOAT_BITS = struct.Struct("<I")
+DOUBLE_BITS = struct.Struct("<Q")
+
+# robot ID, followed by the group mask & robot field groups
+ROBOT_ID = struct.Struct("<i")
+# position, rotation, ang velocity, ang accel, velocity, local velocity, accel, local accel,
+# max velocity, max ang velocity, max accel, max ang accel, last position
+ROBOT_BODY = struct.Struct("<19d")
+# next bullet ID, kills, health, weapon class ID, last shot frame, last death frame, is dead
+ROBOT_STATUS = struct.Struct("<IIdBii?")
+# input flags (see INPUT_* bits), turret rotation
+PLAYER_INPUT = struct.Struct("<Bd")
+# effect class ID, value count (followed by value count doubles)
+EFFECT_HEADER = struct.Struct("<BB")
+# effect data key index, value
+EFFECT_DATA = struct.Struct("<Bd")
+COUNT = struct.Struct("<B")
+STRING_LENGTH = struct.Struct("<H")
+
+# source ID, bullet ID, followed by the group mask & bullet field groups
+BULLET_ID = struct.Struct("<ii")
+# bullet class ID, creation frame
+BULLET_META = struct.Struct("<Bi")
+# position, rotation, local velocity
+BULLET_BODY = struct.Struct("<5d")
+
+INPUT_PRESENT = 1
+INPUT_UP = 2
+INPUT_DOWN = 4
+INPUT_LEFT = 8
+INPUT_RIGHT = 16
+INPUT_SHOOT = 32
+INPUT_SHOOT_PRESSED = 64
+
+NO_EFFECTS = COUNT.pack(0) + COUNT.pack(0)
+
+
+def pack_string(string):
+    data = string.encode("utf-8")[:0xFFFF]
+    return STRING_LENGTH.pack(len(data)) + data
+
+
+def unpack_string(buffer, offset):
+    length = STRING_LENGTH.unpack_from(buffer, offset)[0]
+    offset += STRING_LENGTH.size
+    return bytes(buffer[offset:offset + length]).decode("utf-8", errors="replace"), offset + length
+
+
+def pack_input(player_input, input_struct=PLAYER_INPUT):
+    """Packs the input as flags & turret rotation, in the wire format unless another struct is given."""
+    if player_input is None:
+        return input_struct.pack(0, 0)
+    flags = (INPUT_PRESENT | (INPUT_UP if player_input.up else 0) | (INPUT_DOWN if player_input.down else 0)
+             | (INPUT_LEFT if player_input.left else 0) | (INPUT_RIGHT if player_input.right else 0)
+             | (INPUT_SHOOT if player_input.shoot else 0)
+             | (INPUT_SHOOT_PRESSED if player_input.shoot_pressed else 0))
+    return input_struct.pack(flags, player_input.turret_rot)
+
+
+def unpack_input(buffer, offset, input_struct=PLAYER_INPUT):
+    flags, turret_rot = input_struct.unpack_from(buffer, offset)
+    offset += input_struct.size
+    if not flags & INPUT_PRESENT:
+        return None, offset
+    player_input = PlayerInput()
+    player_input.up = flags & INPUT_UP != 0
+    player_input.down = flags & INPUT_DOWN != 0
+    player_input.left = flags & INPUT_LEFT != 0
+    player_input.right = flags & INPUT_RIGHT != 0
+    player_input.shoot = flags & INPUT_SHOOT != 0
+    player_input.shoot_pressed = flags & INPUT_SHOOT_PRESSED != 0
+    player_input.turret_rot = turret_rot
+    return player_input, offset
+
+
+def pack_robot_body(info):
+    body = info.robot_body
+    return ROBOT_BODY.pack(body.position[0], body.position[1], body.rotation, body.ang_velocity, body.ang_accel,
+                           body.velocity[0], body.velocity[1], body.local_velocity[0], body.local_velocity[1],
+                           body.accel[0], body.accel[1], body.local_accel[0], body.local_accel[1],
+                           body.max_velocity, body.max_ang_velocity, body.max_accel, body.max_ang_accel,
+                           info.last_position[0], info.last_position[1])
+
+
+def unpack_robot_body(info, buffer, offset):
+    values = ROBOT_BODY.unpack_from(buffer, offset)
+    body = SimBody()
+    body.position = (values[0], values[1])
+    body.rotation = values[2]
+    body.ang_velocity = values[3]
+    body.ang_accel = values[4]
+    body.velocity = (values[5], values[6])
+    body.local_velocity = (values[7], values[8])
+    body.accel = (values[9], values[10])
+    body.local_accel = (values[11], values[12])
+    body.max_velocity = values[13]
+    body.max_ang_velocity = values[14]
+    body.max_accel = values[15]
+    body.max_ang_accel = values[16]
+    info.robot_body = body
+    info.last_position = (values[17], values[18])
+    return offset + ROBOT_BODY.size
+
+
+def pack_robot_status(info):
+    return ROBOT_STATUS.pack(info.next_bullet_id, info.kills, info.health, info.weapon_class_id,
+                             info.last_shot_frame, info.last_death_frame, info.is_dead)
+
+
+def unpack_robot_status(info, buffer, offset):
+    (info.next_bullet_id, info.kills, info.health, info.weapon_class_id,
+     info.last_shot_frame, info.last_death_frame, info.is_dead) = ROBOT_STATUS.unpack_from(buffer, offset)
+    return offset + ROBOT_STATUS.size
+
+
+def pack_robot_input(info):
+    return pack_input(info.input)
+
+
+def unpack_robot_input(info, buffer, offset):
+    info.input, offset = unpack_input(buffer, offset)
+    return offset
+
+
+def pack_robot_effects(info):
+    """Packs the effect data lists (see RobotEffect.get_data_list) and the known effect_data entries."""
+    if not info.effects and not info.effect_data:
+        return NO_EFFECTS
+
+    parts = [COUNT.pack(len(info.effects))]
+    for data_list in info.effects:
+        values = data_list[1:]
+        parts.append(EFFECT_HEADER.pack(data_list[0], len(values)))
+        parts.append(struct.pack("<" + str(len(values)) + "d", *values))
+
+    effect_data = [(effect_data_key_ids[key], value) for key, value in info.effect_data.items()
+                   if key in effect_data_key_ids]
+    parts.append(COUNT.pack(len(effect_data)))
+    for key_id, value in effect_data:
+        parts.append(EFFECT_DATA.pack(key_id, value))
+    return b"".join(parts)
+
+
+def unpack_robot_effects(info, buffer, offset):
+    count = COUNT.unpack_from(buffer, offset)[0]
+    offset += COUNT.size
+    info.effects = []
+    for i in range(count):
+        effect_id, value_count = EFFECT_HEADER.unpack_from(buffer, offset)
+        offset += EFFECT_HEADER.size
+        values = struct.unpack_from("<" + str(value_count) + "d", buffer, offset)
+        offset += 8 * value_count
+        info.effects.append([effect_id, *values])
+
+    count = COUNT.unpack_from(buffer, offset)[0]
+    offset += COUNT.size
+    info.effect_data = {}
+    for i in range(count):
+        key_id, value = EFFECT_DATA.unpack_from(buffer, offset)
+        offset += EFFECT_DATA.size
+        info.effect_data[effect_data_keys[key_id]] = value
+    return offset
+
+
+def pack_robot_name(info):
+    return pack_string(info.player_name)
+
+
+def unpack_robot_name(info, buffer, offset):
+    info.player_name, offset = unpack_string(buffer, offset)
+    return offset
+
+
+# Field groups of a robot, in wire order: pack, unpack & the struct of the groups of doubles sent per field
+robot_field_groups = (
+    (pack_robot_body, unpack_robot_body, ROBOT_BODY),
+    (pack_robot_status, unpack_robot_status, None),
+    (pack_robot_input, unpack_robot_input, None),
+    (pack_robot_effects, unpack_robot_effects, None),
+    (pack_robot_name, unpack_robot_name, None),
+)
+
+
+class Snapshot:
+    """Packed field groups of all robots & bullets of one physics frame, used as baseline for delta packets."""
+    def __init__(self, physics_frame=0):
+        self.physics_frame = physics_frame
+        self.robots = {}  # robot ID -> tuple of packed robot field groups
+        self.bullets = {}  # (source ID, bullet ID) -> tuple of packed bullet field groups
+        self.power_ups = None
+        self.scores = None
+
+        self.is_subset = False
+        # (record kind, record key, baseline frame or -1) -> packed record, shared with subsets
+        self.record_cache = {}
+        # baseline frame or -1 -> packed body (only for full snapshots & baselines)
+        self.body_cache = {}
+
+    def subset(self, robot_ids, bullet_keys):
+        """Returns a snapshot with only the given robots & bullets (sharing the packed groups & records)."""
+        snapshot = Snapshot(self.physics_frame)
+        snapshot.robots = {robot_id: groups for robot_id, groups in self.robots.items() if robot_id in robot_ids}
+        snapshot.bullets = {key: groups for key, groups in self.bullets.items() if key in bullet_keys}
+        snapshot.power_ups = self.power_ups
+        snapshot.scores = self.scores
+        snapshot.is_subset = True
+        snapshot.record_cache = self.record_cache
+        return snapshot
+
+    def clear_caches(self):
+        """Frees the packed records & bodies once all clients got their packets."""
+        self.record_cache.clear()
+        self.body_cache.clear()
+
+
+class SnapshotHistory:
+    """Holds the most recent snapshots by physics frame, dropping the oldest ones."""
+    def __init__(self, max_length=SNAPSHOT_HISTORY_LENGTH):
+        self.max_length = max_length
+        self.snapshots = {}  # physics frame -> snapshot, in insertion order
+
+    def add(self, snapshot):
+        self.snapshots[snapshot.physics_frame] = snapshot
+        while len(self.snapshots) > self.max_length:
+            self.snapshots.pop(next(iter(self.snapshots)))
+
+    def get(self, physics_frame):
+        return self.snapshots.get(physics_frame)
+
+
+def pack_scores(scores):
+    parts = [SCORE_COUNT.pack(len(scores))]
+    for name, kills in scores:
+        parts.append(SCORE_KILLS.pack(kills))
+        parts.append(pack_string(name))
+    return b"".join(parts)
+
+
+def unpack_scores(buffer, offset):
+    count = SCORE_COUNT.unpack_from(buffer, offset)[0]
+    offset += SCORE_COUNT.size
+    scores = []
+    for i in range(count):
+        kills = SCORE_KILLS.unpack_from(buffer, offset)[0]
+        name, offset = unpack_string(buffer, offset + SCORE_KILLS.size)
+        scores.append((name, kills))
+    return scores
+
+
+def build_snapshot(physics_frame, robot_infos, bullet_infos, power_ups, scores=None):
+    """Packs all field groups of the robot & bullet infos once, for sending & later delta comparison."""
+    snapshot = Snapshot(physics_frame)
+    for info in robot_infos:
+        snapshot.robots[info.player_id] = tuple([group[0](info) for group in robot_field_groups])
+    for info in bullet_infos:
+        snapshot.bullets[(info.source_id, info.bullet_id)] = tuple([group[0](info) for group in bullet_field_groups])
+    snapshot.power_ups = power_ups
+    if scores is not None:
+        snapshot.scores = pack_scores(scores)
+    return snapshot
+
+
+_field_bits_structs = {}  # field count -> struct of the bits of that many doubles
+
+
+def get_field_bits_struct(count):
+    bits_struct = _field_bits_structs.get(count)
+    if bits_struct is None:
+        bits_struct = struct.Struct("<" + str(count) + "Q")
+        _field_bits_structs[count] = bits_struct
+    return bits_struct
+
+
+def pack_fields(group, reference):
+    """Packs the field codes of a group of doubles & its fields that differ from the reference group.
+    Works on the bits of the doubles, as that's cheaper than converting them."""
+    count = len(group) // DOUBLE.size
+    bits_struct = get_field_bits_struct(count)
+    codes = 0
+    parts = [None]
+    for i, (bits, reference_bits) in enumerate(zip(bits_struct.unpack(group), bits_struct.unpack(reference))):
+        if bits == reference_bits:
+            continue
+        if bits == 0:
+            codes |= FIELD_ZERO << (2 * i)
+            continue
+        exponent = (bits >> 52) & 0x7FF
+        if not bits & 0x1FFFFFFF and 897 <= exponent <= 1150:  # no more mantissa bits & in the normal float range
+            codes |= FIELD_FLOAT << (2 * i)
+            parts.append(FLOAT_BITS.pack((bits >> 32) & 0x80000000 | (exponent - 896) << 23
+                                         | (bits >> 29) & 0x7FFFFF))
+        else:
+            codes |= FIELD_DOUBLE << (2 * i)
+            parts.append(DOUBLE_BITS.pack(bits))
+    parts[0] = codes.to_bytes((count * 2 + 7) // 8, "little")
+    return b"".join(parts)
+
+
+def unpack_fields(buffer, offset, reference):
+    """Returns the group of doubles with the sent fields applied to the reference group & the offset after it."""
+    count = len(reference) // DOUBLE.size
+    bits_struct = get_field_bits_struct(count)
+    code_size = (count * 2 + 7) // 8
+    if offset + code_size > len(buffer):
+        raise IndexError("field codes exceed the packet")
+    codes = int.from_bytes(buffer[offset:offset + code_size], "little")
+    offset += code_size
+    fields = list(bits_struct.unpack(reference))
+    i = -1
+    while codes:  # up to the last sent field
+        i += 1
+        code = codes & 3
+        codes >>= 2
+        if code == FIELD_UNCHANGED:
+            continue
+        if code == FIELD_ZERO:
+            fields[i] = 0
+        elif code == FIELD_FLOAT:
+            float_bits = FLOAT_BITS.unpack_from(buffer, offset)[0]
+            offset += FLOAT_BITS.size
+            exponent = (float_bits >> 23) & 0xFF
+            if 0 < exponent < 0xFF:
+                fields[i] = (float_bits & 0x80000000) << 32 | (exponent + 896) << 52 | (float_bits & 0x7FFFFF) << 29
+            else:  # zero, subnormal, infinite or NaN float, which pack_fields doesn't send as float
+                fields[i] = DOUBLE_BITS.unpack(DOUBLE.pack(FLOAT.unpack_from(buffer, offset - FLOAT_BITS.size)[0]))[0]
+        else:
+            fields[i] = DOUBLE_BITS.unpack_from(buffer, offset)[0]
+            offset += DOUBLE_BITS.size
+    return bits_struct.pack(*fields), offset
+
+
+def pack_record(record_id, groups, baseline_groups, field_groups):
+    """Packs a record ID, a mask of the field groups changed since the baseline and only those groups
+    (of the groups of doubles only the changed fields, see pack_fields)."""
+    mask = 0
+    changed = [record_id, None]
+    for i, group in enumerate(groups):
+        if baseline_groups is None or group != baseline_groups[i]:
+            mask |= 1 << i
+            if field_groups[i][2] is None:
+                changed.append(group)
+            elif baseline_groups is None:
+                changed.append(pack_fields(group, bytes(len(group))))
+            else:
+                changed.append(pack_fields(group, baseline_groups[i]))
+    changed[1] = GROUP_MASK.pack(mask)
+    return b"".join(changed)
+
+
+def unpack_record_groups(info, field_groups, buffer, offset, baseline_groups):
+    """Unpacks the sent field groups & takes the others from the baseline, returning None if it is missing."""
+    mask = GROUP_MASK.unpack_from(buffer, offset)[0]
+    offset += GROUP_MASK.size
+    groups = []
+    for i, (pack, unpack, field_struct) in enumerate(field_groups):
+        if mask & (1 << i):
+            if field_struct is not None:
+                reference = bytes(field_struct.size) if baseline_groups is None else baseline_groups[i]
+                group, offset = unpack_fields(buffer, offset, reference)
+                unpack(info, group, 0)
+                groups.append(group)
+            else:
+                end = unpack(info, buffer, offset)
+                groups.append(bytes(buffer[offset:end]))
+                offset = end
+        elif baseline_groups is not None:
+            unpack(info, baseline_groups[i], 0)
+            groups.append(baseline_groups[i])
+        else:
+            return None, offset
+    return tuple(groups), offset
+
+
+def pack_bullet_meta(info):
+    return BULLET_META.pack(info.bullet_class_id, info.creation_frame)
+
+
+def unpack_bullet_meta(info, buffer, offset):
+    info.bullet_class_id, info.creation_frame = BULLET_META.unpack_from(buffer, offset)
+    return offset + BULLET_META.size
+
+
+def pack_bullet_body(info):
+    body = info.bullet_body
+    return BULLET_BODY.pack(body.position[0], body.position[1], body.rotation,
+                            body.local_velocity[0], body.local_velocity[1])
+
+
+def unpack_bullet_body(info, buffer, offset):
+    values = BULLET_BODY.unpack_from(buffer, offset)
+    body = SimpleBody()
+    body.position = (values[0], values[1])
+    body.rotation = values[2]
+    body.local_velocity = (values[3], values[4])
+    info.bullet_body = body
+    return offset + BULLET_BODY.size
+
+
+# Field groups of a bullet, in wire order (see robot_field_groups)
+bullet_field_groups = (
+    (pack_bullet_meta, unpack_bullet_meta, None),
+    (pack_bullet_body, unpack_bullet_body, BULLET_BODY),
+)
+
+
+def get_packet_kind(buffer):
+    """Returns the packet kind of a binary packet, or None if it is not in the current wire protocol version."""
+    if len(buffer) < PACKET_HEADER.size:
+        return None
+    version, kind = PACKET_HEADER.unpack_from(buffer, 0)
+    if version != WIRE_PROTOCOL_VERSION:
+        return None
+    return kind
+
+
+ROBOT_RECORD = 0
+BULLET_RECORD = 1
+
+
+def get_cached_record(snapshot, kind, key, id_bytes, groups, baseline):
+    """Packs a record once per baseline frame: all clients with that baseline share the same baseline groups,
+    as their baselines are subsets of the same full snapshot."""
+    baseline_groups = None
+    field_groups = robot_field_groups if kind == ROBOT_RECORD else bullet_field_groups
+    if baseline is not None:
+        if kind == ROBOT_RECORD:
+            baseline_groups = baseline.robots.get(key)
+        else:
+            baseline_groups = baseline.bullets.get(key)
+    cache_key = (kind, key, -1 if baseline_groups is None else baseline.physics_frame)
+    record = snapshot.record_cache.get(cache_key)
+    if record is None:
+        record = pack_record(id_bytes, groups, baseline_groups, field_groups)
+        snapshot.record_cache[cache_key] = record
+    return record
+
+
+def pack_state_body(snapshot, baseline):
+    """Packs the shared part of a state packet, reusing it for all clients with the same baseline."""
+    cacheable = not snapshot.is_subset and (baseline is None or not baseline.is_subset)
+    body_key = -1 if baseline is None else baseline.physics_frame
+    if cacheable:
+        body = snapshot.body_cache.get(body_key)
+        if body is not None:
+            return body
+
+    power_ups = snapshot.power_ups
+    scores = snapshot.scores
+    if baseline is not None:
+        if power_ups == baseline.power_ups:
+            power_ups = None
+        if scores == baseline.scores:
+            scores = None
+
+    parts = [STATE_BODY.pack(len(snapshot.robots), len(snapshot.bullets),
+                             -1 if power_ups is None else len(power_ups), -1 if scores is None else len(scores))]
+    if power_ups is not None:
+        parts.append(power_ups)
+    if scores is not None:
+        parts.append(scores)
+    for robot_id, groups in snapshot.robots.items():
+        parts.append(get_cached_record(snapshot, ROBOT_RECORD, robot_id, ROBOT_ID.pack(robot_id), groups, baseline))
+    for bullet_key, groups in snapshot.bullets.items():
+        parts.append(get_cached_record(snapshot, BULLET_RECORD, bullet_key, BULLET_ID.pack(*bullet_key), groups,
+                                       baseline))
+    body = b"".join(parts)
+
+    if cacheable:
+        snapshot.body_cache[body_key] = body
+    return body
+
+
+def write_state_packet(packet):
+    """Packs a StatePacket into bytes, only with the fields changed since packet.baseline if it is set.
+    Only the small header is packed per client, the body is packed once per snapshot & baseline."""
+    snapshot = packet.snapshot
+    if snapshot is None:
+        snapshot = build_snapshot(packet.physics_frame, packet.robots, packet.bullets, packet.power_ups,
+                                  packet.scores)
+    baseline = packet.baseline
+
+    return b"".join([PACKET_HEADER.pack(WIRE_PROTOCOL_VERSION, STATE_PACKET_KIND),
+                     STATE_HEADER.pack(packet.creation_time, packet.world_start_time, packet.client_rtt_start,
+                                       packet.physics_frame, -1 if baseline is None else baseline.physics_frame,
+                                       packet.player_id, packet.input_ack_frame),
+                     pack_state_body(snapshot, baseline)])
+
+
+def read_state_packet(buffer, packet, snapshot_history=None):
+    """Sets all StatePacket values from packed bytes, resolving delta packets against the snapshot history.
+    Returns None if the delta baseline is not (or no longer) in the history."""
+    offset = PACKET_HEADER.size
+    (packet.creation_time, packet.world_start_time, packet.client_rtt_start, packet.physics_frame,
+     baseline_frame, packet.player_id, packet.input_ack_frame) = STATE_HEADER.unpack_from(buffer, offset)
+    offset += STATE_HEADER.size
+    robot_count, bullet_count, power_up_size, scores_size = STATE_BODY.unpack_from(buffer, offset)
+    offset += STATE_BODY.size
+
+    baseline = None
+    if baseline_frame >= 0:
+        if snapshot_history is not None:
+            baseline = snapshot_history.get(baseline_frame)
+        if baseline is None:
+            return None
+
+    snapshot = Snapshot(packet.physics_frame)
+
+    if power_up_size >= 0:
+        snapshot.power_ups = bytes(buffer[offset:offset + power_up_size])
+        offset += power_up_size
+    elif baseline is not None:
+        snapshot.power_ups = baseline.power_ups
+    packet.power_ups = snapshot.power_ups
+
+    if scores_size >= 0:
+        snapshot.scores = bytes(buffer[offset:offset + scores_size])
+        offset += scores_size
+    elif baseline is not None:
+        snapshot.scores = baseline.scores
+    packet.scores = None
+    if snapshot.scores is not None:
+        packet.scores = unpack_scores(snapshot.scores, 0)
+
+    packet.robots = []
+    for i in range(robot_count):
+        info = RobotInfo()
+        info.player_id = ROBOT_ID.unpack_from(buffer, offset)[0]
+        offset += ROBOT_ID.size
+        baseline_groups = None if baseline is None else baseline.robots.get(info.player_id)
+        groups, offset = unpack_record_groups(info, robot_field_groups, buffer, offset, baseline_groups)
+        if groups is None:
+            return None
+        snapshot.robots[info.player_id] = groups
+        packet.robots.append(info)
+
+    packet.bullets = []
+    for i in range(bullet_count):
+        info = BulletInfo()
+        info.source_id, info.bullet_id = BULLET_ID.unpack_from(buffer, offset)
+        offset += BULLET_ID.size
+        bullet_key = (info.source_id, info.bullet_id)
+        baseline_groups = None if baseline is None else baseline.bullets.get(bullet_key)
+        groups, offset = unpack_record_groups(info, bullet_field_groups, buffer, offset, baseline_groups)
+        if groups is None:
+            return None
+        snapshot.bullets[bullet_key] = groups
+        packet.bullets.append(info)
+
+    packet.snapshot = snapshot
+    if snapshot_history is not None:
+        snapshot_history.add(snapshot)
+
+    return packet
+
+
+def write_client_packet(packet):
+    """Packs a ClientPacket into bytes."""
+    inputs = packet.inputs[-0xFF:]
+    data = [PACKET_HEADER.pack(WIRE_PROTOCOL_VERSION, CLIENT_PACKET_KIND),
+            CLIENT_HEADER.pack(packet.creation_time, packet.ack_frame, packet.disconnect, len(inputs))]
+    for frame, player_input in inputs:
+        data.append(INPUT_FRAME.pack(frame))
+        data.append(pack_input(player_input))
+    data.append(pack_string(packet.player_name))
+    return b"".join(data)
+
+
+def read_client_packet(buffer, packet):
+    """Sets all ClientPacket values from packed bytes."""
+    offset = PACKET_HEADER.size
+    packet.creation_time, packet.ack_frame, packet.disconnect, input_count = CLIENT_HEADER.unpack_from(buffer, offset)
+    offset += CLIENT_HEADER.size
+    packet.inputs = []
+    for i in range(input_count):
+        frame = INPUT_FRAME.unpack_from(buffer, offset)[0]
+        player_input, offset = unpack_input(buffer, offset + INPUT_FRAME.size)
+        if player_input is not None:
+            packet.inputs.append((frame, player_input))
+    packet.player_name, offset = unpack_string(buffer, offset)
+    return packet
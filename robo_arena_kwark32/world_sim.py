@@ -4,6 +4,10 @@ import random
 from robot import Robot, PlayerInput
 from arena_converter import load_map
 from physics import PhysicsWorld
+from body_store import BodyStore, ROBOT_ROW_SIZE, BULLET_ROW_SIZE
+from bullet_manager import BulletManager
+from flow_field import FlowFields
+from path_planner import PathPlanner
 from util import Vector, get_delta_time_s
 from globals import GameInfo, Settings
 from constants import FIXED_DELTA_TIME, FIXED_DELTA_TIME_NS, MAX_FIXED_TIMESTEPS, FIXED_FPS, GAME_OVER_DELAY
@@ -14,9 +18,16 @@ from sound_manager import SoundManager
 
 class WorldSim:
     """Base class for all mode-specific game simulations."""
-    def __init__(self):
+    def __init__(self, robot_store=None):
         self.robot_class = Robot
 
+        # kinematic state & health of all robots/bullets, shared robot stores are stepped at once (batch_env)
+        self.robot_store = robot_store if robot_store is not None else BodyStore(ROBOT_ROW_SIZE)
+        self.bullet_store = BodyStore(BULLET_ROW_SIZE)
+        self.bullet_manager = BulletManager(self)
+        self.flow_fields = FlowFields(self)  # shared by all AI robots
+        self.path_planner = PathPlanner(self)
+
         self.world_scene = None
 
         self.physics_world = PhysicsWorld()
@@ -25,10 +36,13 @@ class WorldSim:
         self.local_player_robot = None
         self.bullets = []
         self.player_input = PlayerInput()
+        self.ai_targets_ai = False  # AI robots only target players, unless in AI only matches
 
         self.init_arena()
 
         self.physics_frame_count = 0
+        self.next_player_id = GameInfo.local_player_id + 1
+        self.current_frame_seed = 0
 
         self.curr_time_ns = time.time_ns()
         self.physics_world_time_ns = 0
@@ -46,12 +60,38 @@ class WorldSim:
 
         self.did_fixed_update = False
 
+        self.replay_recorder = None
+
     def clean_mem(self):
         CameraState.position = None
+        self.path_planner.clear()
+        if self.replay_recorder is not None:
+            self.replay_recorder.close()
+            self.replay_recorder = None
+
+    def start_replay_recording(self, file_path, lag_compensation=False):
+        """Records this world's player inputs to a replay file from the next fixed update on."""
+        from replay import ReplayRecorder  # imports world_sim itself
+        try:
+            self.replay_recorder = ReplayRecorder(file_path, self.world_start_time_ns,
+                                                  lag_compensation=lag_compensation, ai_targets_ai=self.ai_targets_ai)
+        except OSError as e:
+            print("ERROR: Could not record replay to " + file_path + ": " + str(e))
 
     def init_arena(self):
         self.arena = load_map(GameInfo.active_arena, physics_world=self.physics_world)
         self.arena.world_sim = self
+        self.flow_fields.clear()
+        self.path_planner.clear()
+
+    def get_next_player_id(self):
+        """Returns an unused robot/player ID of this world."""
+        for robot in self.robots:
+            if robot.robot_id >= self.next_player_id:
+                self.next_player_id = robot.robot_id + 1
+        player_id = self.next_player_id
+        self.next_player_id += 1
+        return player_id
 
     def create_player(self, robot_id=-1, position=None, player_name=None, should_respawn=False):
         if player_name is None:
@@ -71,6 +111,23 @@ class WorldSim:
         self.robots.append(enemy)
         return enemy
 
+    def spawn_random_enemy(self, should_respawn=False):
+        if self.arena.tiles is None:
+            return
+
+        pos = None
+        while pos is None:
+            pos = Vector(random.randrange(self.arena.tile_count.x), random.randrange(self.arena.tile_count.y))
+            tile = self.arena.tiles[pos.y][pos.x]
+            if tile.has_collision or tile.name == "hole" or tile.name == "lava" or tile.name.startswith("portal_"):
+                pos = None
+                continue
+            pos.mult(GameInfo.arena_tile_size)
+            pos.add_scalar(GameInfo.arena_tile_size / 2)
+            pos.round()
+
+        self.create_enemy_robot(position=pos, should_respawn=should_respawn)
+
     def clear_dead_bullets(self):
         dead_bullets = []
         for bullet in self.bullets:
@@ -78,6 +135,7 @@ class WorldSim:
                 dead_bullets.append(bullet)
         for dead in dead_bullets:
             dead.physics_world.world.DestroyBody(dead.physics_body)
+            dead.release_store_slot()
             self.bullets.remove(dead)
         dead_bullets.clear()
 
@@ -87,6 +145,7 @@ class WorldSim:
             if robot.to_remove:
                 dead_robots.append(robot)
         for dead in dead_robots:
+            dead.release_store_slot()
             self.robots.remove(dead)
             if dead is self.local_player_robot:
                 self.local_player_robot = None
@@ -94,30 +153,46 @@ class WorldSim:
 
     def fixed_update(self, delta_time, catchup_frame=False):
         """Update all bullets, robots etc with a fixed delta time."""
+        self.begin_fixed_update(delta_time, catchup_frame=catchup_frame)
+
+        for robot in self.robots:
+            if not robot.interpolated:
+                robot.update(delta_time)
+
+        self.end_fixed_update(delta_time)
+
+    def begin_fixed_update(self, delta_time, catchup_frame=False):
+        """First part of the fixed update before the robots are updated: power-ups, bullets & AI paths."""
         self.did_fixed_update = True
 
         self.catchup_frame = catchup_frame
         SoundManager.instance.catchup_frame = catchup_frame
 
-        random.seed(GameInfo.current_frame_seed)
+        random.seed(self.current_frame_seed)
+
+        if self.replay_recorder is not None:
+            self.replay_recorder.record_frame(self.physics_frame_count, self.robots)
 
         if self.physics_frame_count % FRAMES_PER_POWER_UP == 0:
             self.arena.place_power_up(delta_time)
 
-        for bullet in self.bullets:
-            bullet.update(delta_time)
-
-        for robot in self.robots:
-            robot.update(delta_time)
+        self.bullet_manager.update([bullet for bullet in self.bullets if not bullet.interpolated], delta_time)
+        self.path_planner.deliver()
+        self.flow_fields.begin_frame()
 
+    def end_fixed_update(self, delta_time):
+        """Last part of the fixed update after the robots are updated: physics, collisions & cleanup."""
         self.physics_world.world.Step(delta_time, 0, 4)
 
         for robot in self.robots:
-            robot.refresh_from_physics()
+            if not robot.interpolated:
+                robot.refresh_from_physics()
 
         self.physics_world.do_collisions()
+        self.bullet_manager.resolve_wall_hits(self.bullets)
+        self.resolve_rewound_hits()
 
-        if not catchup_frame:
+        if not self.catchup_frame:
             pos = CameraState.position
             if self.local_player_robot is not None:
                 pos = self.local_player_robot.sim_body.position
@@ -126,7 +201,7 @@ class WorldSim:
             SoundManager.instance.update_sound(pos)
 
             if self.world_scene is not None and self.world_scene.score_board is not None:
-                self.world_scene.score_board.set_scores(self.robots)
+                self.world_scene.score_board.set_scores(self.get_scores())
 
         self.clear_dead_bullets()
         self.clear_dead_robots()
@@ -137,6 +212,14 @@ class WorldSim:
         SoundManager.instance.catchup_frame = False
         self.catchup_frame = False
 
+    def resolve_rewound_hits(self):
+        """Resolves the robot hits of lag compensated bullets, which are left out by the physics world."""
+        pass
+
+    def get_scores(self):
+        """Returns (name, kills) of all robots for the scoreboard."""
+        return [(robot.player_name, robot.kills) for robot in self.robots]
+
     def update_times(self):
         """Calculate current frame times."""
         last_world_time_ns = self.curr_world_time_ns
@@ -156,6 +239,10 @@ class WorldSim:
             self._frames_since_last_show = 0
             self._last_fps_show_time = self.curr_time_ns
 
+    def get_time_until_fixed_update_ns(self):
+        """Returns the time until the next fixed_update is due (negative if overdue)."""
+        return self.world_start_time_ns + self.physics_world_time_ns + FIXED_DELTA_TIME_NS - time.time_ns()
+
     def update_world(self):
         """Updates the world, only calling fixed_update when it is due."""
         self.did_fixed_update = False
@@ -183,23 +270,37 @@ class WorldSim:
 
         self.calc_fps()
 
+    def step(self, frame_count=1):
+        """Advances the simulation frame_count fixed frames back to back, without sleeping or reading the clock.
+        The world's time follows the simulated frames instead of the wall clock, all frames are catchup frames."""
+        for i in range(frame_count):
+            self.curr_world_time_ns = self.physics_world_time_ns
+            self.curr_time_ns = self.world_start_time_ns + self.curr_world_time_ns
+            self.fixed_update(FIXED_DELTA_TIME, catchup_frame=True)
+        self.curr_world_time_ns = self.physics_world_time_ns
+        self.curr_time_ns = self.world_start_time_ns + self.curr_world_time_ns
+
     def set_seed(self):
         """Sets the random seed for the current frame, to be in sync with the server (deterministic)"""
-        GameInfo.current_frame_seed = self.world_start_time_ns + self.physics_frame_count
+        self.current_frame_seed = self.world_start_time_ns + self.physics_frame_count
 
 
 class SPWorldSim(WorldSim):
     """Game simulation for singleplayer."""
-    def __init__(self):
-        super().__init__()
+    def __init__(self, robot_store=None):
+        super().__init__(robot_store=robot_store)
 
         self.local_player_robot = self.create_player(player_name="")
         self.local_player_robot.input = self.player_input
 
+        if GameInfo.replay_record_path is not None:
+            self.start_replay_recording(GameInfo.replay_record_path)
+
         GameInfo.local_player_score = 0
         GameInfo.local_player_score_is_highscore = False
 
         self.player_die_frame = None
+        self.saves_highscore = True
 
         self.last_enemy_spawn_frame = 0
         self.enemy_spawn_delay = 20 * FIXED_FPS
@@ -214,39 +315,29 @@ class SPWorldSim(WorldSim):
     def fixed_update(self, delta_time, catchup_frame=False):
         """Fixed update additions for singleplayer."""
         self.set_seed()
+        self.update_enemy_spawning()
 
+        super().fixed_update(delta_time, catchup_frame=catchup_frame)
+
+        self.update_game_over()
+
+    def update_enemy_spawning(self):
+        """Spawns enemies ever faster."""
         if self.physics_frame_count > self.last_enemy_spawn_frame + self.enemy_spawn_delay:
             self.spawn_random_enemy()
             self.last_enemy_spawn_frame = self.physics_frame_count
         self.enemy_spawn_delay -= 0.00008 * self.enemy_spawn_delay
 
-        super().fixed_update(delta_time)
-
+    def update_game_over(self):
+        """Saves the score once the player died & shows the game over menu after a delay."""
         if self.local_player_robot is None and self.player_die_frame is None:
             self.player_die_frame = self.physics_frame_count
             GameInfo.local_player_score += self.player_die_frame
-            if GameInfo.local_player_score > Settings.instance.highscore:
+            if self.saves_highscore and GameInfo.local_player_score > Settings.instance.highscore:
                 GameInfo.local_player_score_is_highscore = True
                 Settings.instance.highscore = GameInfo.local_player_score
                 Settings.instance.save()
 
-        if (self.player_die_frame is not None and self.world_scene.active_menu is None
+        if (self.player_die_frame is not None and self.world_scene is not None and self.world_scene.active_menu is None
                 and self.physics_frame_count > self.player_die_frame + GAME_OVER_DELAY):
             self.world_scene.switch_menu("game_over_menu")
-
-    def spawn_random_enemy(self):
-        if self.arena.tiles is None:
-            return
-
-        pos = None
-        while pos is None:
-            pos = Vector(random.randrange(self.arena.tile_count.x), random.randrange(self.arena.tile_count.y))
-            tile = self.arena.tiles[pos.y][pos.x]
-            if tile.has_collision or tile.name == "hole" or tile.name == "lava" or tile.name.startswith("portal_"):
-                pos = None
-                continue
-            pos.mult(GameInfo.arena_tile_size)
-            pos.add_scalar(GameInfo.arena_tile_size / 2)
-            pos.round()
-
-        self.create_enemy_robot(position=pos)
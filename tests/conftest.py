@@ -0,0 +1,10 @@
+import sys
+
+from os import path
+
+# the game's modules import each other by bare name, as when run from their directory
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "robo_arena_kwark32"))
+
+from globals import GameInfo  # noqa: E402
+
+GameInfo.is_headless = True  # no PyQt5 needed for the tested modules
@@ -0,0 +1,55 @@
+import time
+import socket
+
+import pytest
+
+import batched_io
+
+from batched_io import DatagramIO, MMsgDatagramIO
+
+
+def create_socket():
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.setblocking(False)
+    return sock
+
+
+def receive_all(datagram_io, sock, count):
+    datagrams = []
+    end_time = time.time() + 2
+    while len(datagrams) < count and time.time() < end_time:
+        datagrams += datagram_io.receive(sock)
+    return datagrams
+
+
+def check_send_receive(datagram_io, receiver_count=5, datagram_count=23):
+    sender = create_socket()
+    receivers = [create_socket() for _ in range(receiver_count)]
+    try:
+        sent = [(("datagram " + str(i)).encode() * (i + 1), receivers[i % receiver_count].getsockname())
+                for i in range(datagram_count)]
+        assert datagram_io.send(sender, sent) == datagram_count
+        for i, receiver in enumerate(receivers):
+            expected = [datagram for datagram, address in sent[i::receiver_count]]
+            received = receive_all(datagram_io, receiver, len(expected))
+            assert [datagram for datagram, address in received] == expected
+            assert all(address == sender.getsockname() for datagram, address in received)
+    finally:
+        sender.close()
+        for receiver in receivers:
+            receiver.close()
+
+
+def test_datagram_io():
+    check_send_receive(DatagramIO(batch_size=4, buffer_size=1024))
+
+
+@pytest.mark.skipif(batched_io.libc_mmsg is None, reason="sendmmsg/recvmmsg are not available")
+def test_mmsg_datagram_io(monkeypatch):
+    # the sockaddr cache is evicted between most batches
+    monkeypatch.setattr(batched_io, "MAX_CACHED_ADDRESSES", 6)
+    datagram_io = MMsgDatagramIO(batch_size=4, buffer_size=1024)
+    check_send_receive(datagram_io)
+    assert len(datagram_io.socket_addresses) <= 6
+    assert datagram_io.send_errors == 0
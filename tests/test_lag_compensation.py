@@ -0,0 +1,47 @@
+import math
+import random
+
+import numpy as np
+
+from util import Vector
+from lag_compensation import get_overlapping
+
+
+def get_corners(center_x, center_y, rotation, half_width, half_height):
+    cos_r, sin_r = math.cos(rotation), math.sin(rotation)
+    return [(center_x + x * cos_r - y * sin_r, center_y + x * sin_r + y * cos_r)
+            for x, y in ((-half_width, -half_height), (half_width, -half_height),
+                         (half_width, half_height), (-half_width, half_height))]
+
+
+def corners_overlap(corners_a, corners_b):
+    """Separating axis test on the projected corners, along the edge normals of both rectangles."""
+    for corners in (corners_a, corners_b):
+        for (x1, y1), (x2, y2) in zip(corners, corners[1:] + corners[:1]):
+            axis = (y1 - y2, x2 - x1)
+            projections_a = [x * axis[0] + y * axis[1] for x, y in corners_a]
+            projections_b = [x * axis[0] + y * axis[1] for x, y in corners_b]
+            if max(projections_a) < min(projections_b) or max(projections_b) < min(projections_a):
+                return False
+    return True
+
+
+def test_get_overlapping_matches_corner_test():
+    rnd = random.Random(5)
+    robot_half_size = Vector(25, 20)
+    transforms = np.array([(rnd.uniform(-150, 150), rnd.uniform(-150, 150), rnd.uniform(-math.pi, math.pi))
+                           for _ in range(500)])
+    for _ in range(50):
+        center_x, center_y = rnd.uniform(-50, 50), rnd.uniform(-50, 50)
+        rotation = rnd.uniform(-math.pi, math.pi)
+        half_width, half_height = rnd.uniform(1, 60), rnd.uniform(1, 60)
+        overlapping = get_overlapping(center_x, center_y, rotation, half_width, half_height, transforms,
+                                      robot_half_size)
+        rectangle = get_corners(center_x, center_y, rotation, half_width, half_height)
+        for i, (x, y, robot_rotation) in enumerate(transforms):
+            robot = get_corners(x, y, robot_rotation, robot_half_size.x, robot_half_size.y)
+            assert overlapping[i] == corners_overlap(rectangle, robot)
+
+
+def test_get_overlapping_empty():
+    assert len(get_overlapping(0, 0, 0, 1, 1, np.empty((0, 3)), Vector(1, 1))) == 0
@@ -0,0 +1,122 @@
+import random
+
+from globals import GameInfo
+from networking import FragmentBuffer, FRAGMENT_HEADER, split_message, Client
+from constants import MAX_PENDING_INPUTS
+from robot import PlayerInput
+
+ADDRESS = ("127.0.0.1", 5000)
+PAYLOAD_SIZE = GameInfo.buffer_size - FRAGMENT_HEADER.size
+
+
+def random_message(rnd, size):
+    return bytes(rnd.getrandbits(8) for _ in range(size))
+
+
+def test_unfragmented_message():
+    fragments = split_message(b"hello", 3)
+    assert len(fragments) == 1
+    buffer = FragmentBuffer()
+    assert buffer.add(ADDRESS, fragments[0], 0) == b"hello"
+    assert buffer.completed_messages == 1
+
+
+def test_reassembly_out_of_order():
+    rnd = random.Random(1)
+    buffer = FragmentBuffer()
+    for sequence in range(20):
+        message = random_message(rnd, rnd.randrange(1, GameInfo.buffer_size * 6))
+        fragments = split_message(message, sequence)
+        assert all(len(fragment) <= GameInfo.buffer_size for fragment in fragments)
+        rnd.shuffle(fragments)
+        results = [buffer.add(ADDRESS, fragment, 0) for fragment in fragments]
+        assert results[:-1] == [None] * (len(fragments) - 1)
+        assert results[-1] == message
+    assert buffer.completed_messages == 20
+    assert not buffer.pending
+
+
+def test_interleaved_messages_and_senders():
+    rnd = random.Random(2)
+    messages = {(("127.0.0.1", port), sequence): random_message(rnd, GameInfo.buffer_size * 3)
+                for port in (1, 2) for sequence in (7, 8)}
+    datagrams = [(key[0], fragment) for key, message in messages.items() for fragment in split_message(message, key[1])]
+    rnd.shuffle(datagrams)
+    buffer = FragmentBuffer()
+    completed = [buffer.add(address, datagram, 0) for address, datagram in datagrams]
+    assert sorted(message for message in completed if message is not None) == sorted(messages.values())
+
+
+def test_lost_fragment_times_out():
+    rnd = random.Random(3)
+    buffer = FragmentBuffer(timeout_ns=100)
+    fragments = split_message(random_message(rnd, GameInfo.buffer_size * 3), 1)
+    for fragment in fragments[1:]:
+        assert buffer.add(ADDRESS, fragment, 0) is None
+    assert len(buffer.pending) == 1
+
+    # a later message completes, the incomplete one is dropped
+    assert buffer.add(ADDRESS, split_message(b"next", 2)[0], 50) == b"next"
+    later_fragments = split_message(random_message(rnd, GameInfo.buffer_size * 2), 3)
+    buffer.add(ADDRESS, later_fragments[0], 200)
+    assert buffer.timed_out_messages == 1
+    assert list(buffer.pending) == [(ADDRESS, 3)]
+    # the lost fragment arriving too late starts a new (incomplete) message
+    assert buffer.add(ADDRESS, fragments[0], 250) is None
+
+
+def test_duplicate_and_invalid_fragments():
+    rnd = random.Random(4)
+    message = random_message(rnd, PAYLOAD_SIZE * 2)
+    fragments = split_message(message, 9)
+    buffer = FragmentBuffer()
+    assert buffer.add(ADDRESS, fragments[0], 0) is None
+    assert buffer.add(ADDRESS, fragments[0], 0) is None
+    assert buffer.duplicate_fragments == 1
+    assert buffer.add(ADDRESS, b"\x01", 0) is None
+    assert buffer.add(ADDRESS, split_message(random_message(rnd, GameInfo.buffer_size * 4), 9)[1], 0) is None
+    assert buffer.invalid_fragments == 2
+    assert buffer.add(ADDRESS, fragments[1], 0) == message
+
+
+def test_full_buffer_evicts_oldest():
+    rnd = random.Random(5)
+    buffer = FragmentBuffer(max_pending=2)
+    first_fragments = [split_message(random_message(rnd, PAYLOAD_SIZE * 2), sequence)
+                       for sequence in range(3)]
+    for fragments in first_fragments:
+        buffer.add(ADDRESS, fragments[0], 0)
+    assert buffer.evicted_messages == 1
+    assert list(buffer.pending) == [(ADDRESS, 1), (ADDRESS, 2)]
+    assert buffer.add(ADDRESS, first_fragments[2][1], 0) is not None
+
+
+def get_input(shoot_pressed=False):
+    player_input = PlayerInput()
+    player_input.shoot_pressed = shoot_pressed
+    return player_input
+
+
+def test_pending_inputs_window():
+    client = Client(ADDRESS)
+    client.add_inputs([(100 + i, get_input()) for i in range(3 * MAX_PENDING_INPUTS)])
+    assert sorted(client.pending_inputs) == list(range(100, 100 + MAX_PENDING_INPUTS))
+
+    client.pop_input(110)
+    assert client.input_ack_frame == 110
+    client.add_inputs([(105, get_input())]
+                      + [(110 + MAX_PENDING_INPUTS + i, get_input()) for i in range(2)])
+    assert max(client.pending_inputs) == 110 + MAX_PENDING_INPUTS
+    assert 105 not in client.pending_inputs
+
+    # the window follows the processed frames, even without inputs for them
+    client.pop_input(1000)
+    client.add_inputs([(1001, get_input())])
+    assert list(client.pending_inputs) == [1001]
+
+
+def test_pop_input_keeps_shoot_presses():
+    client = Client(ADDRESS)
+    client.add_inputs([(1, get_input(shoot_pressed=True)), (2, get_input())])
+    assert client.pop_input(2).shoot_pressed
+    assert not client.pop_input(3).shoot_pressed
@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from robot_AI import astar
+from path_graph import PathGraph
+
+
+def path_cost(costs, width, path):
+    return sum(costs[y * width + x] for x, y in path[1:])
+
+
+def distance(tile, end):
+    return abs(tile[0] - end[0]) + abs(tile[1] - end[1])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_graph_path_matches_astar(seed):
+    rnd = random.Random(seed)
+    width, height = rnd.randrange(5, 45), rnd.randrange(5, 45)
+    blocked_share = rnd.choice((0, 0.1, 0.25, 0.4))
+    costs = [-1 if rnd.random() < blocked_share else rnd.randrange(1, 6) for _ in range(width * height)]
+    graph = PathGraph(costs, width, height)
+    for _ in range(30):
+        start = (rnd.randrange(width), rnd.randrange(height))
+        end = (rnd.randrange(width), rnd.randrange(height))
+        if costs[start[1] * width + start[0]] < 0:  # robots don't stand in walls
+            continue
+        grid_path = astar(costs, (width, height), start, end)
+        graph_path = graph.find_path(start, end)
+        assert graph_path[0] == start
+        for (x, y), (next_x, next_y) in zip(graph_path, graph_path[1:]):
+            assert abs(next_x - x) + abs(next_y - y) == 1
+            assert costs[next_y * width + next_x] >= 0
+
+        if grid_path[-1] != end:
+            # both lead as close as possible to the unreachable end
+            assert distance(graph_path[-1], end) == distance(grid_path[-1], end)
+            continue
+        assert graph_path[-1] == end
+        # hierarchical paths are close to the cheapest one, but not always the same
+        optimal_cost = path_cost(costs, width, grid_path)
+        assert optimal_cost <= path_cost(costs, width, graph_path) <= 1.5 * optimal_cost
+
+
+def test_outside_start():
+    assert PathGraph([1] * 100, 10, 10).find_path((-1, 3), (5, 5)) == [(-1, 3)]
@@ -0,0 +1,66 @@
+import random
+
+from heapq import heappush, heappop
+
+import pytest
+
+from robot_AI import astar
+
+
+def dijkstra_cost(costs, width, height, start, end):
+    """Cost of the cheapest path from start to end, or None if end can't be reached."""
+    distances = {start: 0}
+    heap = [(0, start)]
+    while heap:
+        distance, (x, y) = heappop(heap)
+        if (x, y) == end:
+            return distance
+        if distance > distances[(x, y)]:
+            continue
+        for neighbor_x, neighbor_y in ((x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)):
+            if not (0 <= neighbor_x < width and 0 <= neighbor_y < height):
+                continue
+            cost = costs[neighbor_y * width + neighbor_x]
+            if cost < 0:
+                continue
+            neighbor_distance = distance + cost
+            if neighbor_distance < distances.get((neighbor_x, neighbor_y), neighbor_distance + 1):
+                distances[(neighbor_x, neighbor_y)] = neighbor_distance
+                heappush(heap, (neighbor_distance, (neighbor_x, neighbor_y)))
+    return None
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_astar_finds_cheapest_path(seed):
+    rnd = random.Random(seed)
+    width, height = rnd.randrange(5, 45), rnd.randrange(5, 45)
+    blocked_share = rnd.choice((0, 0.1, 0.25, 0.4))
+    costs = [-1 if rnd.random() < blocked_share else rnd.randrange(1, 6) for _ in range(width * height)]
+    for _ in range(30):
+        start = (rnd.randrange(width), rnd.randrange(height))
+        end = (rnd.randrange(width), rnd.randrange(height))
+        path = astar(costs, (width, height), start, end)
+        assert path[0] == start
+        for (x, y), (next_x, next_y) in zip(path, path[1:]):
+            assert abs(next_x - x) + abs(next_y - y) == 1
+            assert costs[next_y * width + next_x] >= 0
+
+        optimal_cost = dijkstra_cost(costs, width, height, start, end)
+        if optimal_cost is not None:
+            assert path[-1] == end
+            assert sum(costs[y * width + x] for x, y in path[1:]) == optimal_cost
+        else:
+            assert path[-1] != end
+
+
+def test_astar_reuses_search_arena():
+    # the per tile arrays are reused between searches, earlier ones mustn't leak into later ones
+    costs = [1] * 100
+    assert len(astar(costs, (10, 10), (0, 0), (9, 9))) == 19
+    costs[5 * 10 + 4] = -1
+    path = astar(costs, (10, 10), (4, 0), (4, 9))
+    assert (4, 5) not in path and len(path) == 12
+
+
+def test_outside_start():
+    assert astar([1] * 100, (10, 10), (-1, 3), (5, 5)) == [(-1, 3)]
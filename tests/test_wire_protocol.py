@@ -0,0 +1,206 @@
+import math
+import random
+import struct
+
+import pytest
+
+from networking import StatePacket, ClientPacket, encode_packet, decode_packet
+from wire_protocol import SnapshotHistory, build_snapshot, pack_fields, unpack_fields
+from robot import RobotInfo, PlayerInput
+from weapons import BulletInfo
+from transform import SimBody, SimpleBody
+
+ROBOT_BODY_FIELDS = ("position", "rotation", "ang_velocity", "ang_accel", "velocity", "local_velocity", "accel",
+                     "local_accel", "max_velocity", "max_ang_velocity", "max_accel", "max_ang_accel")
+ROBOT_FIELDS = ("player_id", "next_bullet_id", "health", "weapon_class_id", "last_shot_frame", "player_name",
+                "last_position", "effects", "effect_data", "kills", "is_dead", "last_death_frame")
+INPUT_FIELDS = ("up", "down", "left", "right", "shoot", "shoot_pressed", "turret_rot")
+BULLET_BODY_FIELDS = ("position", "rotation", "local_velocity")
+BULLET_FIELDS = ("source_id", "bullet_id", "bullet_class_id", "creation_frame")
+
+
+def random_double(rnd):
+    """Values like in the game: zero, floats (e.g. positions from Box2D) & full doubles."""
+    kind = rnd.randrange(4)
+    if kind == 0:
+        return 0.0
+    if kind == 1:
+        return struct.unpack("<f", struct.pack("<f", rnd.uniform(-5000, 5000)))[0]
+    return rnd.uniform(-5000, 5000)
+
+
+def random_vector(rnd):
+    return random_double(rnd), random_double(rnd)
+
+
+def random_input(rnd):
+    player_input = PlayerInput()
+    for name in INPUT_FIELDS[:-1]:
+        setattr(player_input, name, rnd.random() < 0.5)
+    player_input.turret_rot = random_double(rnd)
+    return player_input
+
+
+def random_robot(rnd, player_id):
+    info = RobotInfo()
+    body = SimBody()
+    for name in ROBOT_BODY_FIELDS:
+        is_vector = name in ("position", "velocity", "local_velocity", "accel", "local_accel")
+        setattr(body, name, random_vector(rnd) if is_vector else random_double(rnd))
+    info.robot_body = body
+    info.player_id = player_id
+    info.next_bullet_id = rnd.randrange(1000)
+    info.health = random_double(rnd)
+    info.weapon_class_id = rnd.randrange(4)
+    info.last_shot_frame = rnd.randrange(-1, 10000)
+    info.player_name = rnd.choice(("", "Player", "Spieler Ä"))
+    info.last_position = random_vector(rnd)
+    info.effects = [[1, random_double(rnd), random_double(rnd)]] if rnd.random() < 0.5 else []
+    info.effect_data = {("PortalTileEffect", "last_tp_frame"): 12.0} if rnd.random() < 0.5 else {}
+    info.input = random_input(rnd)
+    info.kills = rnd.randrange(100)
+    info.is_dead = rnd.random() < 0.2
+    info.last_death_frame = rnd.randrange(10000)
+    return info
+
+
+def random_bullet(rnd, source_id, bullet_id):
+    info = BulletInfo()
+    info.source_id = source_id
+    info.bullet_id = bullet_id
+    info.bullet_class_id = rnd.randrange(4)
+    info.creation_frame = rnd.randrange(10000)
+    body = SimpleBody()
+    body.position = random_vector(rnd)
+    body.rotation = random_double(rnd)
+    body.local_velocity = random_vector(rnd)
+    info.bullet_body = body
+    return info
+
+
+def get_values(info, fields, body, body_fields):
+    values = {name: getattr(info, name) for name in fields}
+    values.update({"body." + name: tuple(getattr(body, name)) if isinstance(getattr(body, name), (tuple, list))
+                   else getattr(body, name) for name in body_fields})
+    return values
+
+
+def robot_values(info):
+    values = get_values(info, ROBOT_FIELDS, info.robot_body, ROBOT_BODY_FIELDS)
+    values.update({"input." + name: getattr(info.input, name) for name in INPUT_FIELDS})
+    values["effects"] = [list(effect) for effect in info.effects]
+    return values
+
+
+def bullet_values(info):
+    return get_values(info, BULLET_FIELDS, info.bullet_body, BULLET_BODY_FIELDS)
+
+
+def assert_same_state(packet, robots, bullets):
+    assert [robot_values(info) for info in packet.robots] == [robot_values(info) for info in robots]
+    assert [bullet_values(info) for info in packet.bullets] == [bullet_values(info) for info in bullets]
+
+
+def state_packet(physics_frame, robots, bullets, snapshot, baseline=None):
+    packet = StatePacket(creation_time=physics_frame * 10, world_start_time=5, physics_frame=physics_frame,
+                         player_id=1, robots=robots, bullets=bullets)
+    packet.snapshot = snapshot
+    packet.baseline = baseline
+    return packet
+
+
+def test_full_state_round_trip():
+    rnd = random.Random(1)
+    robots = [random_robot(rnd, i) for i in range(8)]
+    bullets = [random_bullet(rnd, i % 8, i) for i in range(20)]
+    packet = StatePacket(creation_time=123, world_start_time=99, physics_frame=1000, player_id=4,
+                         robots=robots, bullets=bullets, scores=[("Player", 3), ("Ä", 0)])
+    packet.power_ups = bytes([1, 2, 3])  # compressed power-ups
+    packet.client_rtt_start = 77
+    packet.input_ack_frame = 998
+
+    decoded = decode_packet(encode_packet(packet))
+    assert (decoded.creation_time, decoded.world_start_time, decoded.client_rtt_start, decoded.physics_frame,
+            decoded.player_id, decoded.input_ack_frame) == (123, 99, 77, 1000, 4, 998)
+    assert decoded.power_ups == packet.power_ups
+    assert decoded.scores == packet.scores
+    assert_same_state(decoded, robots, bullets)
+
+
+def test_delta_state_round_trip():
+    rnd = random.Random(2)
+    client_history = SnapshotHistory()
+    robots = [random_robot(rnd, i) for i in range(8)]
+    bullets = [random_bullet(rnd, i % 8, i) for i in range(20)]
+    baseline = build_snapshot(100, robots, bullets, None)
+    assert decode_packet(encode_packet(state_packet(100, robots, bullets, baseline)), client_history) is not None
+
+    for frame in range(101, 131):
+        for info in robots:
+            if rnd.random() < 0.5:  # moved
+                info.robot_body.position = random_vector(rnd)
+                info.robot_body.rotation = random_double(rnd)
+            if rnd.random() < 0.1:
+                info.health = random_double(rnd)
+                info.input = random_input(rnd)
+            if rnd.random() < 0.05:
+                info.player_name = "Renamed " + str(frame)
+        for info in bullets:
+            info.bullet_body.position = random_vector(rnd)
+        if rnd.random() < 0.3:  # left & joined
+            robots.pop(rnd.randrange(len(robots)))
+            robots.append(random_robot(rnd, 100 + frame))
+        bullets = [info for info in bullets if rnd.random() < 0.9] + [random_bullet(rnd, 1, 1000 + frame)]
+
+        snapshot = build_snapshot(frame, robots, bullets, None)
+        message = encode_packet(state_packet(frame, robots, bullets, snapshot, baseline))
+        decoded = decode_packet(message, client_history)
+        assert decoded.physics_frame == frame
+        assert_same_state(decoded, robots, bullets)
+        assert len(message) < len(encode_packet(state_packet(frame, robots, bullets, snapshot)))
+        if rnd.random() < 0.5:  # client acknowledged the frame
+            baseline = snapshot
+
+
+def test_delta_with_unknown_baseline():
+    rnd = random.Random(3)
+    robots = [random_robot(rnd, i) for i in range(2)]
+    baseline = build_snapshot(10, robots, [], None)
+    message = encode_packet(state_packet(11, robots, [], build_snapshot(11, robots, [], None), baseline))
+    assert decode_packet(message, SnapshotHistory()) is None
+    assert decode_packet(message) is None
+
+
+def test_truncated_packets():
+    rnd = random.Random(4)
+    robots = [random_robot(rnd, i) for i in range(2)]
+    message = encode_packet(state_packet(10, robots, [random_bullet(rnd, 0, 0)], None))
+    for length in range(len(message)):
+        assert decode_packet(message[:length]) is None
+
+
+@pytest.mark.parametrize("count", (1, 4, 5, 19))
+def test_fields_round_trip(count):
+    rnd = random.Random(count)
+    special = (0.0, -0.0, math.inf, -math.inf, 1e-310, 1e-40, 3.4e38, 1e39, 2.0 ** -126, 0.1, 1.5)
+    for _ in range(500):
+        values = [rnd.choice(special) if rnd.random() < 0.3 else random_double(rnd) for _ in range(count)]
+        reference = [value if rnd.random() < 0.3 else random_double(rnd) for value in values]
+        group = struct.pack("<" + str(count) + "d", *values)
+        reference_group = struct.pack("<" + str(count) + "d", *reference)
+        packed = b"\x01" + pack_fields(group, reference_group)
+        assert unpack_fields(packed, 1, reference_group) == (group, len(packed))
+
+    nan_group = struct.pack("<" + str(count) + "d", *([math.nan] * count))
+    assert unpack_fields(pack_fields(nan_group, bytes(len(nan_group))), 0, bytes(len(nan_group)))[0] == nan_group
+
+
+def test_client_packet_round_trip():
+    rnd = random.Random(5)
+    inputs = [(frame, random_input(rnd)) for frame in range(40, 50)]
+    packet = ClientPacket(creation_time=7, inputs=inputs, player_name="Spieler Ä", disconnect=True, ack_frame=39)
+    decoded = decode_packet(encode_packet(packet))
+    assert (decoded.creation_time, decoded.player_name, decoded.disconnect, decoded.ack_frame) == \
+           (7, "Spieler Ä", True, 39)
+    assert [(frame, [getattr(player_input, name) for name in INPUT_FIELDS]) for frame, player_input in decoded.inputs] \
+        == [(frame, [getattr(player_input, name) for name in INPUT_FIELDS]) for frame, player_input in inputs]